@@ -1,10 +1,7 @@
+from argparse import ArgumentParser
 from multiprocessing import cpu_count
 from pathlib import Path
 import shutil
-import sys
-
-from bgpy.enums import ASGroups, SpecialPercentAdoptions
-from bgpy.simulation_framework import ScenarioConfig, Simulation
 
 from .policies import (
     GuardValid24,
@@ -17,115 +14,137 @@ from .policies import (
 )
 from .tor_relay_collector import TORRelayCollector, print_relay_stats
 from .scenarios import (
+    ClientsToGuardExitToDestScenario,
     ClientsToGuardScenario,
     ExitToDestScenario,
 )
-from .utils import get_us_country_asns, get_real_world_rov_asn_cls_dict
-
-
-def main():
-    relays = TORRelayCollector().run()
-    print_relay_stats(relays)
-
-    rov_dict = get_real_world_rov_asn_cls_dict()
+from .simulation_framework import (
+    Attackers,
+    Experiment,
+    ExperimentRunner,
+    load_experiments,
+)
 
-    us_asns = get_us_country_asns()
+GUARD_CLASSES = (GuardValid24, GuardValidNot24, GuardNotValid24, GuardNotValidNot24)
+DEST_CLASSES = (Dest24, DestValidNot24, DestNotValidNot24)
 
-    BASE_PATH = Path.home() / "Desktop" / "tor"
+# The experiments for the paper, when no spec is given
+DEFAULT_EXPERIMENTS: tuple[Experiment, ...] = (
+    Experiment(
+        name="client_to_guard_single_attacker",
+        ScenarioCls=ClientsToGuardScenario,
+        AdoptPolicyClasses=GUARD_CLASSES,
+    ),
+    Experiment(
+        name="client_to_guard_us",
+        ScenarioCls=ClientsToGuardScenario,
+        AdoptPolicyClasses=GUARD_CLASSES,
+        attackers=Attackers.US,
+        enabled=False,
+    ),
+    Experiment(
+        name="exit_to_dest_mh",
+        ScenarioCls=ExitToDestScenario,
+        AdoptPolicyClasses=DEST_CLASSES,
+        attackers=Attackers.MULTIHOMED,
+        propagation_rounds=2,
+    ),
+    Experiment(
+        name="exit_to_dest_us",
+        ScenarioCls=ExitToDestScenario,
+        AdoptPolicyClasses=DEST_CLASSES,
+        attackers=Attackers.US,
+        propagation_rounds=2,
+        enabled=False,
+    ),
+    # Both legs at once, for the joint outcomes
+    Experiment(
+        name="client_to_guard_exit_to_dest_mh",
+        ScenarioCls=ClientsToGuardExitToDestScenario,
+        AdoptPolicyClasses=GUARD_CLASSES,
+        attackers=Attackers.MULTIHOMED,
+        propagation_rounds=2,
+    ),
+)
 
-    default_kwargs = {
-        "python_hash_seed": 0,
-        "percent_adoptions": (
-            SpecialPercentAdoptions.ONLY_ONE,
-            0.1,
-            0.3,
-            0.5,
-            0.8,
-            0.99,
-        ),
-        "num_trials": 100 if "quick" in str(sys.argv) else 500,
-        "parse_cpus": cpu_count(),
-    }
-    guard_classes = (GuardValid24, GuardValidNot24, GuardNotValid24, GuardNotValidNot24)
-    dest_classes = (Dest24, DestValidNot24, DestNotValidNot24)
 
-    sim = Simulation(
-        scenario_configs=tuple(
-            [
-                ScenarioConfig(
-                    ScenarioCls=ClientsToGuardScenario,
-                    AdoptPolicyCls=AdoptPolicyCls,
-                    hardcoded_asn_cls_dict=rov_dict,
-                )
-                for AdoptPolicyCls in guard_classes
-            ]
-        ),
-        output_dir=BASE_PATH / "client_to_guard_single_attacker",
-        **default_kwargs,  # type: ignore
+def main():
+    parser = ArgumentParser(description="Runs the TOR BGP simulations")
+    parser.add_argument(
+        "--spec",
+        type=Path,
+        help="TOML or JSON experiment spec (see load_experiments)",
     )
-    sim.run()
-
-    """
-    sim = Simulation(
-        scenario_configs=tuple(
-            [
-                ScenarioConfig(
-                    ScenarioCls=ClientsToGuardScenario,
-                    AdoptPolicyCls=AdoptPolicyCls,
-                    hardcoded_asn_cls_dict=rov_dict,
-                    override_attacker_asns=us_asns,
-                    num_attackers=len(us_asns),
-                )
-                for AdoptPolicyCls in guard_classes
-            ]
+    parser.add_argument(
+        "--experiments",
+        nargs="+",
+        help="Names of the experiments to run (defaults to the enabled ones)",
+    )
+    parser.add_argument("--output-dir", type=Path, default=Path.home() / "Desktop")
+    parser.add_argument("--parse-cpus", type=int, default=cpu_count())
+    parser.add_argument("--quick", action="store_true", help="Runs 100 trials")
+    parser.add_argument(
+        "--target-yerr",
+        type=float,
+        help=(
+            "Stops each percent adoption once the 90%% confidence interval of "
+            "the attacker success is at most this wide (in percentage points), "
+            "so the number of trials is only the most to run"
         ),
-        output_dir=BASE_PATH / "client_to_guard_us",
-        **default_kwargs,  # type: ignore
     )
-    sim.run()
-    """
-
-    sim = Simulation(
-        scenario_configs=tuple(
-            [
-                ScenarioConfig(
-                    ScenarioCls=ExitToDestScenario,
-                    AdoptPolicyCls=AdoptPolicyCls,
-                    hardcoded_asn_cls_dict=rov_dict,
-                    attacker_subcategory_attr=ASGroups.MULTIHOMED.value,
-                    propagation_rounds=2,
-                )
-                for AdoptPolicyCls in dest_classes
-            ]
+    parser.add_argument(
+        "--shard",
+        choices=("plan", "work", "merge"),
+        help=(
+            "Splits the run between hosts that share --output-dir: plan writes "
+            "the shard plan, work runs chunks of it (on any number of hosts), "
+            "and merge writes the data and graphs once they're all done"
         ),
-        output_dir=BASE_PATH / "exit_to_dest_mh",
-        **default_kwargs,  # type: ignore
     )
-    sim.run()
+    args = parser.parse_args()
 
-    """
-    sim = Simulation(
-        scenario_configs=tuple(
-            [
-                ScenarioConfig(
-                    ScenarioCls=ExitToDestScenario,
-                    AdoptPolicyCls=AdoptPolicyCls,
-                    hardcoded_asn_cls_dict=rov_dict,
-                    attacker_subcategory_attr=ASGroups.MULTIHOMED.value,
-                    override_attacker_asns=us_asns,
-                    num_attackers=len(us_asns),
-                    propagation_rounds=2,
-                )
-                for AdoptPolicyCls in dest_classes
-            ]
-        ),
-        output_dir=BASE_PATH / "exit_to_dest_us",
-        **default_kwargs,  # type: ignore
+    BASE_PATH = args.output_dir / "tor"
+
+    if args.shard in ("work", "merge"):
+        runner = ExperimentRunner.from_shard_plan(BASE_PATH, parse_cpus=args.parse_cpus)
+        if args.shard == "work":
+            runner.run_shard_worker()
+        else:
+            runner.merge()
+            _archive(BASE_PATH)
+        return
+
+    experiments = load_experiments(args.spec) if args.spec else DEFAULT_EXPERIMENTS
+    if args.experiments:
+        experiment_dict = {x.name: x for x in experiments}
+        for name in args.experiments:
+            if name not in experiment_dict:
+                parser.error(f"No experiment {name}, only {list(experiment_dict)}")
+        experiments = tuple(experiment_dict[x] for x in args.experiments)
+    else:
+        experiments = tuple(x for x in experiments if x.enabled)
+
+    relays = TORRelayCollector().run()
+    print_relay_stats(relays)
+
+    runner = ExperimentRunner(
+        experiments,
+        BASE_PATH,
+        num_trials=100 if args.quick else 500,
+        parse_cpus=args.parse_cpus,
+        target_yerr=args.target_yerr,
+        # So that every worker uses these relays
+        relay_snapshot=relays,
     )
-    sim.run()
-    """
+    if args.shard == "plan":
+        runner.write_shard_plan()
+        return
+    runner.run()
+    _archive(BASE_PATH)
+
 
-    shutil.make_archive(str(BASE_PATH.parent / "tor.zip"), "zip", str(BASE_PATH))
+def _archive(base_path: Path) -> None:
+    shutil.make_archive(str(base_path.parent / "tor.zip"), "zip", str(base_path))
 
 
 if __name__ == "__main__":
@@ -1,7 +1,15 @@
+from .batched_clients_to_guard_scenario import BatchedClientsToGuardScenario
+from .clients_to_guard_exit_to_dest_scenario import ClientsToGuardExitToDestScenario
 from .clients_to_guard_scenario import ClientsToGuardScenario
 from .exit_to_dest_scenario import ExitToDestScenario
+from .tor_scenario import pin_relay_snapshot, RelayWeighting, TORScenario
 
 __all__ = [
+    "BatchedClientsToGuardScenario",
+    "ClientsToGuardExitToDestScenario",
     "ClientsToGuardScenario",
     "ExitToDestScenario",
+    "pin_relay_snapshot",
+    "RelayWeighting",
+    "TORScenario",
 ]
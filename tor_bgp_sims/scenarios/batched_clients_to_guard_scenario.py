@@ -0,0 +1,185 @@
+import copy
+from ipaddress import ip_network, IPv4Network
+import random
+from typing import Hashable, Optional
+
+from bgpy.simulation_engine import Announcement as Ann
+from bgpy.simulation_engine import Policy
+
+from ..tor_relay_collector import AliasTable, Relay
+from .clients_to_guard_scenario import ClientsToGuardScenario
+from .tor_scenario import RelayWeighting, TORScenario
+
+# Relays grouped by origin, and alias tables of their weights for each origin,
+# for each scenario class and AdoptPolicyCls
+_origin_relays: dict[
+    tuple[type["BatchedClientsToGuardScenario"], type[Policy]],
+    tuple[tuple[Relay, ...], dict[int, tuple[Relay, ...]], dict[int, AliasTable]],
+] = dict()
+
+
+class BatchedClientsToGuardScenario(ClientsToGuardScenario):
+    """ClientsToGuardScenario that propagates many relays in one engine run
+
+    Announcements for unrelated prefixes propagate independently, so each of
+    the relays_per_run relays gets its own prefixes, and a single propagation
+    gives the RIBs for all of them. TORSimulation then analyzes and tracks
+    metrics for each relay on its own (see _get_relay_scenarios), so every
+    relay counts as a trial.
+
+    Every relay in a run has the same origin, so the run has the one victim
+    that a ClientsToGuardScenario for any of them would. That way, no AS
+    adopts because of the batch, and each relay's outcomes are the same as
+    its own run's with the same attackers and adopters. The first relay is
+    picked as usual, and the rest from its origin's relays (see
+    get_random_origin_tor_relay), so each relay is as likely to be in a run
+    as it is to be picked for a ClientsToGuardScenario.
+
+    The announcements only depend on the relay's origin, ROA validity, and
+    whether its prefix is shorter than /24 (see relay_class_key), so relays
+    with the same key share announcements, and the i-th key announces the
+    i-th /23 of the IPv4 space (or the first /24 of it) in place of its
+    relays' prefix. That way relays in the same prefix don't collide.
+
+    The relays in a run share the origin, attackers and adopters, so their
+    results aren't independent. This requires TORSimulation
+    """
+
+    relays_per_run: int = 32
+
+    def __init__(  # type: ignore
+        self, *args, tor_relays: Optional[tuple[Relay, ...]] = None, **kwargs
+    ) -> None:
+        """Picks the relays for the run
+
+        tor_relays overrides the random selection, and must share an origin.
+        So does tor_relay, which runs just that relay (ex: to simulate each
+        relay equivalence class)
+        """
+
+        AdoptPolicyCls = kwargs["scenario_config"].AdoptPolicyCls
+        prev_scenario = kwargs.get("prev_scenario")
+        if tor_relays is None and kwargs.get("tor_relay") is not None:
+            tor_relays = (kwargs["tor_relay"],)
+        if (
+            tor_relays is None
+            and isinstance(prev_scenario, BatchedClientsToGuardScenario)
+            and prev_scenario.get_tor_relays(
+                prev_scenario.scenario_config.AdoptPolicyCls
+            )
+            is self.get_tor_relays(AdoptPolicyCls)
+        ):
+            # Reuse the relays from the last scenario, the same as TORScenario
+            tor_relays = prev_scenario.tor_relays
+        if tor_relays is None:
+            first_relay = self.get_random_tor_relay(AdoptPolicyCls)
+            tor_relays = (first_relay,) + tuple(
+                self.get_random_origin_tor_relay(
+                    AdoptPolicyCls, first_relay.ipv4_origin
+                )
+                for _ in range(self.relays_per_run - 1)
+            )
+        assert (
+            len({x.ipv4_origin for x in tor_relays}) == 1
+        ), "Batched relays must share an origin, or their origins all adopt"
+        self.tor_relays: tuple[Relay, ...] = tor_relays
+        self._relay_scenarios: Optional[tuple[TORScenario, ...]] = None
+        kwargs["tor_relay"] = tor_relays[0]
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def get_random_origin_tor_relay(
+        cls, AdoptPolicyCls: type[Policy], origin_asn: int
+    ) -> Relay:
+        """Returns a relay of the origin for the AdoptPolicyCls, using relay_weighting
+
+        Picking an origin's relays like this, after picking the origin with
+        get_random_tor_relay, picks each relay as often as get_random_tor_relay
+        """
+
+        relays = cls.get_tor_relays(AdoptPolicyCls)
+        key = (cls, AdoptPolicyCls)
+        # Cached along with the relays they're for, in case those change
+        if key not in _origin_relays or _origin_relays[key][0] is not relays:
+            grouped_relays: dict[int, list[Relay]] = dict()
+            for relay in relays:
+                grouped_relays.setdefault(relay.ipv4_origin, list()).append(relay)
+            _origin_relays[key] = (
+                relays,
+                {k: tuple(v) for k, v in grouped_relays.items()},
+                dict(),
+            )
+        _, origin_relays_dict, alias_tables = _origin_relays[key]
+        origin_relays = origin_relays_dict[origin_asn]
+        if cls.relay_weighting == RelayWeighting.UNIFORM:
+            return random.choice(origin_relays)
+        if origin_asn not in alias_tables:
+            relay_position = cls.get_relay_position(AdoptPolicyCls)
+            alias_tables[origin_asn] = AliasTable(
+                [cls.get_relay_weight(x, relay_position) for x in origin_relays]
+            )
+        return origin_relays[alias_tables[origin_asn].sample()]
+
+    def _get_class_relays(self) -> dict[Hashable, Relay]:
+        """Returns the first relay with each relay_class_key, in the run's order"""
+
+        class_relays: dict[Hashable, Relay] = dict()
+        for tor_relay in self.tor_relays:
+            class_relays.setdefault(self.relay_class_key(tor_relay), tor_relay)
+        return class_relays
+
+    def _get_announcements(self, *args, **kwargs) -> tuple["Ann", ...]:
+        """Returns each relay_class_key's announcements, each within its own /23"""
+
+        anns: list["Ann"] = list()
+        for i, tor_relay in enumerate(self._get_class_relays().values()):
+            anns.extend(
+                self._get_relay_announcements(
+                    tor_relay, get_batched_prefix(i, tor_relay)
+                )
+            )
+        return tuple(anns)
+
+    def _get_relay_scenarios(self) -> tuple[TORScenario, ...]:
+        """Returns a copy of this scenario with only the relay, per relay
+
+        These have the same announcements as a ClientsToGuardScenario for
+        the relay would. Relays with the same relay_class_key share a copy
+        """
+
+        if self._relay_scenarios is not None:
+            return self._relay_scenarios
+
+        # The announcements for the i-th key are all within the i-th /23
+        class_relays = self._get_class_relays()
+        class_anns: list[list["Ann"]] = [list() for _ in class_relays]
+        for ann in self.announcements:
+            class_anns[int(ip_network(ann.prefix).network_address) >> 9].append(ann)
+
+        class_scenarios: dict[Hashable, TORScenario] = dict()
+        for (relay_class_key, tor_relay), anns in zip(class_relays.items(), class_anns):
+            relay_scenario = copy.copy(self)
+            relay_scenario.tor_relay = tor_relay
+            relay_scenario.tor_relays = (tor_relay,)
+            relay_scenario.announcements = tuple(anns)
+            relay_scenario.ordered_prefix_subprefix_dict = (
+                relay_scenario._get_ordered_prefix_subprefix_dict()
+            )
+            relay_scenario._cached_round_dict = dict()
+            relay_scenario._relay_scenarios = (relay_scenario,)
+            class_scenarios[relay_class_key] = relay_scenario
+        self._relay_scenarios = tuple(
+            class_scenarios[self.relay_class_key(x)] for x in self.tor_relays
+        )
+        return self._relay_scenarios
+
+
+def get_batched_prefix(index: int, tor_relay: Relay) -> IPv4Network:
+    """Returns the prefix that the index-th relay class of a batch announces
+
+    This is the index-th /23 of the IPv4 space, or the first /24 of it if
+    the relay's prefix isn't shorter than /24
+    """
+
+    prefixlen = 23 if tor_relay.ipv4_prefix.prefixlen < 24 else 24
+    return IPv4Network((index << 9, prefixlen))
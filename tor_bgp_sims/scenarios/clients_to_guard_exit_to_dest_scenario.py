@@ -0,0 +1,219 @@
+import copy
+from ipaddress import ip_network, IPv4Network
+import random
+from typing import Hashable, Literal, Optional
+
+from frozendict import frozendict
+
+from bgpy.simulation_engine import BaseSimulationEngine, Announcement as Ann, Policy
+from bgpy.simulation_framework import Scenario
+
+from ..policies import (
+    GuardValid24,
+    GuardValidNot24,
+    GuardNotValid24,
+    GuardNotValidNot24,
+    Dest24,
+    DestValidNot24,
+    DestNotValidNot24,
+)
+from ..tor_relay_collector import Relay
+from .batched_clients_to_guard_scenario import get_batched_prefix
+from .clients_to_guard_scenario import ClientsToGuardScenario
+from .exit_to_dest_scenario import ExitToDestScenario
+
+# The destination's policy class for each guard policy class
+DEST_POLICY_CLASSES: frozendict[type[Policy], type[Policy]] = frozendict(
+    {
+        GuardValid24: Dest24,
+        GuardNotValid24: Dest24,
+        GuardValidNot24: DestValidNot24,
+        GuardNotValidNot24: DestNotValidNot24,
+    }
+)
+
+
+class ClientsToGuardExitToDestScenario(ExitToDestScenario, ClientsToGuardScenario):
+    """Attacker attempts to intercept both legs of a circuit at once
+
+    To deanonymize a client, the attacker must intercept the client's
+    traffic to the guard (see ClientsToGuardScenario) and the exit's traffic
+    to the destination (see ExitToDestScenario). Both are simulated in the
+    same trial, with the same attackers and adopters, so that the joint
+    outcome for each client is correct, rather than multiplying the
+    percentages from two separate simulations.
+
+    The AdoptPolicyCls picks the guard relay, and the matching Dest policy
+    class (see DEST_POLICY_CLASSES) picks the exit relay and the
+    destination's prefix. The first round only propagates the destination's
+    prefix, for the leaks (see ExitToDestScenario). The second round seeds
+    the guard's prefix too, so that both legs propagate in one engine run.
+
+    The outcomes are joint (see TORASGraphAnalyzer): a client is only an
+    attacker success if its traffic to the guard is intercepted, and the
+    exit's traffic to the destination is too
+    """
+
+    relay_position = "guard"
+
+    def __init__(self, *args, **kwargs) -> None:  # type: ignore
+        """Picks the exit relay, reusing the last scenario's for comparability"""
+
+        scenario_config = kwargs["scenario_config"]
+        prev_scenario = kwargs.get("prev_scenario")
+        DestPolicyCls = DEST_POLICY_CLASSES[scenario_config.AdoptPolicyCls]
+        if isinstance(prev_scenario, ClientsToGuardExitToDestScenario) and (
+            prev_scenario.get_tor_relays(prev_scenario.dest_policy_cls)
+            is self.get_tor_relays(DestPolicyCls)
+        ):
+            self._exit_tor_relay: Relay = prev_scenario.exit_tor_relay
+        else:
+            self._exit_tor_relay = self.get_random_tor_relay(DestPolicyCls)
+        self._dest_victim_asn: Optional[int] = None
+        self._leg: Optional[Literal["guard", "exit"]] = None
+        self._leg_scenarios: Optional[
+            tuple["ClientsToGuardExitToDestScenario", ...]
+        ] = None
+        super().__init__(*args, **kwargs)
+
+    relay_class_key = staticmethod(ClientsToGuardScenario.relay_class_key)
+
+    @classmethod
+    def get_relay_position(
+        cls, AdoptPolicyCls: type[Policy]
+    ) -> Literal["guard", "exit"]:
+        """The Dest policy classes are for picking the exit"""
+
+        return "exit" if AdoptPolicyCls in DEST_POLICY_CLASSES.values() else "guard"
+
+    @property
+    def exit_tor_relay(self) -> Relay:
+        return self._exit_tor_relay
+
+    @property
+    def dest_policy_cls(self) -> type[Policy]:
+        return DEST_POLICY_CLASSES[self.scenario_config.AdoptPolicyCls]
+
+    @property
+    def _dest_victim_asns(self) -> frozenset[int]:
+        assert self._dest_victim_asn is not None, "Victims aren't picked yet"
+        return frozenset([self._dest_victim_asn])
+
+    def _get_victim_asns(
+        self,
+        override_victim_asns: Optional[frozenset[int]],
+        engine: Optional[BaseSimulationEngine],
+        prev_scenario: Optional["Scenario"],
+    ) -> frozenset[int]:
+        """The guard's origin, and a destination
+
+        The destination is reused from the last scenario for comparability,
+        the same as the attackers
+        """
+
+        guard_asn = self.tor_relay.ipv4_origin
+        if override_victim_asns is not None:
+            # Only for tests
+            dest_victim_asns = override_victim_asns - {guard_asn}
+            [self._dest_victim_asn] = dest_victim_asns or override_victim_asns
+            return override_victim_asns
+        elif isinstance(prev_scenario, ClientsToGuardExitToDestScenario):
+            self._dest_victim_asn = prev_scenario._dest_victim_asn
+        else:
+            assert engine
+            possible_victim_asns = Scenario._get_possible_victim_asns(
+                self, engine, self.percent_adoption, prev_scenario
+            )
+            # https://stackoverflow.com/a/15837796/8903959
+            self._dest_victim_asn = random.choice(
+                tuple(possible_victim_asns - {guard_asn})
+            )
+        assert self._dest_victim_asn is not None, "for mypy"
+        return frozenset([guard_asn, self._dest_victim_asn])
+
+    @property
+    def _tracked_asns(self) -> Optional[frozenset[int]]:
+        """Every client is tracked, and the exit is only traced back from
+
+        The exit leg (see _get_leg_scenarios) only tracks the exit
+        """
+
+        if self._leg == "exit":
+            return frozenset([self.exit_tor_relay.ipv4_origin])
+        return None
+
+    @property
+    def _untracked_asns(self) -> frozenset[int]:
+        """Unlike ExitToDestScenario, every client counts"""
+
+        return self._default_adopters | self._default_non_adopters
+
+    def _get_cached_round_key(self, propagation_round: int) -> Optional[Hashable]:
+        """The guard relay is part of the first round's outcomes, for the joint"""
+
+        key = super()._get_cached_round_key(propagation_round)
+        return None if key is None else (key, self.tor_relay.ipv4_origin)
+
+    def post_propagation_hook(self, *args, **kwargs) -> None:  # type: ignore
+        """Seeds the second round, so the legs must be split again"""
+
+        super().post_propagation_hook(*args, **kwargs)
+        self._leg_scenarios = None
+
+    def _get_second_round_announcements(self) -> tuple["Ann", ...]:
+        """The guard's prefix, and the attackers' hijacks of it"""
+
+        return self._get_relay_announcements(self.tor_relay, self._guard_prefix)
+
+    @property
+    def _guard_prefix(self) -> IPv4Network:
+        """The guard's prefix, or a stand in if it overlaps the destination's
+
+        The guard's announcements only depend on its relay_class_key, so
+        a stand in prefix gives the same results
+        """
+
+        dest_prefixes = [
+            ip_network(x.prefix)
+            for x in self.announcements
+            if x.seed_asn in self._dest_victim_asns
+        ]
+        guard_prefix = self.tor_relay.ipv4_prefix
+        if any(guard_prefix.overlaps(x) for x in dest_prefixes):
+            return get_batched_prefix(0, self.tor_relay)
+        return guard_prefix
+
+    def _get_leg_scenarios(self) -> tuple["ClientsToGuardExitToDestScenario", ...]:
+        """Returns a copy of this scenario for the guard leg, and the exit leg
+
+        Each one only has the victim and announcements for its leg, and
+        has no legs of its own
+        """
+
+        if self._leg_scenarios is not None:
+            return self._leg_scenarios
+
+        dest_prefixes = frozenset(
+            x.prefix for x in self.announcements if x.seed_asn in self._dest_victim_asns
+        )
+        leg_scenarios = list()
+        for leg in ("guard", "exit"):
+            leg_scenario = copy.copy(self)
+            leg_scenario._leg = leg  # type: ignore
+            leg_scenario.victim_asns = (
+                self._dest_victim_asns
+                if leg == "exit"
+                else frozenset([self.tor_relay.ipv4_origin])
+            )
+            leg_scenario.announcements = tuple(
+                x
+                for x in self.announcements
+                if (x.prefix in dest_prefixes) == (leg == "exit")
+            )
+            leg_scenario.ordered_prefix_subprefix_dict = (
+                leg_scenario._get_ordered_prefix_subprefix_dict()
+            )
+            leg_scenario._leg_scenarios = ()
+            leg_scenarios.append(leg_scenario)
+        self._leg_scenarios = tuple(leg_scenarios)
+        return self._leg_scenarios
@@ -1,4 +1,5 @@
-from typing import Optional
+from ipaddress import IPv4Network
+from typing import Hashable, Optional
 
 from bgpy.enums import Timestamps, Relationships
 from bgpy.simulation_engine import BaseSimulationEngine, Announcement as Ann
@@ -6,6 +7,7 @@ from bgpy.simulation_framework import Scenario
 
 from roa_checker import ROAValidity
 
+from ..tor_relay_collector import Relay
 from .tor_scenario import TORScenario
 
 
@@ -34,6 +36,16 @@ class ClientsToGuardScenario(TORScenario):
             override_victim_asns=override_victim_asns, engine=engine, prev_scenario=None
         )
 
+    @staticmethod
+    def relay_class_key(relay: Relay) -> Hashable:
+        """The announcements only depend on these, not the exact prefix"""
+
+        return (
+            relay.ipv4_origin,
+            relay.ipv4_prefix.prefixlen < 24,
+            ROAValidity.is_valid(relay.ipv4_roa_validity),
+        )
+
     def _get_possible_victim_asns(self, *args, **kwargs) -> frozenset[int]:
         """Returns possible victim ASNs, defaulted from config"""
 
@@ -58,14 +70,26 @@ class ClientsToGuardScenario(TORScenario):
                 subperfix interception attack guard
         """
 
-        anns = list()
-
         # Victim
         assert self.scenario_config.num_victims == 1, "How is there >1 relay?"
         assert len(self.victim_asns) == 1, "How is there >1 relay?"
         [victim_asn] = self.victim_asns
         assert victim_asn == self.tor_relay.ipv4_origin
-        if ROAValidity.is_valid(self.tor_relay.ipv4_roa_validity):
+        return self._get_relay_announcements(self.tor_relay, self.tor_relay.ipv4_prefix)
+
+    def _get_relay_announcements(
+        self, tor_relay: Relay, relay_prefix: IPv4Network
+    ) -> tuple["Ann", ...]:
+        """Returns the victim and attacker announcements for the relay
+
+        relay_prefix is announced in place of the relay's prefix (see
+        BatchedClientsToGuardScenario)
+        """
+
+        anns = list()
+
+        victim_asn = tor_relay.ipv4_origin
+        if ROAValidity.is_valid(tor_relay.ipv4_roa_validity):
             roa_valid_length = True
             roa_origin = victim_asn
         else:
@@ -75,11 +99,11 @@ class ClientsToGuardScenario(TORScenario):
         # Victim/tor relay's ann
         anns.append(
             self.scenario_config.AnnCls(
-                prefix=str(self.tor_relay.ipv4_prefix),
-                next_hop_asn=self.tor_relay.ipv4_origin,
-                as_path=(self.tor_relay.ipv4_origin,),
+                prefix=str(relay_prefix),
+                next_hop_asn=tor_relay.ipv4_origin,
+                as_path=(tor_relay.ipv4_origin,),
                 timestamp=Timestamps.VICTIM.value,
-                seed_asn=self.tor_relay.ipv4_origin,
+                seed_asn=tor_relay.ipv4_origin,
                 roa_valid_length=roa_valid_length,
                 roa_origin=roa_origin,
                 recv_relationship=Relationships.ORIGIN,
@@ -88,70 +112,58 @@ class ClientsToGuardScenario(TORScenario):
 
         # If victim is in attacker asns, that's an auto-win for attacker
         # so don't waste the compution time by adding lots of anns
-        if victim_asn not in self.attacker_asns:
-            for attacker_asn in self.attacker_asns:
-                # Covered by a ROA
-                if roa_valid_length is not None:
-                    # origin prefix hijack
-                    anns.append(
-                        self.scenario_config.AnnCls(
-                            prefix=str(self.tor_relay.ipv4_prefix),
-                            next_hop_asn=attacker_asn,
-                            as_path=(attacker_asn, victim_asn),
-                            timestamp=Timestamps.ATTACKER.value,
-                            seed_asn=attacker_asn,
-                            roa_valid_length=True,
-                            roa_origin=victim_asn,
-                            recv_relationship=Relationships.ORIGIN,
-                        )
-                    )
-                    if self.tor_relay.ipv4_prefix.prefixlen < 24:
-                        # Also a subprefix hijack for non-ROV nodes
-                        prefix = str(self.tor_relay.ipv4_prefix)
-                        plen = self.tor_relay.ipv4_prefix.prefixlen
-                        prefix = prefix.replace(f"/{plen}", f"/{plen + 1}")
-                        anns.append(
-                            self.scenario_config.AnnCls(
-                                prefix=prefix,
-                                next_hop_asn=attacker_asn,
-                                as_path=(attacker_asn,),
-                                timestamp=Timestamps.ATTACKER.value,
-                                seed_asn=attacker_asn,
-                                roa_valid_length=False,
-                                roa_origin=victim_asn,
-                                recv_relationship=Relationships.ORIGIN,
-                            )
-                        )
-                # Not covered by a ROA
-                else:
-                    # prefix hijack, unknown by ROA
-                    anns.append(
-                        self.scenario_config.AnnCls(
-                            prefix=str(self.tor_relay.ipv4_prefix),
-                            next_hop_asn=attacker_asn,
-                            as_path=(attacker_asn,),
-                            timestamp=Timestamps.ATTACKER.value,
-                            seed_asn=attacker_asn,
-                            roa_valid_length=None,
-                            roa_origin=None,
-                            recv_relationship=Relationships.ORIGIN,
-                        )
+        if victim_asn in self.attacker_asns:
+            return tuple(anns)
+
+        # Every attacker's anns are the same other than the attacker's ASN,
+        # so everything else is only worked out once, rather than per attacker
+        # (there can be thousands, ex: every US ASN)
+        prefix = str(relay_prefix)
+        subprefix: Optional[str] = None
+        if relay_prefix.prefixlen < 24:
+            plen = relay_prefix.prefixlen
+            subprefix = prefix.replace(f"/{plen}", f"/{plen + 1}")
+        # Covered by a ROA
+        if roa_valid_length is not None:
+            # origin prefix hijack
+            prefix_as_path: tuple[int, ...] = (victim_asn,)
+            prefix_roa_valid_length: Optional[bool] = True
+            # Also a subprefix hijack for non-ROV nodes
+            subprefix_roa_valid_length: Optional[bool] = False
+        # Not covered by a ROA
+        else:
+            # prefix hijack, unknown by ROA
+            prefix_as_path = ()
+            prefix_roa_valid_length = None
+            # Also a subprefix hijack, unknown bu ROA
+            subprefix_roa_valid_length = None
+
+        AnnCls = self.scenario_config.AnnCls
+        timestamp = Timestamps.ATTACKER.value
+        for attacker_asn in self.attacker_asns:
+            anns.append(
+                AnnCls(
+                    prefix=prefix,
+                    next_hop_asn=attacker_asn,
+                    as_path=(attacker_asn, *prefix_as_path),
+                    timestamp=timestamp,
+                    seed_asn=attacker_asn,
+                    roa_valid_length=prefix_roa_valid_length,
+                    roa_origin=roa_origin,
+                    recv_relationship=Relationships.ORIGIN,
+                )
+            )
+            if subprefix is not None:
+                anns.append(
+                    AnnCls(
+                        prefix=subprefix,
+                        next_hop_asn=attacker_asn,
+                        as_path=(attacker_asn,),
+                        timestamp=timestamp,
+                        seed_asn=attacker_asn,
+                        roa_valid_length=subprefix_roa_valid_length,
+                        roa_origin=roa_origin,
+                        recv_relationship=Relationships.ORIGIN,
                     )
-                    if self.tor_relay.ipv4_prefix.prefixlen < 24:
-                        # Also a subprefix hijack, unknown bu ROA
-                        prefix = str(self.tor_relay.ipv4_prefix)
-                        plen = self.tor_relay.ipv4_prefix.prefixlen
-                        prefix = prefix.replace(f"/{plen}", f"/{plen + 1}")
-                        anns.append(
-                            self.scenario_config.AnnCls(
-                                prefix=prefix,
-                                next_hop_asn=attacker_asn,
-                                as_path=(attacker_asn,),
-                                timestamp=Timestamps.ATTACKER.value,
-                                seed_asn=attacker_asn,
-                                roa_valid_length=None,
-                                roa_origin=None,
-                                recv_relationship=Relationships.ORIGIN,
-                            )
-                        )
+                )
         return tuple(anns)
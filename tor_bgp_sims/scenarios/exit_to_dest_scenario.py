@@ -1,9 +1,11 @@
+from typing import Any, ClassVar, Hashable, Literal, Optional
 import warnings
 
 from bgpy.enums import Timestamps, Relationships, SpecialPercentAdoptions
-from bgpy.simulation_engine import BaseSimulationEngine, Announcement as Ann
+from bgpy.simulation_engine import BaseSimulationEngine, Announcement as Ann, Policy
 from bgpy.simulation_framework import AccidentalRouteLeak
 
+from ..tor_relay_collector import Relay
 from .tor_scenario import TORScenario
 from ..policies import Dest24, DestValidNot24, DestNotValidNot24
 
@@ -19,8 +21,12 @@ class ExitToDestScenario(TORScenario):
     """
 
     min_propagation_rounds: int = 2
+    relay_position: ClassVar[Literal["guard", "exit"]] = "exit"
+    # Only propagate towards the attackers and the exit in the first round
+    prune_first_round: bool = True
 
     def __init__(self, *args, **kwargs) -> None:  # type: ignore
+        self._untracked_asns_cache: Optional[frozenset[int]] = None
         super().__init__(*args, **kwargs)
         if (
             self.scenario_config.attacker_subcategory_attr in self.warning_as_groups
@@ -37,19 +43,96 @@ class ExitToDestScenario(TORScenario):
 
     warning_as_groups = AccidentalRouteLeak.warning_as_groups
 
+    @staticmethod
+    def relay_class_key(relay: Relay) -> Hashable:
+        """Only the exit's origin is used, for traceback"""
+
+        return relay.ipv4_origin
+
+    @property
+    def exit_tor_relay(self) -> Relay:
+        """The exit relay, whose connection to the destination is attacked"""
+
+        return self.tor_relay
+
+    @property
+    def dest_policy_cls(self) -> type[Policy]:
+        """The Dest policy class, which decides the destination's prefix"""
+
+        return self.scenario_config.AdoptPolicyCls
+
+    @property
+    def _dest_victim_asns(self) -> frozenset[int]:
+        """The destinations, which announce the prefix the exit connects to"""
+
+        return self.victim_asns
+
+    @property
+    def _tracked_asns(self) -> Optional[frozenset[int]]:
+        """Only the exit is traced back from, since we don't care about others"""
+
+        return frozenset([self.exit_tor_relay.ipv4_origin])
+
     @property
     def _untracked_asns(self) -> frozenset[int]:
         """Anything in this list won't be tracked
 
         Since we only want to traceback from exit and don't care about
-        other nodes, add everything other than exit to here
+        other nodes, add everything other than exit to here. This is only
+        used by analyzers and metric trackers that don't use _tracked_asns,
+        so it's built once per scenario, rather than on every access
         """
 
-        assert self.engine
-        untracked_asns = frozenset(
-            [x.asn for x in self.engine.as_graph if x.asn != self.tor_relay.ipv4_origin]
+        if self._untracked_asns_cache is None:
+            assert self.engine
+            self._untracked_asns_cache = frozenset(
+                self.engine.as_graph.as_dict
+            ) - frozenset([self.exit_tor_relay.ipv4_origin])
+        return self._untracked_asns_cache
+
+    def _get_propagation_target_asns(
+        self, propagation_round: int
+    ) -> Optional[frozenset[int]]:
+        """The first round is only for the attackers' RIBs (and the exit's)
+
+        See post_propagation_hook
+        """
+
+        if propagation_round == 0 and self.prune_first_round:
+            return self.attacker_asns | frozenset([self.exit_tor_relay.ipv4_origin])
+        else:
+            return None
+
+    def _get_cached_round_key(self, propagation_round: int) -> Optional[Hashable]:
+        """The first round can be shared by configs with the same propagation
+
+        ex: DestValidNot24 and DestNotValidNot24 both announce 2.2.0.0/16,
+        which only ROV adopters look at, and they only drop invalid ones.
+        The leaked announcements get their ROA attributes from this
+        scenario, so only whether the announcements are invalid matters
+        """
+
+        if propagation_round != 0:
+            return None
+        return (
+            self.__class__,
+            self.prune_first_round,
+            self.victim_asns,
+            self.attacker_asns,
+            self.exit_tor_relay.ipv4_origin,
+            tuple(
+                (
+                    ann.prefix,
+                    ann.as_path,
+                    ann.seed_asn,
+                    ann.recv_relationship,
+                    ann.timestamp,
+                    ann.invalid_by_roa,
+                )
+                for ann in self.announcements
+            ),
+            self._get_adoption_key(),
         )
-        return untracked_asns
 
     def _get_announcements(self, *args, **kwargs) -> tuple["Ann", ...]:
         """Returns a valid prefix announcement
@@ -59,16 +142,16 @@ class ExitToDestScenario(TORScenario):
         """
 
         anns = list()
-        for victim_asn in self.victim_asns:
-            if self.scenario_config.AdoptPolicyCls == Dest24:
+        for victim_asn in self._dest_victim_asns:
+            if self.dest_policy_cls == Dest24:
                 roa_valid_length = True
                 roa_origin = victim_asn
                 prefix = "2.2.3.0/24"
-            elif self.scenario_config.AdoptPolicyCls == DestValidNot24:
+            elif self.dest_policy_cls == DestValidNot24:
                 roa_valid_length = True
                 roa_origin = victim_asn
                 prefix = "2.2.0.0/16"
-            elif self.scenario_config.AdoptPolicyCls == DestNotValidNot24:
+            elif self.dest_policy_cls == DestNotValidNot24:
                 roa_valid_length = None
                 roa_origin = None
                 prefix = "2.2.0.0/16"
@@ -121,62 +204,84 @@ class ExitToDestScenario(TORScenario):
         Since this simulator treats each propagation round as if it all happens
         at once, this is possible.
 
-        Additionally, you could also do the optimization in the first propagation
-        round to only propagate from ASes that can reach the attacker. But we'll
-        forgo this for now for simplicity.
+        Additionally, in the first propagation round, TORSimulationEngine only
+        propagates from ASes that can reach the attacker (or the exit, for the
+        first round's metrics). See prune_first_round.
 
         NOTE: EXTENSIONS FOR THE TOR PAPER
         if prefix is shorter than /24, add a subprefix interception attack
         """
 
         if propagation_round == 0:
+            # Reused from an earlier config in the trial if the round was cached
+            cached_round = self._get_cached_round(propagation_round)
+            if cached_round and cached_round.local_ribs is not None:
+                local_ribs = cached_round.local_ribs
+            else:
+                local_ribs = {
+                    asn: tuple(engine.as_graph.as_dict[asn].policy._local_rib.values())
+                    for asn in self.attacker_asns
+                }
+                if cached_round:
+                    cached_round.local_ribs = local_ribs
+            # The leaked anns for a prefix are the same other than the path
+            # and the attacker's ASN, so the rest is only worked out once per
+            # prefix rather than per attacker (there can be thousands)
+            leak_kwargs_dict: dict[str, dict[str, Any]] = dict()
+            subprefix_kwargs_dict: dict[str, Optional[dict[str, Any]]] = dict()
+            for victim_ann in self.announcements:
+                prefix = victim_ann.prefix
+                # The cached RIBs may be from a config with other ROAs
+                leak_kwargs_dict[prefix] = {
+                    "roa_origin": victim_ann.roa_origin,
+                    "roa_valid_length": victim_ann.roa_valid_length,
+                    "recv_relationship": Relationships.CUSTOMERS,
+                    "traceback_end": True,
+                    "timestamp": Timestamps.ATTACKER.value,
+                }
+                subprefix_kwargs_dict[prefix] = None
+                prefix_len = int(prefix.split("/")[-1])
+                if prefix_len < 24:
+                    subprefix_kwargs_dict[prefix] = {
+                        **leak_kwargs_dict[prefix],
+                        "prefix": prefix.replace(str(prefix_len), str(prefix_len + 1)),
+                        "roa_valid_length": (
+                            None if victim_ann.roa_valid_length is None else False
+                        ),
+                    }
+
             announcements: list["Ann"] = list(self.announcements)  # type: ignore
+            num_not_leaking = 0
             for attacker_asn in self.attacker_asns:
-                if not engine.as_graph.as_dict[attacker_asn].policy._local_rib:
-                    print("Attacker did not recieve announcement, can't leak. ")
-                for prefix, ann in engine.as_graph.as_dict[
-                    attacker_asn
-                ].policy._local_rib.items():
-                    announcements.append(
-                        ann.copy(
-                            {
-                                "recv_relationship": Relationships.CUSTOMERS,
-                                "seed_asn": attacker_asn,
-                                "traceback_end": True,
-                                "timestamp": Timestamps.ATTACKER.value,
-                            }
-                        )
-                    )
-                    prefix_len = int(prefix.split("/")[-1])
-                    if prefix_len < 24:
-                        if ann.roa_valid_length is not None:
-                            roa_origin = ann.roa_origin
-                            roa_valid_length = False
-                        else:
-                            roa_origin = ann.roa_origin
-                            roa_valid_length = None
-                        announcements.append(
-                            ann.copy(
-                                {
-                                    "prefix": prefix.replace(
-                                        str(prefix_len), str(prefix_len + 1)
-                                    ),
-                                    "roa_origin": roa_origin,
-                                    "roa_valid_length": roa_valid_length,
-                                    "recv_relationship": Relationships.CUSTOMERS,
-                                    "seed_asn": attacker_asn,
-                                    "traceback_end": True,
-                                    "timestamp": Timestamps.ATTACKER.value,
-                                }
-                            )
-                        )
+                if not local_ribs[attacker_asn]:
+                    num_not_leaking += 1
+                # copy() doesn't keep the kwargs, so they're reused for each ann
+                for ann in local_ribs[attacker_asn]:
+                    leak_kwargs = leak_kwargs_dict[ann.prefix]
+                    leak_kwargs["seed_asn"] = attacker_asn
+                    announcements.append(ann.copy(leak_kwargs))
+                    subprefix_kwargs = subprefix_kwargs_dict[ann.prefix]
+                    if subprefix_kwargs is not None:
+                        subprefix_kwargs["seed_asn"] = attacker_asn
+                        announcements.append(ann.copy(subprefix_kwargs))
+            if num_not_leaking:
+                print(
+                    f"{num_not_leaking} attacker(s) did not recieve announcement, "
+                    "can't leak. "
+                )
 
+            announcements.extend(self._get_second_round_announcements())
             self.announcements = tuple(announcements)
-            self.ordered_prefix_subprefix_dict: dict[
-                str, list[str]
-            ] = self._get_ordered_prefix_subprefix_dict()
+            self.ordered_prefix_subprefix_dict: dict[str, list[str]] = (
+                self._get_ordered_prefix_subprefix_dict()
+            )
 
             self.setup_engine(engine)
             engine.ready_to_run_round = 1
         elif propagation_round > 1:
             raise NotImplementedError
+
+    def _get_second_round_announcements(self) -> tuple["Ann", ...]:
+        """Announcements to seed along with the leaks, for the second round"""
+
+        return ()
@@ -1,9 +1,14 @@
+from dataclasses import dataclass
+from enum import Enum
+import os
+from pathlib import Path
 import random
-from typing import Optional, Union
+from typing import ClassVar, Hashable, Literal, Optional, Union
 
 from frozendict import frozendict
 
 from bgpy.enums import SpecialPercentAdoptions
+from bgpy.simulation_engine import Announcement as Ann
 from bgpy.simulation_engine import BaseSimulationEngine
 from bgpy.simulation_engine import Policy
 from bgpy.simulation_framework import Scenario, ScenarioConfig
@@ -12,15 +17,167 @@ from bgpy.simulation_framework.scenarios.preprocess_anns_funcs import (
     PREPROCESS_ANNS_FUNC_TYPE,
 )
 
-from ..tor_relay_collector import get_tor_relay_groups, TORRelay
+from ..tor_relay_collector import (
+    AliasTable,
+    get_position_bandwidth_weight,
+    get_relay_equivalence_classes,
+    get_tor_relay_groups,
+    Relay,
+    RelayEquivalenceClass,
+    RelaySnapshot,
+    TORRelayCollector,
+)
+
+# Path of the relay snapshot that every TORScenario uses. This is set in the
+# parent process, and inherited by the workers through the environment, so
+# that they all use the same relays (even if a worker starts the next day)
+RELAY_SNAPSHOT_ENV_VAR: str = "TOR_BGP_SIMS_RELAY_SNAPSHOT"
+
+# Relay equivalence classes for each scenario class and AdoptPolicyCls
+_relay_equivalence_classes: dict[
+    tuple[type["TORScenario"], type[Policy]],
+    tuple[tuple[Relay, ...], tuple[RelayEquivalenceClass, ...]],
+] = dict()
+
+# Alias tables of the relay weights for each scenario class and AdoptPolicyCls
+_relay_alias_tables: dict[
+    tuple[type["TORScenario"], type[Policy]], tuple[tuple[Relay, ...], AliasTable]
+] = dict()
+
+# Relay snapshots and their relay groups for each path, loaded on first use
+_relay_snapshots: dict[str, RelaySnapshot] = dict()
+_tor_relay_groups_dicts: dict[str, frozendict[type[Policy], tuple[Relay, ...]]] = dict()
+
+
+# Class attributes that don't change how a policy propagates (ex: Dest24 only
+# renames ROV for the graphs)
+_RENAME_ONLY_POLICY_ATTRS: frozenset[str] = frozenset(
+    [
+        "name",
+        "__module__",
+        "__qualname__",
+        "__doc__",
+        "__annotations__",
+        "__abstractmethods__",
+        "_abc_impl",
+        "__yaml_tag_suffix__",
+        "__firstlineno__",
+        "__static_attributes__",
+    ]
+)
+# get_propagation_policy_cls for each policy class, since it's needed for
+# every adopting AS (and there can be thousands, ex: every US ASN)
+_propagation_policy_classes: dict[type[Policy], type[Policy]] = dict()
+
+
+@dataclass(slots=True)
+class CachedRound:
+    """What a propagation round left behind, for later scenarios in the trial
+
+    Scenarios whose rounds would give the same results (see
+    TORScenario._get_cached_round_key) share one of these. Once both are
+    set, TORSimulationEngine skips the round, and TORSimulation reuses the
+    outcomes
+    """
+
+    # Outcomes for the metrics, from the ASGraphAnalyzer
+    outcomes: Optional[dict[int, dict[int, int]]] = None
+    # Local RIB announcements of the ASes that the scenario needs after
+    # the round (ex: the attackers that leak them)
+    local_ribs: Optional[dict[int, tuple[Ann, ...]]] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.outcomes is not None and self.local_ribs is not None
+
+
+def get_propagation_policy_cls(PolicyCls: type[Policy]) -> type[Policy]:
+    """Returns the class that PolicyCls propagates the same as
+
+    Policies that only rename their base class (ex: Dest24 for ROV) return
+    the base, so that they can share cached rounds
+    """
+
+    if PolicyCls not in _propagation_policy_classes:
+        PropagationPolicyCls = PolicyCls
+        while len(PropagationPolicyCls.__bases__) == 1 and (
+            set(vars(PropagationPolicyCls)) <= _RENAME_ONLY_POLICY_ATTRS
+        ):
+            PropagationPolicyCls = PropagationPolicyCls.__bases__[0]
+        _propagation_policy_classes[PolicyCls] = PropagationPolicyCls
+    return _propagation_policy_classes[PolicyCls]
+
+
+class RelayWeighting(Enum):
+    """How likely each relay in a group is to be picked"""
+
+    # Every relay is equally likely
+    UNIFORM = "uniform"
+    # In proportion to the relay's bandwidth
+    BANDWIDTH = "bandwidth"
+    # In proportion to the bandwidth scaled by the consensus bandwidth-weights
+    # for the relay's position, the same as Tor clients
+    CONSENSUS = "consensus"
+
+
+def pin_relay_snapshot(snapshot: Optional[Union[RelaySnapshot, Path]] = None) -> Path:
+    """Pins the relay snapshot that TORScenarios use, and returns its path
+
+    Call this in the parent process before starting any workers. Defaults
+    to collecting the relays for today
+    """
+
+    if snapshot is None:
+        snapshot = TORRelayCollector().run()
+    path = snapshot.path if isinstance(snapshot, RelaySnapshot) else snapshot
+    os.environ[RELAY_SNAPSHOT_ENV_VAR] = str(path.resolve())
+    return path
+
+
+def get_pinned_relay_snapshot() -> RelaySnapshot:
+    """Returns the pinned relay snapshot"""
+
+    path = os.environ.get(RELAY_SNAPSHOT_ENV_VAR)
+    if path is None:
+        print(
+            "No relay snapshot was pinned, so using today's relays. "
+            "Call pin_relay_snapshot before starting workers so they all match"
+        )
+        path = str(pin_relay_snapshot())
+    if path not in _relay_snapshots:
+        _relay_snapshots[path] = RelaySnapshot(Path(path))
+    return _relay_snapshots[path]
+
+
+def get_pinned_tor_relay_groups() -> frozendict[type[Policy], tuple[Relay, ...]]:
+    """Returns the relay groups for the pinned relay snapshot"""
+
+    snapshot = get_pinned_relay_snapshot()
+    path = str(snapshot.path)
+    if path not in _tor_relay_groups_dicts:
+        _tor_relay_groups_dicts[path] = get_tor_relay_groups(snapshot)
+    return _tor_relay_groups_dicts[path]
 
 
 class TORScenario(Scenario):
-    """TOR Scenario that selects a relay based on adopt policy"""
+    """TOR Scenario that selects a relay based on adopt policy
 
-    tor_relay_groups_dict: frozendict[
-        type[Policy], tuple[TORRelay, ...]
-    ] = get_tor_relay_groups()
+    Relay groups are loaded lazily from the pinned relay snapshot (see
+    pin_relay_snapshot), rather than when this module is imported
+
+    Relays are picked uniformly by default. Subclasses can set
+    relay_weighting to pick them the way Tor clients do (by bandwidth),
+    which samples from a precomputed alias table in O(1) per trial
+    """
+
+    # Set this to use these relay groups instead of the pinned snapshot
+    tor_relay_groups_dict: Optional[frozendict[type[Policy], tuple[Relay, ...]]] = None
+    # Set this to use these consensus bandwidth-weights instead of the pinned
+    # snapshot's (ex: Wgg=5919)
+    bandwidth_weights: Optional[frozendict[str, int]] = None
+    relay_weighting: RelayWeighting = RelayWeighting.UNIFORM
+    # Position the relays are picked for, for the consensus bandwidth-weights
+    relay_position: ClassVar[Literal["guard", "exit"]] = "guard"
 
     def __init__(
         self,
@@ -30,6 +187,8 @@ class TORScenario(Scenario):
         engine: Optional[BaseSimulationEngine] = None,
         prev_scenario: Optional["Scenario"] = None,
         preprocess_anns_func: PREPROCESS_ANNS_FUNC_TYPE = noop,
+        tor_relay: Optional[Relay] = None,
+        rov_asn_cls_dict: frozendict[int, type[Policy]] = frozendict(),
     ):
         """Adds TOR relay to the scenario
 
@@ -43,17 +202,39 @@ class TORScenario(Scenario):
         The reason that this is set to the AdoptPolicyCls is merely because the
         GraphFactoryCls uses that when creating the graph lines, so by doing
         it this way we won't need to modify the GraphFactory class
+
+        tor_relay overrides the random selection (ex: to simulate each relay
+        equivalence class once)
+
+        rov_asn_cls_dict is the ASes that deploy ROV in this trial, which are
+        treated like the hardcoded_asn_cls_dict. Unlike that, it can change
+        every trial without changing the scenario config (see
+        TORSimulation.real_world_rov)
         """
 
-        try:
-            self.tor_relay = random.choice(
-                self.tor_relay_groups_dict[scenario_config.AdoptPolicyCls]
-            )
-        except KeyError:
-            raise KeyError(
-                f"This Scenario only supports {list(self.tor_relay_groups_dict)} for "
-                f"AdoptPolicyCls, but you used {self.scenario_config.AdoptPolicyCls}"
+        relays = self.get_tor_relays(scenario_config.AdoptPolicyCls)
+        if (
+            tor_relay is None
+            and isinstance(prev_scenario, TORScenario)
+            and prev_scenario.get_tor_relays(
+                prev_scenario.scenario_config.AdoptPolicyCls
             )
+            is relays
+        ):
+            # Reuse the relay from the last scenario for comparability, the
+            # same as the attackers (ex: every Dest config picks from the exits)
+            tor_relay = prev_scenario.tor_relay
+        if tor_relay is None:
+            tor_relay = self.get_random_tor_relay(scenario_config.AdoptPolicyCls)
+        self.tor_relay: Relay = tor_relay
+        # Shared by every scenario in the trial, through the prev_scenario
+        self._cached_rounds: dict[Hashable, CachedRound] = (
+            prev_scenario._cached_rounds
+            if isinstance(prev_scenario, TORScenario)
+            else dict()
+        )
+        self._cached_round_dict: dict[int, Optional[CachedRound]] = dict()
+        self.rov_asn_cls_dict: frozendict[int, type[Policy]] = rov_asn_cls_dict
 
         super().__init__(
             scenario_config=scenario_config,
@@ -66,3 +247,229 @@ class TORScenario(Scenario):
         # Needed for the untracked asns in the exit to dest scenario
         assert engine
         self.engine = engine
+
+    @classmethod
+    def get_tor_relay_groups_dict(
+        cls,
+    ) -> frozendict[type[Policy], tuple[Relay, ...]]:
+        """Returns the relay groups to select relays from"""
+
+        if cls.tor_relay_groups_dict is not None:
+            return cls.tor_relay_groups_dict
+        return get_pinned_tor_relay_groups()
+
+    @classmethod
+    def get_tor_relays(cls, AdoptPolicyCls: type[Policy]) -> tuple[Relay, ...]:
+        """Returns the relays to select from for the AdoptPolicyCls"""
+
+        tor_relay_groups_dict = cls.get_tor_relay_groups_dict()
+        try:
+            return tor_relay_groups_dict[AdoptPolicyCls]
+        except KeyError:
+            raise KeyError(
+                f"This Scenario only supports {list(tor_relay_groups_dict)} for "
+                f"AdoptPolicyCls, but you used {AdoptPolicyCls}"
+            )
+
+    @classmethod
+    def get_random_tor_relay(cls, AdoptPolicyCls: type[Policy]) -> Relay:
+        """Returns a relay for the AdoptPolicyCls, picked using relay_weighting"""
+
+        relays = cls.get_tor_relays(AdoptPolicyCls)
+        if cls.relay_weighting == RelayWeighting.UNIFORM:
+            return random.choice(relays)
+        else:
+            return relays[cls.get_relay_alias_table(AdoptPolicyCls).sample()]
+
+    @classmethod
+    def get_relay_equivalence_classes(
+        cls, AdoptPolicyCls: type[Policy]
+    ) -> tuple[RelayEquivalenceClass, ...]:
+        """Returns the relays for the AdoptPolicyCls, grouped by relay_class_key"""
+
+        relays = cls.get_tor_relays(AdoptPolicyCls)
+        key = (cls, AdoptPolicyCls)
+        # Cached along with the relays they're for, in case those change
+        if key not in _relay_equivalence_classes or (
+            _relay_equivalence_classes[key][0] is not relays
+        ):
+            _relay_equivalence_classes[key] = (
+                relays,
+                get_relay_equivalence_classes(relays, cls.relay_class_key),
+            )
+        return _relay_equivalence_classes[key][1]
+
+    @classmethod
+    def get_relay_alias_table(cls, AdoptPolicyCls: type[Policy]) -> AliasTable:
+        """Returns an alias table of get_relay_weight for each relay"""
+
+        relays = cls.get_tor_relays(AdoptPolicyCls)
+        key = (cls, AdoptPolicyCls)
+        # Cached along with the relays they're for, in case those change
+        if key not in _relay_alias_tables or (
+            _relay_alias_tables[key][0] is not relays
+        ):
+            relay_position = cls.get_relay_position(AdoptPolicyCls)
+            _relay_alias_tables[key] = (
+                relays,
+                AliasTable([cls.get_relay_weight(x, relay_position) for x in relays]),
+            )
+        return _relay_alias_tables[key][1]
+
+    @classmethod
+    def get_relay_position(
+        cls, AdoptPolicyCls: type[Policy]
+    ) -> Literal["guard", "exit"]:
+        """Returns the position the relays for the AdoptPolicyCls are picked for"""
+
+        return cls.relay_position
+
+    @classmethod
+    def get_relay_weight(
+        cls,
+        relay: Relay,
+        relay_position: Optional[Literal["guard", "exit"]] = None,
+    ) -> float:
+        """Returns how likely the relay is to be picked, using relay_weighting
+
+        relay_position defaults to the scenario's relay_position
+        """
+
+        if cls.relay_weighting == RelayWeighting.UNIFORM:
+            return 1
+        elif cls.relay_weighting == RelayWeighting.BANDWIDTH:
+            return relay.bandwidth_weight
+        elif cls.relay_weighting == RelayWeighting.CONSENSUS:
+            if cls.bandwidth_weights is not None:
+                bandwidth_weights = cls.bandwidth_weights
+            elif cls.tor_relay_groups_dict is not None:
+                # Overridden relays aren't from the pinned snapshot
+                bandwidth_weights = frozendict()
+            else:
+                bandwidth_weights = get_pinned_relay_snapshot().bandwidth_weights
+            return get_position_bandwidth_weight(
+                relay, relay_position or cls.relay_position, bandwidth_weights
+            )
+        else:
+            raise NotImplementedError(cls.relay_weighting)
+
+    def _get_non_default_asn_cls_dict(
+        self,
+        override_non_default_asn_cls_dict: Union[
+            Optional[frozendict[int, type[Policy]]], frozendict[str, None]
+        ],
+        engine: Optional[BaseSimulationEngine],
+        prev_scenario: Optional[Scenario],
+    ) -> frozendict[int, type[Policy]]:
+        """Adds the rov_asn_cls_dict, the same as bgpy's hardcoded ASes"""
+
+        non_default_asn_cls_dict = super()._get_non_default_asn_cls_dict(
+            override_non_default_asn_cls_dict, engine, prev_scenario
+        )
+        # Without a prev_scenario, _get_randomized_non_default_asn_cls_dict
+        # already added them
+        if (
+            self.rov_asn_cls_dict
+            and override_non_default_asn_cls_dict is None
+            and prev_scenario
+        ):
+            non_default_asn_cls_dict = frozendict(
+                {**non_default_asn_cls_dict, **self.rov_asn_cls_dict}
+            )
+        return non_default_asn_cls_dict
+
+    def _get_randomized_non_default_asn_cls_dict(
+        self, engine: BaseSimulationEngine
+    ) -> dict[int, type[Policy]]:
+        """Starts from the rov_asn_cls_dict, like bgpy does with the hardcoded ASes"""
+
+        return {
+            **self.rov_asn_cls_dict,
+            **super()._get_randomized_non_default_asn_cls_dict(engine),
+        }
+
+    @property
+    def _preset_asns(self) -> frozenset[int]:
+        """So that the ROV ASes aren't picked as random adopters"""
+
+        return super()._preset_asns | frozenset(self.rov_asn_cls_dict)
+
+    @property
+    def _tracked_asns(self) -> Optional[frozenset[int]]:
+        """ASNs to trace back from and track metrics for (None for all)
+
+        When set, TORASGraphAnalyzer and TORMetricTracker only look at these
+        ASes (and the ASes along their paths), rather than the whole graph
+        """
+
+        return None
+
+    def _get_propagation_target_asns(
+        self, propagation_round: int
+    ) -> Optional[frozenset[int]]:
+        """ASNs that need exact RIBs after the round (None for every AS)
+
+        When set, TORSimulationEngine only propagates between the seeded
+        ASes and these ASes
+        """
+
+        return None
+
+    def _get_relay_scenarios(self) -> tuple["TORScenario", ...]:
+        """Returns a scenario to analyze and track metrics for, per relay
+
+        Scenarios that propagate many relays at once (see
+        BatchedClientsToGuardScenario) return one per relay, so that each
+        relay counts as its own trial
+        """
+
+        return (self,)
+
+    def _get_cached_round(self, propagation_round: int) -> Optional[CachedRound]:
+        """Returns the round's results shared within the trial, if it has a key"""
+
+        if propagation_round not in self._cached_round_dict:
+            key = self._get_cached_round_key(propagation_round)
+            self._cached_round_dict[propagation_round] = (
+                None
+                if key is None
+                else self._cached_rounds.setdefault(key, CachedRound())
+            )
+        return self._cached_round_dict[propagation_round]
+
+    def _get_cached_round_key(self, propagation_round: int) -> Optional[Hashable]:
+        """Returns what the round's results depend on (None to never share)
+
+        Scenarios in the same trial with the same key share their results
+        for the round, rather than propagating again
+        """
+
+        return None
+
+    def _get_adoption_key(self) -> Hashable:
+        """Returns the policies each AS propagates with, for cached round keys"""
+
+        AttackerBasePolicyCls = self.scenario_config.AttackerBasePolicyCls
+        return (
+            get_propagation_policy_cls(self.scenario_config.BasePolicyCls),
+            (
+                None
+                if AttackerBasePolicyCls is None
+                else get_propagation_policy_cls(AttackerBasePolicyCls)
+            ),
+            frozenset(
+                (asn, get_propagation_policy_cls(PolicyCls))
+                for asn, PolicyCls in self.non_default_asn_cls_dict.items()
+            ),
+        )
+
+    @staticmethod
+    def relay_class_key(relay: Relay) -> Hashable:
+        """Returns what the scenario depends on for a relay
+
+        Relays with the same key give the same results, so they can be
+        simulated once as an equivalence class. This should be overridden
+        by subclasses that depend on less (ex: only the origin)
+        """
+
+        return (relay.ipv4_origin, relay.ipv4_prefix, relay.ipv4_roa_validity)
@@ -0,0 +1,24 @@
+from .combined_as_graph_analyzer import CombinedASGraphAnalyzer
+from .experiment import Attackers, Experiment, load_experiments
+from .experiment_runner import ExperimentRunner
+from .tor_as_graph_analyzer import TORASGraphAnalyzer
+from .tor_metric_tracker import TORMetricTracker
+from .tor_simulation_engine import (
+    get_valley_free_propagation_ranks,
+    TORSimulationEngine,
+)
+from .tor_simulation import RelaySampling, TORSimulation
+
+__all__ = [
+    "Attackers",
+    "CombinedASGraphAnalyzer",
+    "Experiment",
+    "ExperimentRunner",
+    "load_experiments",
+    "TORASGraphAnalyzer",
+    "TORMetricTracker",
+    "get_valley_free_propagation_ranks",
+    "TORSimulationEngine",
+    "RelaySampling",
+    "TORSimulation",
+]
@@ -0,0 +1,160 @@
+from typing import Iterable, Optional, TYPE_CHECKING
+
+from bgpy.enums import Outcomes, Plane, Relationships
+from bgpy.simulation_engine import BaseSimulationEngine
+from bgpy.simulation_framework import ASGraphAnalyzer
+
+if TYPE_CHECKING:
+    from bgpy.simulation_framework.scenarios import Scenario
+
+
+class CombinedASGraphAnalyzer(ASGraphAnalyzer):
+    """Performs traceback for guard and dest attacker
+
+    For an attacker to have the easiest time deanonomizing users
+    they need to hijack both the connection going from the guard
+    to the client, and also the connection going from the exit to
+    the destination.
+
+    This requires the attacker to use two non-overlapping prefixes
+    and thus requires a custom traceback/ASGraphAnalyzer class
+
+    Quite simply, this traceback performs only data plane traceback,
+    and just does the traceback to get outcomes for attacker success
+    against the guard, and then again to get attacker success against
+    the exit, and then simply does an intersection of the two.
+
+    It's important to note that for the exit-to-dest tracking, we only
+    trace back to a single AS - the exit relay. So essentially, we perform
+    __normal__ traceback for client-to-guard attack, and then if dest-to-exit
+    is intercepted by the attacker, return the client-to-guard results, else
+    all are victim success and not attacker success.
+
+    The scenario splits itself into the legs (see
+    ClientsToGuardExitToDestScenario._get_leg_scenarios). Each AS's outcome
+    for a leg is memoized as soon as any traceback walks through it, so
+    every AS is walked at most once per leg, and the most specific
+    announcement is only looked up for the ASes that are walked. The
+    control plane isn't analyzed at all, since it has no joint outcome
+    """
+
+    def __init__(
+        self,
+        engine: BaseSimulationEngine,
+        scenario: "Scenario",
+        data_plane_tracking: bool = True,
+        control_plane_tracking: bool = False,
+    ) -> None:
+        # Unlike the base class, the most specific anns aren't looked up here
+        self.engine: BaseSimulationEngine = engine
+        self.scenario: "Scenario" = scenario
+        self._data_plane_outcomes: dict[int, int] = dict()
+        self._control_plane_outcomes: dict[int, int] = dict()
+        self.outcomes: dict[int, dict[int, int]] = {
+            Plane.DATA.value: self._data_plane_outcomes,
+            Plane.CTRL.value: self._control_plane_outcomes,
+        }
+        self.data_plane_tracking: bool = data_plane_tracking
+        self.control_plane_tracking: bool = control_plane_tracking
+
+    def analyze(self) -> dict[int, dict[int, int]]:
+        """Returns the first leg's outcomes, joint with the other legs
+
+        An AS is only an attacker success if the attacker intercepts its
+        traffic on the first leg (ex: client to guard) and at every tracked AS
+        of the other legs (ex: the exit). Otherwise the attacker can't link
+        the two, so the AS's attacker successes are victim successes
+        """
+
+        if not self.data_plane_tracking:
+            return self.outcomes
+
+        ATTACKER_SUCCESS = Outcomes.ATTACKER_SUCCESS.value
+        first_leg_scenario, *other_leg_scenarios = (
+            self.scenario._get_leg_scenarios()  # type: ignore
+        )
+        other_legs_intercepted = all(
+            outcome == ATTACKER_SUCCESS
+            for leg_scenario in other_leg_scenarios
+            for outcome in self._get_leg_outcomes(leg_scenario).values()
+        )
+        outcomes = self._get_leg_outcomes(first_leg_scenario)
+        if not other_legs_intercepted:
+            VICTIM_SUCCESS = Outcomes.VICTIM_SUCCESS.value
+            for asn, outcome in outcomes.items():
+                if outcome == ATTACKER_SUCCESS:
+                    outcomes[asn] = VICTIM_SUCCESS
+        self._data_plane_outcomes.update(outcomes)
+        return self.outcomes
+
+    def _get_leg_outcomes(self, leg_scenario: "Scenario") -> dict[int, int]:
+        """Returns the data plane outcomes of the leg for its tracked ASes
+
+        These are for every AS if the leg doesn't track any (see
+        TORScenario._tracked_asns)
+        """
+
+        tracked_asns: Optional[frozenset[int]] = getattr(
+            leg_scenario, "_tracked_asns", None
+        )
+        asns: Iterable[int] = (
+            self.engine.as_graph.as_dict if tracked_asns is None else tracked_asns
+        )
+        outcomes = self._trace_back(leg_scenario, asns)
+        if tracked_asns is None:
+            return outcomes
+        return {asn: outcomes[asn] for asn in tracked_asns}
+
+    def _trace_back(
+        self, leg_scenario: "Scenario", asns: Iterable[int]
+    ) -> dict[int, int]:
+        """Traces back from the ASes on the data plane, for the leg
+
+        This gives the same outcomes as the base class's data plane
+        traceback, but walks each path in a loop rather than recursively, and
+        stops at the first AS with a known outcome. Every AS along the walk
+        then gets that outcome
+        """
+
+        as_dict = self.engine.as_graph.as_dict
+        attacker_asns = leg_scenario.attacker_asns
+        victim_asns = leg_scenario.victim_asns
+        prefixes = tuple(leg_scenario.ordered_prefix_subprefix_dict)
+        ORIGIN = Relationships.ORIGIN.value
+        ATTACKER_SUCCESS = Outcomes.ATTACKER_SUCCESS.value
+        VICTIM_SUCCESS = Outcomes.VICTIM_SUCCESS.value
+        DISCONNECTED = Outcomes.DISCONNECTED.value
+
+        outcomes: dict[int, int] = dict()
+        for asn in asns:
+            path: list[int] = list()
+            while asn not in outcomes:
+                if asn in attacker_asns:
+                    outcomes[asn] = ATTACKER_SUCCESS
+                    break
+                elif asn in victim_asns:
+                    outcomes[asn] = VICTIM_SUCCESS
+                    break
+                local_rib = as_dict[asn].policy._local_rib
+                for prefix in prefixes:
+                    ann = local_rib.get(prefix)
+                    if ann:
+                        break
+                else:
+                    ann = None
+                # End of traceback
+                if (
+                    ann is None
+                    or len(ann.as_path) == 1
+                    or ann.recv_relationship.value == ORIGIN
+                    or getattr(ann, "traceback_end", False)
+                    or ann.next_hop_asn == asn
+                ):
+                    outcomes[asn] = DISCONNECTED
+                    break
+                path.append(asn)
+                asn = ann.next_hop_asn
+            outcome = outcomes[asn]
+            for path_asn in path:
+                outcomes[path_asn] = outcome
+        return outcomes
@@ -0,0 +1,164 @@
+from dataclasses import dataclass, field, fields
+from enum import Enum
+import json
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from frozendict import frozendict
+
+from bgpy.enums import ASGroups, SpecialPercentAdoptions
+from bgpy.simulation_engine import Policy
+from bgpy.simulation_framework import ScenarioConfig
+
+from .. import policies, scenarios
+from ..scenarios import TORScenario
+from .tor_simulation import RelaySampling
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python 3.10
+    tomllib = None  # type: ignore
+
+
+class Attackers(Enum):
+    """Who attacks in an experiment"""
+
+    # One attacker, from bgpy's default ASGroup
+    SINGLE = "single"
+    # One multihomed attacker (ex: ExitToDestScenario can't leak from stubs)
+    MULTIHOMED = "multihomed"
+    # Every US ASN
+    US = "us"
+
+
+@dataclass(frozen=True)
+class Experiment:
+    """A named TORSimulation, with a scenario config per AdoptPolicyCls
+
+    See ExperimentRunner. num_trials, percent_adoptions, and target_yerr
+    default to the ExperimentRunner's. With a target_yerr, num_trials is the
+    most trials for each percent adoption (see TORSimulation)
+    """
+
+    name: str
+    ScenarioCls: type[TORScenario]
+    AdoptPolicyClasses: tuple[type[Policy], ...]
+    attackers: Attackers = Attackers.SINGLE
+    propagation_rounds: int = 1
+    # Hardcodes the ASes that deploy ROV in the real world
+    real_world_rov: bool = True
+    # Draws the real world ROV ASes again for every trial, rather than once
+    # for every experiment (see TORSimulation.real_world_rov)
+    resample_rov: bool = False
+    relay_sampling: RelaySampling = RelaySampling.RANDOM
+    num_trials: Optional[int] = None
+    percent_adoptions: Optional[tuple[Union[float, SpecialPercentAdoptions], ...]] = (
+        None
+    )
+    target_yerr: Optional[float] = None
+    # Only run when selected by name, if False
+    enabled: bool = field(default=True, compare=False)
+
+    def get_scenario_configs(
+        self,
+        rov_asn_cls_dict: frozendict[int, type[Policy]] = frozendict(),
+        us_asns: frozenset[int] = frozenset(),
+    ) -> tuple[ScenarioConfig, ...]:
+        """Returns a scenario config for each AdoptPolicyCls
+
+        rov_asn_cls_dict is only used with real_world_rov (and not
+        resample_rov, which draws the ROV ASes per trial instead), and us_asns
+        is only used with US attackers
+        """
+
+        kwargs: dict[str, Any] = {"propagation_rounds": self.propagation_rounds}
+        if self.real_world_rov and not self.resample_rov:
+            kwargs["hardcoded_asn_cls_dict"] = rov_asn_cls_dict
+        if self.attackers == Attackers.MULTIHOMED:
+            kwargs["attacker_subcategory_attr"] = ASGroups.MULTIHOMED.value
+        elif self.attackers == Attackers.US:
+            assert us_asns, "US attackers need the US ASNs"
+            kwargs["override_attacker_asns"] = us_asns
+            kwargs["num_attackers"] = len(us_asns)
+        return tuple(
+            ScenarioConfig(
+                ScenarioCls=self.ScenarioCls, AdoptPolicyCls=AdoptPolicyCls, **kwargs
+            )
+            for AdoptPolicyCls in self.AdoptPolicyClasses
+        )
+
+    @classmethod
+    def from_dict(cls, name: str, spec: dict[str, Any]) -> "Experiment":
+        """Returns the experiment for a spec, with the classes by name
+
+        ex: {"scenario": "ExitToDestScenario", "adopt_policies": ["Dest24"],
+        "attackers": "multihomed", "propagation_rounds": 2}
+        """
+
+        spec = dict(spec)
+        kwargs: dict[str, Any] = {
+            "name": name,
+            "ScenarioCls": _get_named_cls(scenarios, spec.pop("scenario"), TORScenario),
+            "AdoptPolicyClasses": tuple(
+                _get_named_cls(policies, x, Policy) for x in spec.pop("adopt_policies")
+            ),
+        }
+        if "attackers" in spec:
+            kwargs["attackers"] = Attackers(spec.pop("attackers"))
+        if "relay_sampling" in spec:
+            kwargs["relay_sampling"] = RelaySampling(spec.pop("relay_sampling"))
+        if "percent_adoptions" in spec:
+            kwargs["percent_adoptions"] = tuple(
+                SpecialPercentAdoptions[x] if isinstance(x, str) else float(x)
+                for x in spec.pop("percent_adoptions")
+            )
+        field_names = {x.name for x in fields(cls)}
+        for key, value in spec.items():
+            if key not in field_names or key in kwargs:
+                raise ValueError(f"Experiment {name} has an unknown setting {key}")
+            kwargs[key] = value
+        return cls(**kwargs)
+
+
+def load_experiments(path: Path) -> tuple[Experiment, ...]:
+    """Loads the experiments from a TOML or JSON spec
+
+    Each experiment is a table under experiments, and the optional defaults
+    table applies to all of them, ex:
+
+    [defaults]
+    propagation_rounds = 2
+
+    [experiments.exit_to_dest_mh]
+    scenario = "ExitToDestScenario"
+    adopt_policies = ["Dest24", "DestValidNot24", "DestNotValidNot24"]
+    attackers = "multihomed"
+
+    JSON specs have the same layout. TOML needs Python 3.11 or later
+    """
+
+    if path.suffix == ".json":
+        with path.open() as f:
+            spec = json.load(f)
+    elif path.suffix == ".toml":
+        if tomllib is None:
+            raise NotImplementedError("TOML specs need Python 3.11, use JSON instead")
+        with path.open("rb") as f:
+            spec = tomllib.load(f)
+    else:
+        raise NotImplementedError(f"Experiment specs must be TOML or JSON: {path}")
+
+    defaults = spec.get("defaults", dict())
+    return tuple(
+        Experiment.from_dict(name, {**defaults, **experiment_spec})
+        for name, experiment_spec in spec["experiments"].items()
+    )
+
+
+def _get_named_cls(module: Any, name: str, BaseCls: type) -> Any:
+    """Returns the module's subclass of BaseCls with the name"""
+
+    Cls = getattr(module, name, None)
+    if not (isinstance(Cls, type) and issubclass(Cls, BaseCls)):
+        raise ValueError(f"{module.__name__} has no {BaseCls.__name__} {name}")
+    return Cls
@@ -0,0 +1,383 @@
+from contextlib import nullcontext
+import inspect
+from multiprocessing import cpu_count
+import os
+from pathlib import Path
+import pickle
+import shutil
+import time
+from typing import Any, Optional, Union
+
+from frozendict import frozendict
+
+from bgpy.enums import SpecialPercentAdoptions
+from bgpy.simulation_engine import Policy
+from bgpy.simulation_framework import GraphFactory, Simulation
+
+from ..scenarios import pin_relay_snapshot
+from ..tor_relay_collector import RelaySnapshot
+from ..utils import (
+    get_real_world_rov_asn_cls_dict,
+    get_us_country_asns,
+    RealWorldROV,
+)
+from .experiment import Attackers, Experiment
+from .tor_simulation import (
+    _init_worker,
+    _run_claimed_worker_chunk,
+    _run_worker_chunk,
+    get_shared_worker_pool,
+    TORSimulation,
+)
+
+
+class ExperimentRunner:
+    """Runs many experiments in one pool of workers
+
+    Each experiment is its own TORSimulation (with its own output_dir), but
+    their chunks all run in the same workers. The engine (see
+    TORSimulation._get_engine), the relays, and the simulations (and so the
+    ROV ASNs and US ASNs) are built once in the parent, and shared by all of
+    the workers (see get_shared_worker_pool), rather than once per
+    experiment.
+
+    The ROV ASNs and US ASNs are only collected if an experiment needs them.
+    Every experiment is checkpointed (see TORSimulation), so a restarted
+    run picks up where it left off
+
+    To split the experiments between many hosts, write a shard plan to a
+    directory they all share (see write_shard_plan), then run
+    run_shard_worker on each of them (with the runner from from_shard_plan),
+    and then merge once they're done. This gives the same data and graphs
+    as running them all on one host
+    """
+
+    SHARD_PLAN_NAME: str = "shard_plan.pickle"
+    RELAY_SNAPSHOT_NAME: str = "relays.snapshot"
+
+    def __init__(
+        self,
+        experiments: tuple[Experiment, ...],
+        output_dir: Path,
+        *,
+        num_trials: int = 500,
+        percent_adoptions: tuple[Union[float, SpecialPercentAdoptions], ...] = (
+            SpecialPercentAdoptions.ONLY_ONE,
+            0.1,
+            0.3,
+            0.5,
+            0.8,
+            0.99,
+        ),
+        trials_per_checkpoint: int = 25,
+        target_yerr: Optional[float] = None,
+        parse_cpus: int = cpu_count(),
+        python_hash_seed: Optional[int] = 0,
+        relay_snapshot: Optional[Union[RelaySnapshot, Path]] = None,
+        rov_asn_cls_dict: Optional[frozendict[int, type[Policy]]] = None,
+        real_world_rov: Optional[RealWorldROV] = None,
+        us_asns: Optional[frozenset[int]] = None,
+        **simulation_kwargs: Any,
+    ) -> None:
+        """simulation_kwargs are for every TORSimulation
+
+        target_yerr makes every experiment without its own adaptive (see
+        TORSimulation). rov_asn_cls_dict, real_world_rov (for experiments
+        that resample_rov), and us_asns are collected if needed and not given
+        """
+
+        names = [x.name for x in experiments]
+        assert len(set(names)) == len(names), f"Experiment names repeat: {names}"
+        self.experiments: tuple[Experiment, ...] = experiments
+        self.output_dir: Path = output_dir
+        self.num_trials: int = num_trials
+        self.percent_adoptions: tuple[Union[float, SpecialPercentAdoptions], ...] = (
+            percent_adoptions
+        )
+        self.trials_per_checkpoint: int = trials_per_checkpoint
+        self.target_yerr: Optional[float] = target_yerr
+        self.parse_cpus: int = parse_cpus
+        self.python_hash_seed: Optional[int] = python_hash_seed
+        self.relay_snapshot: Optional[Union[RelaySnapshot, Path]] = relay_snapshot
+        self.rov_asn_cls_dict: Optional[frozendict[int, type[Policy]]] = (
+            rov_asn_cls_dict
+        )
+        self.real_world_rov: Optional[RealWorldROV] = real_world_rov
+        self.us_asns: Optional[frozenset[int]] = us_asns
+        self.simulation_kwargs: dict[str, Any] = simulation_kwargs
+        # Each experiment's checkpoint dir name and chunks, for shard plans
+        self.work_units: Optional[
+            dict[
+                str,
+                tuple[
+                    str,
+                    tuple[list[tuple[Union[float, SpecialPercentAdoptions], int]], ...],
+                ],
+            ]
+        ] = None
+
+    def run(
+        self,
+        GraphFactoryCls: Optional[type[GraphFactory]] = GraphFactory,
+        graph_factory_kwargs=None,
+    ) -> None:
+        """Runs every experiment, then writes each one's data and graphs"""
+
+        simulations = self._get_simulations()
+        if self.parse_cpus == 1:
+            _init_worker(simulations)
+        with (
+            get_shared_worker_pool(simulations, self.parse_cpus)
+            if self.parse_cpus > 1
+            else nullcontext()
+        ) as p:
+            # Adaptive experiments only know which chunks they need next once
+            # the last ones are done, so these run in rounds
+            chunks = self._get_remaining_chunks(simulations)
+            while chunks:
+                if p is None:
+                    for chunk_args in chunks:
+                        _run_worker_chunk(*chunk_args)
+                else:
+                    p.starmap(_run_worker_chunk, chunks, chunksize=1)
+                chunks = self._get_remaining_chunks(simulations)
+
+        self._write_simulations(simulations, GraphFactoryCls, graph_factory_kwargs)
+
+    def write_shard_plan(self) -> Path:
+        """Writes the plan that workers on any host can run, into output_dir
+
+        Everything that the hosts must agree on is pinned in the plan: the
+        relay snapshot (which is copied next to it), the ROV ASNs (or how
+        likely each AS is to deploy ROV), the US ASNs, and the AS graph's
+        download time. The plan also has the work units, which are the chunks
+        of each experiment (see TORSimulation), so that workers with other
+        settings fail rather than running chunks that are never merged
+        """
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        relay_snapshot_path = self.output_dir / self.RELAY_SNAPSHOT_NAME
+        pinned_path = pin_relay_snapshot(self.relay_snapshot)
+        if pinned_path.resolve() != relay_snapshot_path.resolve():
+            shutil.copyfile(pinned_path, relay_snapshot_path)
+        self.relay_snapshot = relay_snapshot_path
+        self._pin_as_graph_dl_time()
+
+        simulations = self._get_simulations()
+        self.work_units = {
+            experiment.name: (
+                simulation.checkpoint_dir.name,
+                tuple(simulation._get_chunks(self.parse_cpus)),
+            )
+            for experiment, simulation in zip(self.experiments, simulations)
+        }
+        path = self.output_dir / self.SHARD_PLAN_NAME
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(self, f)
+        os.replace(tmp_path, path)
+        print(f"Wrote the shard plan to {path}")
+        return path
+
+    @classmethod
+    def from_shard_plan(
+        cls, output_dir: Path, parse_cpus: Optional[int] = None
+    ) -> "ExperimentRunner":
+        """Returns the runner from the shard plan in output_dir
+
+        output_dir is where this host has the shared directory, which may not
+        be where the host that wrote the plan has it. parse_cpus defaults to
+        the plan's
+        """
+
+        with (output_dir / cls.SHARD_PLAN_NAME).open("rb") as f:
+            runner = pickle.load(f)
+        assert isinstance(runner, cls), "Not a shard plan"
+        runner.output_dir = output_dir
+        runner.relay_snapshot = output_dir / cls.RELAY_SNAPSHOT_NAME
+        if parse_cpus is not None:
+            runner.parse_cpus = parse_cpus
+        return runner
+
+    def run_shard_worker(
+        self, claim_timeout: float = 6 * 60 * 60, poll_interval: float = 60
+    ) -> None:
+        """Runs the shard plan's chunks that no other worker has claimed
+
+        Returns once every chunk is either checkpointed or claimed by
+        another worker. Claims that are older than claim_timeout seconds are
+        taken over (see TORSimulation._claim_chunk), so it must be longer
+        than a chunk takes. Adaptive experiments (see
+        TORSimulation.target_yerr) only know which chunks they need next once
+        the claimed ones are done, so for those, this checks for them every
+        poll_interval seconds until every percent adoption has converged
+        """
+
+        simulations = self._get_shard_simulations()
+        if self.parse_cpus == 1:
+            _init_worker(simulations)
+        with (
+            get_shared_worker_pool(simulations, self.parse_cpus)
+            if self.parse_cpus > 1
+            else nullcontext()
+        ) as p:
+            while True:
+                chunks = [
+                    (*chunk_args, claim_timeout)
+                    for chunk_args in self._get_remaining_chunks(simulations)
+                ]
+                if p is None:
+                    ran = [_run_claimed_worker_chunk(*x) for x in chunks]
+                else:
+                    ran = p.starmap(_run_claimed_worker_chunk, chunks, chunksize=1)
+                # Only the chunks other workers are running are left
+                if not any(ran):
+                    if not chunks or all(x.target_yerr is None for x in simulations):
+                        break
+                    time.sleep(poll_interval)
+        print(f"{len(chunks)} chunks are left for the other workers")
+
+    def merge(
+        self,
+        GraphFactoryCls: Optional[type[GraphFactory]] = GraphFactory,
+        graph_factory_kwargs=None,
+    ) -> None:
+        """Merges the shard plan's chunks, then writes the data and graphs
+
+        Every chunk must be checkpointed by the workers first
+        """
+
+        simulations = self._get_shard_simulations()
+        num_remaining = len(self._get_remaining_chunks(simulations))
+        if num_remaining:
+            raise RuntimeError(
+                f"{num_remaining} chunks aren't checkpointed yet, "
+                "so they must be run by more workers first"
+            )
+        self._write_simulations(simulations, GraphFactoryCls, graph_factory_kwargs)
+
+    def _get_remaining_chunks(
+        self, simulations: tuple[TORSimulation, ...]
+    ) -> list[tuple[int, int, list[tuple[Union[float, SpecialPercentAdoptions], int]]]]:
+        """Returns each simulation's remaining chunks, with its index"""
+
+        return [
+            (simulation_index, chunk_id, chunk)
+            for simulation_index, simulation in enumerate(simulations)
+            for chunk_id, chunk in simulation._get_remaining_chunks()
+        ]
+
+    def _write_simulations(
+        self,
+        simulations: tuple[TORSimulation, ...],
+        GraphFactoryCls: Optional[type[GraphFactory]],
+        graph_factory_kwargs,
+    ) -> None:
+        """Merges and writes each simulation's checkpoints, and their graphs"""
+
+        # Every chunk is checkpointed, so this only merges and writes them
+        for simulation in simulations:
+            simulation.run(
+                GraphFactoryCls=GraphFactoryCls,
+                graph_factory_kwargs=graph_factory_kwargs,
+            )
+
+    def _get_shard_simulations(self) -> tuple[TORSimulation, ...]:
+        """Returns the simulations, after checking they match the shard plan"""
+
+        assert self.work_units is not None, "Use from_shard_plan"
+        simulations = self._get_simulations()
+        for experiment, simulation in zip(self.experiments, simulations):
+            work_units = (
+                simulation.checkpoint_dir.name,
+                tuple(simulation._get_chunks(self.parse_cpus)),
+            )
+            if work_units != self.work_units[experiment.name]:
+                raise ValueError(
+                    f"{experiment.name} doesn't match the shard plan. Does this "
+                    "host have the same version of tor_bgp_sims as the one that "
+                    "wrote it?"
+                )
+        return simulations
+
+    def _pin_as_graph_dl_time(self) -> None:
+        """Pins the AS graph's download time, if it's not set
+
+        By default, it depends on the day, and hosts that start on another
+        day would use another AS graph
+        """
+
+        defaults = inspect.signature(Simulation.__init__).parameters
+        ASGraphConstructorCls = self.simulation_kwargs.get(
+            "ASGraphConstructorCls", defaults["ASGraphConstructorCls"].default
+        )
+        as_graph_constructor_kwargs = self.simulation_kwargs.get(
+            "as_graph_constructor_kwargs",
+            defaults["as_graph_constructor_kwargs"].default,
+        )
+        collector_kwargs = as_graph_constructor_kwargs.get(
+            "as_graph_collector_kwargs", frozendict()
+        )
+        if collector_kwargs.get("dl_time") is None:
+            dl_time = ASGraphConstructorCls(
+                **as_graph_constructor_kwargs
+            ).as_graph_collector.dl_time
+            self.simulation_kwargs["as_graph_constructor_kwargs"] = frozendict(
+                {
+                    **as_graph_constructor_kwargs,
+                    "as_graph_collector_kwargs": frozendict(
+                        {**collector_kwargs, "dl_time": dl_time}
+                    ),
+                }
+            )
+
+    def _get_simulations(self) -> tuple[TORSimulation, ...]:
+        """Returns a TORSimulation for each experiment"""
+
+        rov_asn_cls_dict: frozendict[int, type[Policy]] = frozendict()
+        if any(x.real_world_rov and not x.resample_rov for x in self.experiments):
+            if self.rov_asn_cls_dict is None:
+                self.rov_asn_cls_dict = get_real_world_rov_asn_cls_dict()
+            rov_asn_cls_dict = self.rov_asn_cls_dict
+        if self.real_world_rov is None and any(
+            x.real_world_rov and x.resample_rov for x in self.experiments
+        ):
+            self.real_world_rov = RealWorldROV.from_json()
+        us_asns: frozenset[int] = frozenset()
+        if any(x.attackers == Attackers.US for x in self.experiments):
+            if self.us_asns is None:
+                self.us_asns = get_us_country_asns()
+            us_asns = self.us_asns
+
+        simulations = list()
+        for experiment in self.experiments:
+            simulation = TORSimulation(
+                scenario_configs=experiment.get_scenario_configs(
+                    rov_asn_cls_dict, us_asns
+                ),
+                relay_sampling=experiment.relay_sampling,
+                num_trials=experiment.num_trials or self.num_trials,
+                percent_adoptions=(
+                    experiment.percent_adoptions or self.percent_adoptions
+                ),
+                output_dir=self.output_dir / experiment.name,
+                trials_per_checkpoint=self.trials_per_checkpoint,
+                target_yerr=(
+                    self.target_yerr
+                    if experiment.target_yerr is None
+                    else experiment.target_yerr
+                ),
+                parse_cpus=self.parse_cpus,
+                python_hash_seed=self.python_hash_seed,
+                relay_snapshot=self.relay_snapshot,
+                real_world_rov=(
+                    self.real_world_rov
+                    if experiment.real_world_rov and experiment.resample_rov
+                    else None
+                ),
+                **self.simulation_kwargs,
+            )
+            # So that every simulation uses the same relays
+            self.relay_snapshot = simulation.relay_snapshot_path
+            simulations.append(simulation)
+        return tuple(simulations)
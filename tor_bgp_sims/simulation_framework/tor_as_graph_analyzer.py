@@ -0,0 +1,102 @@
+from typing import Callable, Optional, TYPE_CHECKING
+
+from bgpy.as_graphs import AS
+from bgpy.enums import Plane
+from bgpy.simulation_engine import BaseSimulationEngine
+from bgpy.simulation_framework import ASGraphAnalyzer
+
+from .combined_as_graph_analyzer import CombinedASGraphAnalyzer
+
+if TYPE_CHECKING:
+    from bgpy.simulation_engine import Announcement as Ann
+    from bgpy.simulation_framework.scenarios import Scenario
+
+
+class TORASGraphAnalyzer(ASGraphAnalyzer):
+    """ASGraphAnalyzer that only traces back from a scenario's tracked ASes
+
+    The base analyzer finds the most specific announcement at every AS, and
+    traces back from every AS. When a TORScenario only tracks a few ASes
+    (ex: the exit's origin), only those ASes and the ASes along their data
+    plane paths are looked at, so the cost doesn't depend on the graph size.
+
+    Scenarios with legs (see ClientsToGuardExitToDestScenario) get the joint
+    outcomes from the CombinedASGraphAnalyzer
+
+    Scenarios without tracked ASes are analyzed the same as the base class
+    """
+
+    def __init__(
+        self,
+        engine: BaseSimulationEngine,
+        scenario: "Scenario",
+        data_plane_tracking: bool = True,
+        control_plane_tracking: bool = False,
+    ) -> None:
+        self.leg_scenarios: tuple["Scenario", ...] = (
+            scenario._get_leg_scenarios()
+            if hasattr(scenario, "_get_leg_scenarios")
+            else ()
+        )
+        self.tracked_asns: Optional[frozenset[int]] = getattr(
+            scenario, "_tracked_asns", None
+        )
+        if self.tracked_asns is None and not self.leg_scenarios:
+            super().__init__(
+                engine=engine,
+                scenario=scenario,
+                data_plane_tracking=data_plane_tracking,
+                control_plane_tracking=control_plane_tracking,
+            )
+            return
+
+        self.engine: BaseSimulationEngine = engine
+        self.scenario: "Scenario" = scenario
+        # Filled in as ASes are traced back through
+        self._most_specific_ann_dict: dict[AS, Optional["Ann"]] = _MostSpecificAnnDict(
+            self._get_most_specific_ann
+        )
+        self._data_plane_outcomes: dict[int, int] = dict()
+        self._control_plane_outcomes: dict[int, int] = dict()
+        self.outcomes: dict[int, dict[int, int]] = {
+            Plane.DATA.value: self._data_plane_outcomes,
+            Plane.CTRL.value: self._control_plane_outcomes,
+        }
+        self.data_plane_tracking: bool = data_plane_tracking
+        self.control_plane_tracking: bool = control_plane_tracking
+
+    def analyze(self) -> dict[int, dict[int, int]]:
+        """Traces back from the tracked ASes (or every AS if there are none)"""
+
+        if self.leg_scenarios:
+            return CombinedASGraphAnalyzer(
+                engine=self.engine,
+                scenario=self.scenario,
+                data_plane_tracking=self.data_plane_tracking,
+                control_plane_tracking=self.control_plane_tracking,
+            ).analyze()
+        elif self.tracked_asns is None:
+            return super().analyze()
+
+        as_dict = self.engine.as_graph.as_dict
+        for asn in self.tracked_asns:
+            as_obj = as_dict[asn]
+            if self.data_plane_tracking:
+                self._get_as_outcome_data_plane(as_obj)
+            if self.control_plane_tracking:
+                self._get_as_outcome_ctrl_plane(as_obj)
+            self._get_other_as_outcome_hook(as_obj)
+        return self.outcomes
+
+
+class _MostSpecificAnnDict(dict[AS, Optional["Ann"]]):
+    """Dict that looks up the most specific ann for an AS on first access"""
+
+    def __init__(self, get_most_specific_ann: Callable[[AS], Optional["Ann"]]) -> None:
+        super().__init__()
+        self._get_most_specific_ann = get_most_specific_ann
+
+    def __missing__(self, as_obj: AS) -> Optional["Ann"]:
+        ann = self._get_most_specific_ann(as_obj)
+        self[as_obj] = ann
+        return ann
@@ -0,0 +1,191 @@
+from collections import defaultdict
+from math import sqrt
+from typing import Any, Optional
+
+from bgpy.enums import Outcomes, Plane
+from bgpy.simulation_engine import BaseSimulationEngine
+from bgpy.simulation_framework import MetricTracker, Scenario
+from bgpy.simulation_framework.metric_tracker import DataKey, Metric
+from bgpy.simulation_framework.metric_tracker.metric_key import MetricKey
+
+
+class RunningStats:
+    """Running mean and variance of a metric's trials (Welford's algorithm)
+
+    This counts each trial once, without keeping every trial. So its yerr
+    isn't quite the CSV's: bgpy's MetricTracker.get_csv_rows sums the trials
+    starting from the first one, which counts the first trial twice. The
+    two yerrs differ by a fraction on the order of 1/num_trials, so with the
+    min_trials of adaptive runs (see TORSimulation), they're close
+    """
+
+    __slots__ = ("num_trials", "mean", "_sum_of_squares")
+
+    def __init__(self) -> None:
+        self.num_trials: int = 0
+        self.mean: float = 0
+        # Sum of the squared differences from the mean
+        self._sum_of_squares: float = 0
+
+    def add(self, value: float) -> None:
+        self.num_trials += 1
+        delta = value - self.mean
+        self.mean += delta / self.num_trials
+        self._sum_of_squares += delta * (value - self.mean)
+
+    @property
+    def variance(self) -> float:
+        """Sample variance, like statistics.variance"""
+
+        if self.num_trials < 2:
+            return 0
+        return self._sum_of_squares / (self.num_trials - 1)
+
+    @property
+    def yerr(self) -> float:
+        """Width of the 90% confidence interval, like MetricTracker._get_yerr
+
+        This is for the trials as they are, rather than with the first trial
+        counted twice like the CSV (see above)
+        """
+
+        if self.num_trials < 2:
+            return 0
+        return 1.645 * 2 * sqrt(self.variance) / sqrt(self.num_trials)
+
+
+class TORMetricTracker(MetricTracker):
+    """MetricTracker for TORScenarios
+
+    Scenarios with tracked ASes (see TORScenario._tracked_asns) only have
+    those ASes counted, rather than checking every AS in the graph against
+    the untracked ASes.
+
+    This can also combine weighted runs into a single trial. While
+    trial_weight is set, tracked metrics are held back. Then
+    merge_weighted_trial combines them into one metric per data key, using
+    the weighted mean of each percent, so that the results from each relay
+    equivalence class count as a single trial
+
+    The CSV and pickle rows also have the number of trials with data, since
+    adaptive runs (see TORSimulation.target_yerr) run more trials for some
+    percent adoptions than others
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # Weight of the runs currently being tracked (None to track normally)
+        self.trial_weight: Optional[float] = None
+        self._weighted_metrics: defaultdict[DataKey, list[tuple[float, Metric]]] = (
+            defaultdict(list)
+        )
+
+    def track_trial_metrics(self, **kwargs) -> None:  # type: ignore
+        """Tracks metrics, holding them back if trial_weight is set"""
+
+        if self.trial_weight is None:
+            return super().track_trial_metrics(**kwargs)
+
+        data = self.data
+        self.data = defaultdict(list)
+        try:
+            super().track_trial_metrics(**kwargs)
+        finally:
+            weighted_data, self.data = self.data, data
+        for data_key, metrics in weighted_data.items():
+            self._weighted_metrics[data_key].extend(
+                (self.trial_weight, metric) for metric in metrics
+            )
+
+    def get_csv_rows(self) -> list[dict[str, Any]]:
+        """Returns rows for a CSV, with the number of trials"""
+
+        rows = super().get_csv_rows()
+        for row, num_trials in zip(rows, self._get_num_trials(), strict=True):
+            row["num_trials"] = num_trials
+        return rows
+
+    def get_pickle_data(self):
+        """Returns the rows to pickle, with the number of trials"""
+
+        rows = super().get_pickle_data()
+        for row, num_trials in zip(rows, self._get_num_trials(), strict=True):
+            row["num_trials"] = num_trials
+        return rows
+
+    def _get_num_trials(self) -> list[int]:
+        """Returns the number of trials with data, in the order of the rows"""
+
+        return [
+            sum(1 for metric in metric_list if metric.percents.get(metric_key))
+            for metric_list in self.data.values()
+            for metric_key in sum(metric_list, start=metric_list[0]).percents
+        ]
+
+    def _populate_metrics(
+        self,
+        *,
+        metrics: list[Metric],
+        engine: BaseSimulationEngine,
+        scenario: Scenario,
+        outcomes: dict[int, dict[int, int]],
+    ) -> None:
+        """Populates all metrics with data from the tracked ASes"""
+
+        tracked_asns: Optional[frozenset[int]] = getattr(
+            scenario, "_tracked_asns", None
+        )
+        if tracked_asns is None:
+            return super()._populate_metrics(
+                metrics=metrics, engine=engine, scenario=scenario, outcomes=outcomes
+            )
+
+        ctrl_plane_outcomes = outcomes[Plane.CTRL.value]
+        data_plane_outcomes = outcomes[Plane.DATA.value]
+        for asn in tracked_asns:
+            as_obj = engine.as_graph.as_dict[asn]
+            for metric in metrics:
+                metric.add_data(
+                    as_obj=as_obj,
+                    engine=engine,
+                    scenario=scenario,
+                    ctrl_plane_outcome=ctrl_plane_outcomes.get(
+                        asn, Outcomes.UNDETERMINED.value
+                    ),
+                    data_plane_outcome=data_plane_outcomes.get(
+                        asn, Outcomes.UNDETERMINED.value
+                    ),
+                )
+        for metric in metrics:
+            metric.save_percents()
+
+    def merge_weighted_trial(self) -> None:
+        """Combines the held back metrics into one trial per data key
+
+        Runs without any data for a metric key (ex: no ASes in the group)
+        don't count towards its weighted mean
+        """
+
+        for data_key, weighted_metrics in self._weighted_metrics.items():
+            totals: dict[MetricKey, list[float]] = dict()
+            for weight, metric in weighted_metrics:
+                for metric_key, percents in metric.percents.items():
+                    total = totals.setdefault(metric_key, [0, 0])
+                    for percent in percents:
+                        total[0] += weight * percent
+                        total[1] += weight
+            first_metric = weighted_metrics[0][1]
+            self.data[data_key].append(
+                Metric(
+                    metric_key=first_metric.metric_key,
+                    as_classes_used=first_metric.as_classes_used,
+                    percents=defaultdict(
+                        list,
+                        {
+                            k: [weighted_sum / weight] if weight else []
+                            for k, (weighted_sum, weight) in totals.items()
+                        },
+                    ),
+                )
+            )
+        self._weighted_metrics.clear()
@@ -0,0 +1,869 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import dataclasses
+from enum import Enum
+import gc
+import hashlib
+import multiprocessing
+from multiprocessing.pool import Pool
+import os
+from pathlib import Path
+import pickle
+import random
+import re
+import shutil
+import socket
+import time
+from typing import Any, Hashable, Iterator, Mapping, Optional, Union
+
+from bgpy.as_graphs.base import ASGraph
+from bgpy.enums import ASGroups, Outcomes, Plane, SpecialPercentAdoptions
+from bgpy.simulation_engine import BaseSimulationEngine, Policy, SimulationEngine
+from bgpy.simulation_framework import GraphFactory, MetricTracker, Scenario, Simulation
+from bgpy.simulation_framework.as_graph_analyzers import BaseASGraphAnalyzer
+from bgpy.simulation_framework.metric_tracker import DataKey
+from bgpy.simulation_framework.metric_tracker.metric_key import MetricKey
+
+from ..scenarios import pin_relay_snapshot, RelayWeighting, TORScenario
+from ..tor_relay_collector import RelaySnapshot
+from ..utils import RealWorldROV
+from .tor_as_graph_analyzer import TORASGraphAnalyzer
+from .tor_metric_tracker import RunningStats, TORMetricTracker
+from .tor_simulation_engine import TORSimulationEngine
+
+# Engines for each graph, created once per process (see TORSimulation._get_engine)
+_engines: dict[str, BaseSimulationEngine] = dict()
+# SHA-256 of each relay snapshot, by path
+# (see TORSimulation._get_checkpoint_fingerprint)
+_relay_snapshot_digests: dict[Path, str] = dict()
+# Simulations that a worker runs chunks of, set once when it starts
+_worker_simulations: tuple["TORSimulation", ...] = ()
+
+
+class RelaySampling(Enum):
+    """How TORScenarios pick the relay for each trial"""
+
+    # A random relay from the group for every trial
+    RANDOM = "random"
+    # Every relay equivalence class once per trial, weighted by the chance of
+    # picking one of its relays (see TORScenario.relay_weighting)
+    EQUIVALENCE_CLASSES = "equivalence_classes"
+
+
+class TORSimulation(Simulation):
+    """Simulation for TORScenarios
+
+    The relay snapshot is pinned here, in the parent process, so that every
+    worker uses the same relays. By default, scenarios that only track a
+    few ASes (ex: the exit) only have those ASes traced back and counted,
+    and rounds that only need a few RIBs only propagate towards them.
+
+    With RelaySampling.EQUIVALENCE_CLASSES, relays that the scenario can't
+    tell apart (see TORScenario.relay_class_key) are only simulated once
+    per trial, rather than being picked (and propagated) over and over. All
+    classes get the same random state, so they share attackers and mostly
+    share adopters, and their results are combined into a single trial,
+    weighted by how likely each class is to be picked. This gives the same
+    estimate as picking a random relay every trial, for far fewer trials
+
+    Within a trial, rounds that give the same results for several scenario
+    configs (see TORScenario._get_cached_round_key) are only propagated and
+    analyzed for the first one. Scenarios that propagate many relays at
+    once (ex: BatchedClientsToGuardScenario) count each relay as a trial
+
+    With trials_per_checkpoint set, the trials are split into chunks of that
+    many trials per percent adoption, rather than one chunk per CPU. Each
+    chunk is seeded by its index and saved to checkpoint_dir once it's done,
+    so a run that's restarted (ex: after a preemption) skips the saved
+    chunks, and gives the same results as if it had never stopped. The
+    checkpoints are only for runs with the same settings, and are deleted
+    once the run finishes. Since the checkpoints are the same wherever
+    they're run, workers on many hosts can split the chunks between them
+    (see _run_claimed_chunk and ExperimentRunner.run_shard_worker)
+
+    With target_yerr set as well, num_trials is only the most trials to run
+    for each percent adoption. Each percent adoption's chunks are run a few
+    at a time, until the yerr (the width of the 90% confidence interval) of
+    each of the stopping_metric_keys is at most target_yerr for every
+    scenario config and propagation round. This happens after at least
+    min_trials trials. So noisy percent adoptions get more trials, and
+    ones that converge quickly get fewer. Only the chunks up to the one that
+    converged are merged, so the results don't depend on how many chunks
+    ran at once
+
+    With real_world_rov set, the ASes that deploy ROV are drawn again for
+    every trial (see RealWorldROV.draw), rather than hardcoding one draw for
+    the whole run. Each trial's draw is seeded by the trial, so every
+    scenario config and percent adoption gets the same ROV ASes for it
+
+    With parse_cpus, the engine and relays are built once in the parent,
+    and the workers share them (see get_shared_worker_pool)
+    """
+
+    def __init__(
+        self,
+        *,
+        relay_sampling: RelaySampling = RelaySampling.RANDOM,
+        relay_snapshot: Optional[Union[RelaySnapshot, Path]] = None,
+        trials_per_checkpoint: Optional[int] = None,
+        target_yerr: Optional[float] = None,
+        min_trials: int = 50,
+        stopping_metric_keys: tuple[MetricKey, ...] = (
+            MetricKey(
+                plane=Plane.DATA,
+                as_group=ASGroups.ALL_WOUT_IXPS,
+                outcome=Outcomes.ATTACKER_SUCCESS,
+                # For all of the ASes, whatever their policy
+                PolicyCls=Policy,
+            ),
+        ),
+        real_world_rov: Optional[RealWorldROV] = None,
+        MetricTrackerCls: type[MetricTracker] = TORMetricTracker,
+        ASGraphAnalyzerCls: type[BaseASGraphAnalyzer] = TORASGraphAnalyzer,
+        SimulationEngineCls: type[BaseSimulationEngine] = TORSimulationEngine,
+        **kwargs,
+    ) -> None:
+        self.relay_sampling: RelaySampling = relay_sampling
+        self.trials_per_checkpoint: Optional[int] = trials_per_checkpoint
+        self.target_yerr: Optional[float] = target_yerr
+        self.min_trials: int = min_trials
+        self.stopping_metric_keys: tuple[MetricKey, ...] = stopping_metric_keys
+        self.real_world_rov: Optional[RealWorldROV] = real_world_rov
+        # Set on first use, since it hashes every setting (see checkpoint_dir)
+        self._checkpoint_fingerprint: Optional[str] = None
+        assert (
+            target_yerr is None or trials_per_checkpoint is not None
+        ), "target_yerr requires trials_per_checkpoint"
+        # Running stats of each percent adoption's first chunks, and how many
+        # chunks they're for (see _get_num_merged_chunks)
+        self._running_stats: dict[
+            Union[float, SpecialPercentAdoptions],
+            dict[tuple[DataKey, MetricKey], RunningStats],
+        ] = defaultdict(dict)
+        self._num_chunks_in_running_stats: dict[
+            Union[float, SpecialPercentAdoptions], int
+        ] = defaultdict(int)
+        self._num_merged_chunks: dict[Union[float, SpecialPercentAdoptions], int] = (
+            dict()
+        )
+        # Defaults to today's relays
+        self.relay_snapshot_path: Path = pin_relay_snapshot(relay_snapshot)
+        super().__init__(
+            MetricTrackerCls=MetricTrackerCls,
+            ASGraphAnalyzerCls=ASGraphAnalyzerCls,
+            SimulationEngineCls=SimulationEngineCls,
+            **kwargs,
+        )
+        if self.relay_sampling == RelaySampling.EQUIVALENCE_CLASSES:
+            assert issubclass(
+                self.MetricTrackerCls, TORMetricTracker
+            ), "Equivalence class sampling requires a TORMetricTracker"
+
+    def run(
+        self,
+        GraphFactoryCls: Optional[type[GraphFactory]] = GraphFactory,
+        graph_factory_kwargs=None,
+    ) -> None:
+        """Runs the simulation and writes the data, then deletes the checkpoints"""
+
+        super().run(
+            GraphFactoryCls=GraphFactoryCls, graph_factory_kwargs=graph_factory_kwargs
+        )
+        if self.trials_per_checkpoint is not None:
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+    def _get_data(self) -> MetricTracker:
+        """Runs the chunks that aren't checkpointed yet, and merges them all
+
+        The chunks are always merged in the same order, whether they were
+        run now or loaded, so that resumed runs give the same results.
+        Adaptive runs only know which chunks they need next once the last
+        ones are done, so they're run in rounds
+        """
+
+        if self.trials_per_checkpoint is None:
+            metric_tracker: MetricTracker = super()._get_data()
+            return metric_tracker
+
+        remaining_chunks = self._get_remaining_chunks()
+        # No need to start workers if there's at most one chunk left
+        if self.parse_cpus == 1 or (
+            len(remaining_chunks) <= 1 and self.target_yerr is None
+        ):
+            while remaining_chunks:
+                for chunk_id, chunk in remaining_chunks:
+                    self._run_checkpointed_chunk(chunk_id, chunk)
+                remaining_chunks = self._get_remaining_chunks()
+        else:
+            with get_shared_worker_pool((self,), self.parse_cpus) as p:
+                while remaining_chunks:
+                    p.starmap(
+                        _run_worker_chunk,
+                        [(0, chunk_id, chunk) for chunk_id, chunk in remaining_chunks],
+                        chunksize=1,
+                    )
+                    remaining_chunks = self._get_remaining_chunks()
+
+        metric_tracker = self.MetricTrackerCls(metric_keys=self.metric_keys)
+        for chunk_id in self._get_merged_chunk_ids():
+            with self._get_checkpoint_path(chunk_id).open("rb") as f:
+                metric_tracker = metric_tracker + pickle.load(f)
+        return metric_tracker
+
+    def _get_mp_results(self, parse_cpus: int) -> list[MetricTracker]:
+        """Gets results from workers that share the engine and relays"""
+
+        with get_shared_worker_pool((self,), parse_cpus) as p:
+            results = p.starmap(
+                _run_worker_chunk,
+                [
+                    (0, chunk_id, chunk)
+                    for chunk_id, chunk in enumerate(self._get_chunks(parse_cpus))
+                ],
+            )
+        metric_trackers = [x for x in results if x is not None]
+        assert len(metric_trackers) == len(results), "Chunks were checkpointed"
+        return metric_trackers
+
+    def _get_remaining_chunks(
+        self,
+    ) -> list[tuple[int, list[tuple[Union[float, SpecialPercentAdoptions], int]]]]:
+        """Returns the chunks (and their IDs) that aren't checkpointed yet
+
+        For adaptive runs, these are only the next few chunks of each percent
+        adoption that hasn't converged yet, enough to keep parse_cpus busy
+        """
+
+        assert self.trials_per_checkpoint is not None, "Only for checkpointed runs"
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        chunks = self._get_chunks(self.parse_cpus)
+        if self.target_yerr is None:
+            remaining_chunks = [
+                (chunk_id, chunk)
+                for chunk_id, chunk in enumerate(chunks)
+                if not self._get_checkpoint_path(chunk_id).exists()
+            ]
+            if 0 < len(remaining_chunks) < len(chunks):
+                print(
+                    f"Resuming from {len(chunks) - len(remaining_chunks)} of "
+                    f"{len(chunks)} checkpointed chunks in {self.checkpoint_dir}"
+                )
+            return remaining_chunks
+
+        unconverged_chunk_ids = [
+            chunk_ids[self._num_chunks_in_running_stats[percent_adopt] :]
+            for percent_adopt, chunk_ids in self._get_percent_adopt_chunk_ids().items()
+            if self._get_num_merged_chunks(percent_adopt, chunk_ids) is None
+        ]
+        chunks_per_percent_adopt = max(
+            1, self.parse_cpus // max(1, len(unconverged_chunk_ids))
+        )
+        return [
+            (chunk_id, chunks[chunk_id])
+            for chunk_ids in unconverged_chunk_ids
+            for chunk_id in [
+                x for x in chunk_ids if not self._get_checkpoint_path(x).exists()
+            ][:chunks_per_percent_adopt]
+        ]
+
+    def _get_merged_chunk_ids(self) -> list[int]:
+        """Returns the IDs of the chunks to merge, in order
+
+        For adaptive runs, these are each percent adoption's chunks up to
+        the one that converged, and how many trials that took is printed
+        """
+
+        if self.target_yerr is None:
+            return list(range(len(self._get_chunks(self.parse_cpus))))
+
+        chunks = self._get_chunks(self.parse_cpus)
+        merged_chunk_ids = list()
+        for percent_adopt, chunk_ids in self._get_percent_adopt_chunk_ids().items():
+            num_merged_chunks = self._get_num_merged_chunks(percent_adopt, chunk_ids)
+            assert num_merged_chunks is not None, f"{percent_adopt} isn't done yet"
+            merged_chunk_ids.extend(chunk_ids[:num_merged_chunks])
+            num_trials = sum(len(chunks[x]) for x in chunk_ids[:num_merged_chunks])
+            yerr = max(
+                (x.yerr for x in self._running_stats[percent_adopt].values()),
+                default=0,
+            )
+            print(
+                f"{percent_adopt} stopped after {num_trials} trials, "
+                f"with a yerr of at most {yerr:.2f}"
+            )
+        return sorted(merged_chunk_ids)
+
+    def _get_percent_adopt_chunk_ids(
+        self,
+    ) -> dict[Union[float, SpecialPercentAdoptions], list[int]]:
+        """Returns the IDs of each percent adoption's chunks, in order"""
+
+        percent_adopt_chunk_ids: dict[Union[float, SpecialPercentAdoptions], list[int]]
+        percent_adopt_chunk_ids = defaultdict(list)
+        for chunk_id, chunk in enumerate(self._get_chunks(self.parse_cpus)):
+            percent_adopt, _trial = chunk[0]
+            percent_adopt_chunk_ids[percent_adopt].append(chunk_id)
+        return percent_adopt_chunk_ids
+
+    def _get_num_merged_chunks(
+        self,
+        percent_adopt: Union[float, SpecialPercentAdoptions],
+        chunk_ids: list[int],
+    ) -> Optional[int]:
+        """Returns how many of the chunks to merge, or None if it needs more
+
+        The chunks' stopping metrics are added to the running stats in order,
+        until the yerrs are at most target_yerr (or there are no chunks
+        left). So this only depends on which chunks are checkpointed, and
+        the chunks after the one that converged (ex: ones that were already
+        running) are never merged
+        """
+
+        assert self.target_yerr is not None, "Only for adaptive runs"
+        if percent_adopt in self._num_merged_chunks:
+            return self._num_merged_chunks[percent_adopt]
+
+        running_stats = self._running_stats[percent_adopt]
+        stopping_metric_keys = frozenset(self.stopping_metric_keys)
+        for num_chunks in range(
+            self._num_chunks_in_running_stats[percent_adopt] + 1, len(chunk_ids) + 1
+        ):
+            path = self._get_checkpoint_path(chunk_ids[num_chunks - 1])
+            if not path.exists():
+                return None
+            with path.open("rb") as f:
+                metric_tracker: MetricTracker = pickle.load(f)
+            for data_key, metrics in metric_tracker.data.items():
+                for metric in metrics:
+                    for metric_key, percents in metric.percents.items():
+                        if metric_key in stopping_metric_keys:
+                            stats = running_stats.get((data_key, metric_key))
+                            if stats is None:
+                                stats = RunningStats()
+                                running_stats[(data_key, metric_key)] = stats
+                            for percent in percents:
+                                stats.add(percent)
+            self._num_chunks_in_running_stats[percent_adopt] = num_chunks
+
+            assert self.trials_per_checkpoint is not None, "for mypy"
+            if (
+                num_chunks * self.trials_per_checkpoint >= self.min_trials
+                and running_stats
+                and all(
+                    x.num_trials > 1 and x.yerr <= self.target_yerr
+                    for x in running_stats.values()
+                )
+            ):
+                self._num_merged_chunks[percent_adopt] = num_chunks
+                return num_chunks
+        # Every chunk is done, so it's as close as num_trials gets
+        self._num_merged_chunks[percent_adopt] = len(chunk_ids)
+        return len(chunk_ids)
+
+    def _get_chunks(
+        self, cpus: int
+    ) -> list[list[tuple[Union[float, SpecialPercentAdoptions], int]]]:
+        """Returns chunks of trials_per_checkpoint trials, if it's set
+
+        Unlike the base class, these don't depend on the number of CPUs, so
+        each chunk's seed (its index) doesn't either
+        """
+
+        if self.trials_per_checkpoint is None:
+            return super()._get_chunks(cpus)
+        return [
+            [
+                (percent_adopt, trial)
+                for trial in range(
+                    start, min(start + self.trials_per_checkpoint, self.num_trials)
+                )
+            ]
+            for percent_adopt in self.percent_adoptions
+            for start in range(0, self.num_trials, self.trials_per_checkpoint)
+        ]
+
+    def _run_checkpointed_chunk(
+        self,
+        chunk_id: int,
+        percent_adopt_trials: list[tuple[Union[float, SpecialPercentAdoptions], int]],
+    ) -> None:
+        """Runs a chunk and saves its metrics to its checkpoint
+
+        These aren't returned, since the parent process loads every chunk
+        from its checkpoint anyways
+        """
+
+        metric_tracker = self._run_chunk(chunk_id, percent_adopt_trials)
+        path = self._get_checkpoint_path(chunk_id)
+        # Written in full before it's moved, so a crash never leaves half of one
+        # (and named by the worker, so two workers never write to the same one)
+        tmp_path = path.with_name(f"{path.stem}.{_get_worker_id()}.tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(metric_tracker, f)
+        os.replace(tmp_path, path)
+
+    def _run_claimed_chunk(
+        self,
+        chunk_id: int,
+        percent_adopt_trials: list[tuple[Union[float, SpecialPercentAdoptions], int]],
+        claim_timeout: float,
+    ) -> bool:
+        """Runs and checkpoints the chunk if no other worker has claimed it
+
+        Returns whether it was run. The claim is released once the chunk is
+        checkpointed (see _claim_chunk)
+        """
+
+        if self._get_checkpoint_path(chunk_id).exists() or not self._claim_chunk(
+            chunk_id, claim_timeout
+        ):
+            return False
+        try:
+            self._run_checkpointed_chunk(chunk_id, percent_adopt_trials)
+        finally:
+            self._get_claim_path(chunk_id).unlink(missing_ok=True)
+        return True
+
+    def _claim_chunk(self, chunk_id: int, claim_timeout: float) -> bool:
+        """Claims the chunk for this worker, and returns whether it could
+
+        A claim is a file that's created only if it doesn't exist yet, which
+        is atomic on local and network filesystems, so only one worker gets
+        it. Claims that are older than claim_timeout, or that are from a
+        process on this host that has died, are taken over. At worst, two
+        workers run the same chunk, which gives the same checkpoint anyways
+        """
+
+        path = self._get_claim_path(chunk_id)
+        if self._is_stale_claim(path, claim_timeout):
+            print(f"Taking over the stale claim {path}")
+            path.unlink(missing_ok=True)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(_get_worker_id())
+        return True
+
+    @staticmethod
+    def _is_stale_claim(path: Path, claim_timeout: float) -> bool:
+        """Returns whether the claim's worker has timed out or died"""
+
+        try:
+            age = time.time() - path.stat().st_mtime
+            hostname, pid = path.read_text().rsplit(".", 1)
+        except (FileNotFoundError, ValueError):
+            # Either there's no claim, or it's still being written
+            return False
+        if age > claim_timeout:
+            return True
+        elif hostname == socket.gethostname():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return False
+
+    def _get_claim_path(self, chunk_id: int) -> Path:
+        return self.checkpoint_dir / f"chunk_{chunk_id}.claim"
+
+    @property
+    def checkpoint_dir(self) -> Path:
+        """Directory of the checkpoints for runs with these settings
+
+        The settings are only hashed the first time, so they mustn't change
+        after that
+        """
+
+        if self._checkpoint_fingerprint is None:
+            self._checkpoint_fingerprint = self._get_checkpoint_fingerprint()
+        return self.output_dir / f"checkpoints_{self._checkpoint_fingerprint}"
+
+    def _get_checkpoint_path(self, chunk_id: int) -> Path:
+        return self.checkpoint_dir / f"chunk_{chunk_id}.pickle"
+
+    def _get_checkpoint_fingerprint(self) -> str:
+        """Returns a hash of the settings the checkpoints depend on
+
+        Runs with other settings (ex: another num_trials) use other
+        checkpoints, rather than merging results that don't belong together
+        """
+
+        settings: tuple[Any, ...] = (
+            self.scenario_configs,
+            self.percent_adoptions,
+            self.num_trials,
+            self.trials_per_checkpoint,
+            self.python_hash_seed,
+            self.relay_sampling,
+            self.real_world_rov,
+            # Rather than the path, which can differ between hosts
+            _get_relay_snapshot_digest(self.relay_snapshot_path),
+            self.as_graph_constructor_kwargs,
+            self.ASGraphConstructorCls,
+            self.SimulationEngineCls,
+            self.ASGraphAnalyzerCls,
+            self.MetricTrackerCls,
+            self.data_plane_tracking,
+            self.control_plane_tracking,
+            self.metric_keys,
+        )
+        description = _get_stable_repr(settings)
+        return hashlib.sha256(description.encode()).hexdigest()[:16]
+
+    def _run_chunk(
+        self,
+        chunk_id: int,
+        percent_adopt_trials: list[tuple[Union[float, SpecialPercentAdoptions], int]],
+    ) -> MetricTracker:
+        """Runs a chunk of trial inputs"""
+
+        # Must also seed randomness here since we don't want multiproc to be the same
+        self._seed_random(seed_suffix=str(chunk_id))
+
+        engine = self._get_engine()
+        metric_tracker = self.MetricTrackerCls(metric_keys=self.metric_keys)
+
+        if self.relay_sampling == RelaySampling.RANDOM:
+            # Same as the base class, but with the process's engine
+            for percent_adopt, trial in percent_adopt_trials:
+                scenario_kwargs = self._get_trial_scenario_kwargs(trial)
+                prev_scenario: Optional[Scenario] = None
+                for scenario_config in self.scenario_configs:
+                    assert scenario_config.ScenarioCls, "ScenarioCls is None"
+                    scenario = scenario_config.ScenarioCls(
+                        scenario_config=scenario_config,
+                        percent_adoption=percent_adopt,
+                        engine=engine,
+                        prev_scenario=prev_scenario,
+                        preprocess_anns_func=scenario_config.preprocess_anns_func,
+                        **scenario_kwargs,
+                    )
+
+                    self._print_progress(percent_adopt, scenario, trial)
+
+                    scenario.setup_engine(engine, prev_scenario)
+                    for propagation_round in range(scenario_config.propagation_rounds):
+                        self._single_engine_run(
+                            engine=engine,
+                            percent_adopt=percent_adopt,
+                            trial=trial,
+                            scenario=scenario,
+                            propagation_round=propagation_round,
+                            metric_tracker=metric_tracker,
+                        )
+                    prev_scenario = scenario
+            return metric_tracker
+
+        assert isinstance(metric_tracker, TORMetricTracker), "for mypy"
+        for percent_adopt, trial in percent_adopt_trials:
+            scenario_kwargs = self._get_trial_scenario_kwargs(trial)
+            # So that every relay class gets the same attackers/adopters
+            random_state = random.getstate()
+            # Chained across configs per relay class, like the base class
+            prev_scenarios: dict[Hashable, TORScenario] = dict()
+            for scenario_config in self.scenario_configs:
+                ScenarioCls = scenario_config.ScenarioCls
+                assert ScenarioCls and issubclass(
+                    ScenarioCls, TORScenario
+                ), "Equivalence class sampling only works for TORScenarios"
+                relay_classes = ScenarioCls.get_relay_equivalence_classes(
+                    scenario_config.AdoptPolicyCls
+                )
+                relay_position = ScenarioCls.get_relay_position(
+                    scenario_config.AdoptPolicyCls
+                )
+                class_weights = [
+                    sum(
+                        ScenarioCls.get_relay_weight(x, relay_position)
+                        for x in relay_class.relays
+                    )
+                    for relay_class in relay_classes
+                ]
+                total_weight = sum(class_weights)
+                for relay_class, class_weight in zip(relay_classes, class_weights):
+                    random.setstate(random_state)
+                    scenario = ScenarioCls(
+                        scenario_config=scenario_config,
+                        percent_adoption=percent_adopt,
+                        engine=engine,
+                        prev_scenario=prev_scenarios.get(relay_class.key),
+                        preprocess_anns_func=scenario_config.preprocess_anns_func,
+                        tor_relay=relay_class.relay,
+                        **scenario_kwargs,
+                    )
+                    prev_scenarios[relay_class.key] = scenario
+
+                    self._print_progress(percent_adopt, scenario, trial)
+
+                    scenario.setup_engine(engine, None)
+                    metric_tracker.trial_weight = class_weight / total_weight
+                    for propagation_round in range(scenario_config.propagation_rounds):
+                        self._single_engine_run(
+                            engine=engine,
+                            percent_adopt=percent_adopt,
+                            trial=trial,
+                            scenario=scenario,
+                            propagation_round=propagation_round,
+                            metric_tracker=metric_tracker,
+                        )
+                metric_tracker.trial_weight = None
+                metric_tracker.merge_weighted_trial()
+
+        return metric_tracker
+
+    def _get_trial_scenario_kwargs(self, trial: int) -> dict[str, Any]:
+        """Returns the kwargs for every scenario of the trial
+
+        This is the ROV ASes of the trial, if real_world_rov is set. They're
+        drawn with their own Random, so the scenarios' random state is the
+        same as without them
+        """
+
+        if self.real_world_rov is None:
+            return dict()
+        seed = (
+            None
+            if self.python_hash_seed is None
+            else f"{self.python_hash_seed}.{trial}"
+        )
+        return {
+            "rov_asn_cls_dict": self.real_world_rov.draw(random.Random(seed).random)
+        }
+
+    def _collect_engine_run_data(
+        self,
+        engine: SimulationEngine,
+        percent_adopt: Union[float, SpecialPercentAdoptions],
+        trial: int,
+        scenario: Scenario,
+        propagation_round: int,
+        metric_tracker: MetricTracker,
+    ) -> dict[int, dict[int, int]]:
+        """Tracks the metrics, reusing the outcomes if the round was cached
+
+        Scenarios that propagate many relays at once are analyzed and
+        tracked once per relay (see TORScenario._get_relay_scenarios), and
+        the last relay's outcomes are returned
+        """
+
+        relay_scenarios: tuple[Scenario, ...] = (
+            scenario._get_relay_scenarios()
+            if isinstance(scenario, TORScenario)
+            else (scenario,)
+        )
+        for relay_scenario in relay_scenarios:
+            cached_round = None
+            if isinstance(relay_scenario, TORScenario):
+                cached_round = relay_scenario._get_cached_round(propagation_round)
+            if cached_round and cached_round.outcomes is not None:
+                outcomes = cached_round.outcomes
+            else:
+                outcomes = self.ASGraphAnalyzerCls(
+                    engine=engine,
+                    scenario=relay_scenario,
+                    data_plane_tracking=self.data_plane_tracking,
+                    control_plane_tracking=self.control_plane_tracking,
+                ).analyze()
+                if cached_round:
+                    cached_round.outcomes = outcomes
+
+            # The metrics can still differ, since they depend on the policies
+            metric_tracker.track_trial_metrics(
+                engine=engine,
+                percent_adopt=percent_adopt,
+                trial=trial,
+                scenario=relay_scenario,
+                propagation_round=propagation_round,
+                outcomes=outcomes,
+            )
+        return outcomes
+
+    def _get_engine(self) -> BaseSimulationEngine:
+        """Returns the engine, which must be created within each process
+
+        Each process only creates it once, and reuses it for every chunk of
+        every simulation with the same graph (ex: within an ExperimentRunner),
+        since setting up each scenario replaces every AS's policy anyways
+        """
+
+        key = _get_stable_repr(
+            (
+                self.SimulationEngineCls,
+                self.ASGraphConstructorCls,
+                self.as_graph_constructor_kwargs,
+            )
+        )
+        if key not in _engines:
+            constructor_kwargs = dict(self.as_graph_constructor_kwargs)
+            constructor_kwargs["tsv_path"] = None
+            as_graph: ASGraph = self.ASGraphConstructorCls(**constructor_kwargs).run()
+            _engines[key] = self.SimulationEngineCls(
+                as_graph,
+                cached_as_graph_tsv_path=self.as_graph_constructor_kwargs.get(
+                    "tsv_path"
+                ),
+            )
+        return _engines[key]
+
+    def _build_shared_state(self) -> None:
+        """Builds what the workers only read, so forked workers can share it
+
+        This is the engine, and the relays for each scenario config (along
+        with their equivalence classes or alias tables). The rest (ex: the
+        ROV ASNs in each hardcoded_asn_cls_dict, or real_world_rov) is
+        already in the simulation
+        """
+
+        self._get_engine()
+        for scenario_config in self.scenario_configs:
+            ScenarioCls = scenario_config.ScenarioCls
+            if not (ScenarioCls and issubclass(ScenarioCls, TORScenario)):
+                continue
+            AdoptPolicyCls = scenario_config.AdoptPolicyCls
+            ScenarioCls.get_tor_relays(AdoptPolicyCls)
+            if self.relay_sampling == RelaySampling.EQUIVALENCE_CLASSES:
+                ScenarioCls.get_relay_equivalence_classes(AdoptPolicyCls)
+            elif ScenarioCls.relay_weighting != RelayWeighting.UNIFORM:
+                ScenarioCls.get_relay_alias_table(AdoptPolicyCls)
+
+
+@contextmanager
+def get_shared_worker_pool(
+    simulations: tuple[TORSimulation, ...],
+    processes: int,
+) -> Iterator[Pool]:
+    """Yields a pool of workers that run chunks of the simulations
+
+    The workers call _run_worker_chunk with the index of the simulation.
+    The simulations' engines and relays (see _build_shared_state) are built
+    once in the parent, and then forked workers share them copy-on-write,
+    rather than each worker building its own. To keep those pages shared,
+    the gc is disabled while they're built (so that collections don't leave
+    holes in them that later objects fill), and they're frozen before the
+    fork (so that collections in the workers don't write to them). Objects
+    that are used still have their refcounts written to, but most of the
+    graph (ex: customer cones) isn't used by most trials.
+
+    Without fork (ex: on Windows), each worker builds its own
+    """
+
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for simulation in simulations:
+            simulation._build_shared_state()
+        # PyPy's gc has no freeze
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+        context = multiprocessing.get_context(
+            "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+        )
+        # Pool is much faster than ProcessPoolExecutor
+        with context.Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(simulations,),
+        ) as p:
+            yield p
+    finally:
+        if hasattr(gc, "unfreeze"):
+            gc.unfreeze()
+        if gc_was_enabled:
+            gc.enable()
+
+
+def _init_worker(simulations: tuple[TORSimulation, ...]) -> None:
+    """Stores the simulations in the worker, so they're only sent once
+
+    With fork, they aren't sent at all. The gc is disabled in the parent
+    for the fork, so it's enabled again here
+    """
+
+    global _worker_simulations
+    _worker_simulations = simulations
+    gc.enable()
+
+
+def _run_worker_chunk(
+    simulation_index: int,
+    chunk_id: int,
+    percent_adopt_trials: list[tuple[Union[float, SpecialPercentAdoptions], int]],
+) -> Optional[MetricTracker]:
+    """Runs a chunk of one of the worker's simulations
+
+    Chunks of checkpointed simulations are saved rather than returned
+    """
+
+    simulation = _worker_simulations[simulation_index]
+    if simulation.trials_per_checkpoint is None:
+        return simulation._run_chunk(chunk_id, percent_adopt_trials)
+    simulation._run_checkpointed_chunk(chunk_id, percent_adopt_trials)
+    return None
+
+
+def _run_claimed_worker_chunk(
+    simulation_index: int,
+    chunk_id: int,
+    percent_adopt_trials: list[tuple[Union[float, SpecialPercentAdoptions], int]],
+    claim_timeout: float,
+) -> bool:
+    """Runs a chunk of one of the worker's simulations, if it can claim it"""
+
+    return _worker_simulations[simulation_index]._run_claimed_chunk(
+        chunk_id, percent_adopt_trials, claim_timeout
+    )
+
+
+def _get_worker_id() -> str:
+    """Returns an ID for this process that's unique across hosts"""
+
+    return f"{socket.gethostname()}.{os.getpid()}"
+
+
+def _get_relay_snapshot_digest(path: Path) -> str:
+    """Returns the SHA-256 of the relay snapshot"""
+
+    path = path.resolve()
+    if path not in _relay_snapshot_digests:
+        _relay_snapshot_digests[path] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return _relay_snapshot_digests[path]
+
+
+def _get_stable_repr(obj: Any) -> str:
+    """Returns a repr that's the same in every process, for the same obj
+
+    Sets and dicts are sorted, since their order can change (ex: once
+    they're pickled), and the addresses that change every run are removed
+    (ex: of functions such as a ScenarioConfig's preprocess_anns_func)
+    """
+
+    return re.sub(r" at 0x[0-9a-f]+", "", _get_sorted_repr(obj))
+
+
+def _get_sorted_repr(obj: Any) -> str:
+    """Returns the repr, with every set and dict within it sorted"""
+
+    if isinstance(obj, (set, frozenset)):
+        items = sorted(_get_sorted_repr(x) for x in obj)
+        return f"{type(obj).__name__}({{{', '.join(items)}}})"
+    elif isinstance(obj, Mapping):
+        items = sorted(
+            f"{_get_sorted_repr(k)}: {_get_sorted_repr(v)}" for k, v in obj.items()
+        )
+        return f"{type(obj).__name__}({{{', '.join(items)}}})"
+    elif isinstance(obj, (tuple, list)):
+        items = [_get_sorted_repr(x) for x in obj]
+        return f"{type(obj).__name__}([{', '.join(items)}])"
+    elif dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        items = [
+            f"{x.name}={_get_sorted_repr(getattr(obj, x.name))}"
+            for x in dataclasses.fields(obj)
+            if x.repr
+        ]
+        return f"{type(obj).__name__}({', '.join(items)})"
+    else:
+        return repr(obj)
@@ -0,0 +1,148 @@
+from typing import Iterable, Mapping, Optional, TYPE_CHECKING
+
+from bgpy.as_graphs import AS, ASGraph
+from bgpy.enums import Relationships
+from bgpy.simulation_engine import SimulationEngine
+
+if TYPE_CHECKING:
+    from bgpy.simulation_framework import Scenario
+
+
+class TORSimulationEngine(SimulationEngine):
+    """SimulationEngine that can propagate within only part of the graph
+
+    If a scenario only needs exact RIBs at a few ASes after a round (see
+    TORScenario._get_propagation_target_asns), only the ASes on valley free
+    paths from the seeded ASes to those ASes process announcements. Every
+    other scenario propagates over the whole graph, the same as the base
+    class. Rounds that an earlier scenario in the trial already cached (see
+    TORScenario._get_cached_round) aren't propagated at all
+    """
+
+    def _propagate(self, propagation_round: int, scenario: "Scenario"):
+        """Propogates announcements, pruning the graph if the scenario can"""
+
+        # An earlier scenario in the trial already left everything behind
+        if hasattr(scenario, "_get_cached_round"):
+            cached_round = scenario._get_cached_round(propagation_round)
+            if cached_round and cached_round.complete:
+                return
+
+        target_asns: Optional[frozenset[int]] = None
+        if hasattr(scenario, "_get_propagation_target_asns"):
+            target_asns = scenario._get_propagation_target_asns(propagation_round)
+        if target_asns is None:
+            return super()._propagate(propagation_round, scenario)
+
+        propagation_ranks = get_valley_free_propagation_ranks(
+            self.as_graph,
+            frozenset(
+                x.seed_asn for x in scenario.announcements if x.seed_asn is not None
+            ),
+            target_asns,
+        )
+
+        # Same as the base class, but with the pruned propagation ranks
+        for i, rank in enumerate(propagation_ranks):
+            if i > 0:
+                for as_obj in rank:
+                    as_obj.policy.process_incoming_anns(
+                        from_rel=Relationships.CUSTOMERS,
+                        propagation_round=propagation_round,
+                        scenario=scenario,
+                    )
+            for as_obj in rank:
+                as_obj.policy.propagate_to_providers()
+
+        for rank in propagation_ranks:
+            for as_obj in rank:
+                as_obj.policy.propagate_to_peers()
+        for rank in propagation_ranks:
+            for as_obj in rank:
+                as_obj.policy.process_incoming_anns(
+                    from_rel=Relationships.PEERS,
+                    propagation_round=propagation_round,
+                    scenario=scenario,
+                )
+
+        for i, rank in enumerate(reversed(propagation_ranks)):
+            if i > 0:
+                for as_obj in rank:
+                    as_obj.policy.process_incoming_anns(
+                        from_rel=Relationships.PROVIDERS,
+                        propagation_round=propagation_round,
+                        scenario=scenario,
+                    )
+            for as_obj in rank:
+                as_obj.policy.propagate_to_customers()
+
+
+def get_valley_free_propagation_ranks(
+    as_graph: ASGraph,
+    source_asns: Iterable[int],
+    target_asns: Iterable[int],
+) -> tuple[tuple[AS, ...], ...]:
+    """Returns the propagation ranks with only the ASes between the ASNs
+
+    These are the ASes on a valley free path from a source to a target.
+    Every announcement that reaches a target only passes through these ASes,
+    and since an AS always prefers customer routes (which it can export
+    anywhere) to peer and provider routes, their best routes only ever come
+    from each other. So propagating within them gives the targets the same
+    RIBs as the full graph, as long as the policies don't drop valid
+    announcements (ex: ROV is fine, since it only drops invalid ones)
+
+    Both searches only walk up the graph from the sources and targets,
+    which are small compared to the graph
+    """
+
+    as_dict = as_graph.as_dict
+    # ASes with a customer route from a source (or that are a source)
+    up_from_source = _get_ancestor_asns(as_dict, source_asns)
+    # ASes that can reach a target going only to customers
+    down_to_target = _get_ancestor_asns(as_dict, target_asns)
+
+    def rank_key(asn: int) -> int:
+        rank = as_dict[asn].propagation_rank
+        assert rank is not None, "for mypy"
+        return -rank
+
+    # Sorted from the top of the graph, so that providers are checked first
+    # ASes with a customer route that can still reach a target
+    up_to_target: set[int] = set()
+    for asn in sorted(up_from_source, key=rank_key):
+        as_obj = as_dict[asn]
+        if (
+            asn in down_to_target
+            or any(x.asn in down_to_target for x in as_obj.peers)
+            or any(x.asn in up_to_target for x in as_obj.providers)
+        ):
+            up_to_target.add(asn)
+    # ASes with a peer or provider route that can still reach a target
+    down_from_source: set[int] = set()
+    for asn in sorted(down_to_target, key=rank_key):
+        as_obj = as_dict[asn]
+        if any(x.asn in up_from_source for x in as_obj.peers) or any(
+            x.asn in up_from_source or x.asn in down_from_source
+            for x in as_obj.providers
+        ):
+            down_from_source.add(asn)
+
+    pruned_asns = up_to_target | down_from_source
+    return tuple(
+        tuple(x for x in rank if x.asn in pruned_asns)
+        for rank in as_graph.propagation_ranks
+    )
+
+
+def _get_ancestor_asns(as_dict: Mapping[int, AS], asns: Iterable[int]) -> set[int]:
+    """Returns the ASNs and all of their providers' ASNs, recursively"""
+
+    ancestors = set(asns)
+    stack = list(ancestors)
+    while stack:
+        for provider in as_dict[stack.pop()].providers:
+            if provider.asn not in ancestors:
+                ancestors.add(provider.asn)
+                stack.append(provider.asn)
+    return ancestors
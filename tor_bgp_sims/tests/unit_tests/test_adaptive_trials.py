@@ -0,0 +1,108 @@
+from collections import defaultdict
+import pickle
+import statistics
+
+import pytest
+
+from bgpy.enums import ASGroups, Outcomes, Plane
+from bgpy.simulation_engine import Policy
+from bgpy.simulation_framework import ScenarioConfig
+from bgpy.simulation_framework.metric_tracker import DataKey, Metric
+from bgpy.simulation_framework.metric_tracker.metric_key import MetricKey
+
+from tor_bgp_sims.policies import GuardValid24
+from tor_bgp_sims.scenarios import ClientsToGuardScenario
+from tor_bgp_sims.simulation_framework import TORMetricTracker, TORSimulation
+from tor_bgp_sims.simulation_framework.tor_metric_tracker import RunningStats
+
+
+class AdaptiveSimulation(TORSimulation):
+    """TORSimulation with only what adaptive runs need, without a graph"""
+
+    def __init__(self, checkpoint_dir):
+        self._checkpoint_dir = checkpoint_dir
+        self.percent_adoptions = (0.1, 0.5)
+        self.num_trials = 12
+        self.parse_cpus = 4
+        self.trials_per_checkpoint = 2
+        self.target_yerr = 5
+        self.min_trials = 4
+        self.stopping_metric_keys = (
+            MetricKey(
+                plane=Plane.DATA,
+                as_group=ASGroups.ALL_WOUT_IXPS,
+                outcome=Outcomes.ATTACKER_SUCCESS,
+                PolicyCls=Policy,
+            ),
+        )
+        self._running_stats = defaultdict(dict)
+        self._num_chunks_in_running_stats = defaultdict(int)
+        self._num_merged_chunks = dict()
+
+    @property
+    def checkpoint_dir(self):
+        return self._checkpoint_dir
+
+    def write_checkpoint(self, chunk_id, values):
+        """Checkpoints the chunk, with a trial for each value"""
+
+        percent_adopt, _trial = self._get_chunks(self.parse_cpus)[chunk_id][0]
+        [metric_key] = self.stopping_metric_keys
+        data_key = DataKey(
+            propagation_round=0,
+            percent_adopt=percent_adopt,
+            scenario_config=ScenarioConfig(
+                ScenarioCls=ClientsToGuardScenario, AdoptPolicyCls=GuardValid24
+            ),
+            metric_key=metric_key,
+        )
+        metric_tracker = TORMetricTracker()
+        for value in values:
+            metric_tracker.data[data_key].append(
+                Metric(
+                    metric_key=metric_key,
+                    as_classes_used=frozenset([GuardValid24]),
+                    percents=defaultdict(list, {metric_key: [value]}),
+                )
+            )
+        with self._get_checkpoint_path(chunk_id).open("wb") as f:
+            pickle.dump(metric_tracker, f)
+
+
+@pytest.mark.unit_tests
+class TestAdaptiveTrials:
+    def test_running_stats(self):
+        """Tests that the running stats match the stats of every trial"""
+
+        values = [3.0, 50.0, 12.5, 99.0, 0.0, 7.25]
+        running_stats = RunningStats()
+        for value in values:
+            running_stats.add(value)
+        assert running_stats.num_trials == len(values)
+        assert running_stats.mean == pytest.approx(statistics.mean(values))
+        assert running_stats.variance == pytest.approx(statistics.variance(values))
+        assert running_stats.yerr == pytest.approx(
+            1.645 * 2 * statistics.stdev(values) / len(values) ** 0.5
+        )
+
+    def test_stopping(self, tmp_path):
+        """Tests that each percent adoption stops once its yerr is small enough
+
+        Chunks 0-5 are for 0.1 and chunks 6-11 are for 0.5
+        """
+
+        simulation = AdaptiveSimulation(tmp_path)
+        # 4 CPUs, so the next 2 chunks of each percent adoption
+        assert [x for x, _ in simulation._get_remaining_chunks()] == [0, 1, 6, 7]
+
+        # 0.1 converges once it has min_trials, and 0.5 never does
+        for chunk_id in (0, 1, 2):
+            simulation.write_checkpoint(chunk_id, [20, 20])
+        for chunk_id in (6, 7):
+            simulation.write_checkpoint(chunk_id, [0, 100])
+        assert [x for x, _ in simulation._get_remaining_chunks()] == [8, 9, 10, 11]
+        for chunk_id in (8, 9, 10, 11):
+            simulation.write_checkpoint(chunk_id, [0, 100])
+        assert simulation._get_remaining_chunks() == []
+        # Chunk 2 was already running, but isn't merged
+        assert simulation._get_merged_chunk_ids() == [0, 1, 6, 7, 8, 9, 10, 11]
@@ -0,0 +1,34 @@
+from collections import Counter
+import random
+
+import pytest
+
+from tor_bgp_sims.tor_relay_collector import AliasTable
+
+
+@pytest.mark.unit_tests
+class TestAliasTable:
+    def test_sample_frequencies(self):
+        """Tests that indexes are sampled in proportion to their weights"""
+
+        weights = [1, 0, 5, 2.5, 1.5]
+        alias_table = AliasTable(weights)
+        # Every column's probability and alias add back up to the weights
+        totals = [0.0] * len(weights)
+        for i, (prob, alias) in enumerate(zip(alias_table.probs, alias_table.aliases)):
+            totals[i] += prob
+            totals[alias] += 1 - prob
+        assert totals == pytest.approx(
+            [x * len(weights) / sum(weights) for x in weights]
+        )
+
+        random.seed(0)
+        counts = Counter(alias_table.sample() for _ in range(50000))
+        assert counts[1] == 0
+        for i, weight in enumerate(weights):
+            assert counts[i] / 50000 == pytest.approx(weight / sum(weights), abs=0.01)
+
+    @pytest.mark.parametrize("weights", [[], [0, 0], [1, -1]])
+    def test_invalid_weights(self, weights):
+        with pytest.raises(ValueError):
+            AliasTable(weights)
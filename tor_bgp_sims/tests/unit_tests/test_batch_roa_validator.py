@@ -0,0 +1,83 @@
+from ipaddress import IPv4Network, IPv6Network
+import random
+
+import pytest
+
+from roa_checker import ROAChecker, ROARouted, ROAValidity
+
+from tor_bgp_sims.tor_relay_collector import BatchROAValidator
+
+
+def get_random_prefix(rand: random.Random, version: int, prefixlen: int):
+    """Returns a random prefix within 10.0.0.0/8 (or 2001:db8::/32)"""
+
+    if version == 4:
+        addr = (10 << 24) | rand.getrandbits(24)
+        return IPv4Network((addr, prefixlen), strict=False)
+    else:
+        addr = (0x20010DB8 << 96) | rand.getrandbits(96)
+        return IPv6Network((addr, prefixlen), strict=False)
+
+
+@pytest.mark.unit_tests
+class TestBatchROAValidator:
+    @pytest.mark.parametrize("version", [4, 6])
+    def test_same_as_roa_checker(self, version):
+        """Tests that batch validation matches ROAChecker for random ROAs"""
+
+        rand = random.Random(version)
+        prefixlens = (8, 9, 12, 16, 20, 24) if version == 4 else (32, 33, 40, 48)
+        roas = [
+            (
+                get_random_prefix(rand, version, rand.choice(prefixlens)),
+                rand.choice((0, 1, 2, 3)),
+                rand.choice((None, prefixlens[-1], 128 if version == 6 else 32)),
+            )
+            for _ in range(200)
+        ]
+        roa_checker = ROAChecker()
+        for roa in roas:
+            roa_checker.insert(*roa)
+
+        queries = [
+            (
+                get_random_prefix(
+                    rand, version, rand.choice(prefixlens + (prefixlens[-1] + 4,))
+                ),
+                rand.choice((1, 2, 3, 4)),
+            )
+            for _ in range(2000)
+        ]
+        expected = [roa_checker.get_validity(*query) for query in queries]
+        for validator in (
+            BatchROAValidator(roas),
+            BatchROAValidator.from_roa_checker(roa_checker),
+        ):
+            validities, routeds = validator.get_validities(
+                version,
+                [int(prefix.network_address) for prefix, _ in queries],
+                [prefix.prefixlen for prefix, _ in queries],
+                [origin for _, origin in queries],
+            )
+            assert [
+                (ROAValidity(x), ROARouted(y)) for x, y in zip(validities, routeds)
+            ] == expected
+        # Not every query should be unknown
+        assert len(set(expected)) > 3
+
+    def test_most_specific_roa(self):
+        """Tests that only the most specific covering ROA is used"""
+
+        validator = BatchROAValidator(
+            [
+                (IPv4Network("1.0.0.0/8"), 1, 24),
+                (IPv4Network("1.2.0.0/16"), 2, 16),
+                (IPv4Network("1.2.3.0/24"), 0, 24),
+            ]
+        )
+        addrs = [int(IPv4Network(x).network_address) for x in ("1.2.3.4", "1.2.4.5")]
+        validities, routeds = validator.get_validities(4, addrs, [16, 24], [2, 1])
+        assert ROAValidity(validities[0]) == ROAValidity.VALID
+        # 1.2.0.0/16 is more specific than 1.0.0.0/8, even though it's invalid
+        assert ROAValidity(validities[1]) == ROAValidity.INVALID_LENGTH_AND_ORIGIN
+        assert ROARouted(routeds[1]) == ROARouted.ROUTED
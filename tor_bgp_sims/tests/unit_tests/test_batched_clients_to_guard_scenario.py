@@ -0,0 +1,162 @@
+from collections import Counter
+from ipaddress import IPv4Network
+import random
+
+import pytest
+
+from frozendict import frozendict
+
+from bgpy.as_graphs import ASGraph
+from bgpy.enums import Plane
+from bgpy.simulation_engine import ROV, SimulationEngine
+from bgpy.simulation_framework import ASGraphAnalyzer, ScenarioConfig
+
+from roa_checker import ROAValidity
+
+from tor_bgp_sims.scenarios import (
+    BatchedClientsToGuardScenario,
+    ClientsToGuardScenario,
+)
+from tor_bgp_sims.simulation_framework import TORMetricTracker
+
+from .utils import FakeRelay, get_random_as_graph_info
+
+
+@pytest.mark.unit_tests
+class TestBatchedClientsToGuardScenario:
+    @pytest.mark.parametrize("seed", range(10))
+    def test_batched_outcomes(self, seed):
+        """Tests that each batched relay gets the outcomes and metrics of its run
+
+        The runs are plain ClientsToGuardScenarios, with the same attackers
+        and random state, so only the relay's origin adopts as a victim
+        """
+
+        rand = random.Random(seed)
+        as_graph_info = get_random_as_graph_info(rand, 150)
+        attacker_asn, origin_asn = rand.sample(range(1, 151), 2)
+        # Relays in the same prefix, and an attacker's relay, shouldn't matter
+        if rand.random() < 0.2:
+            origin_asn = attacker_asn
+        prefixes = [IPv4Network("1.2.0.0/16"), IPv4Network("1.2.3.0/24")]
+        relays = tuple(
+            FakeRelay(
+                ipv4_origin=origin_asn,
+                ipv4_prefix=rand.choice(prefixes),
+                ipv4_roa_validity=rand.choice(list(ROAValidity)),
+            )
+            for _ in range(8)
+        )
+
+        class Batched(BatchedClientsToGuardScenario):
+            tor_relay_groups_dict = frozendict({ROV: relays})  # type: ignore
+
+        class Single(ClientsToGuardScenario):
+            tor_relay_groups_dict = frozendict({ROV: relays})  # type: ignore
+
+        def get_outcomes(ScenarioCls, engine, metric_tracker, **kwargs):
+            scenario_config = ScenarioConfig(
+                ScenarioCls=ScenarioCls,
+                AdoptPolicyCls=ROV,
+                override_attacker_asns=frozenset([attacker_asn]),
+            )
+            random.seed(seed)
+            scenario = ScenarioCls(
+                scenario_config=scenario_config,
+                percent_adoption=0.3,
+                engine=engine,
+                **kwargs,
+            )
+            assert scenario.victim_asns == {origin_asn}
+            scenario.setup_engine(engine)
+            engine.run(propagation_round=0, scenario=scenario)
+            outcomes = list()
+            for relay_scenario in scenario._get_relay_scenarios():
+                relay_outcomes = ASGraphAnalyzer(
+                    engine=engine, scenario=relay_scenario
+                ).analyze()
+                metric_tracker.track_trial_metrics(
+                    engine=engine,
+                    percent_adopt=0.3,
+                    trial=0,
+                    scenario=relay_scenario,
+                    propagation_round=0,
+                    outcomes=relay_outcomes,
+                )
+                outcomes.append(
+                    (
+                        relay_scenario.non_default_asn_cls_dict,
+                        relay_outcomes[Plane.DATA.value],
+                    )
+                )
+            return outcomes
+
+        def get_metric_rows(metric_tracker):
+            """Returns the CSV rows, without the scenario class's name"""
+
+            rows = metric_tracker.get_csv_rows()
+            for row in rows:
+                del row["scenario_cls"]
+            return rows
+
+        engine = SimulationEngine(ASGraph(as_graph_info))
+        batched_metric_tracker = TORMetricTracker()
+        batched_outcomes = get_outcomes(
+            Batched, engine, batched_metric_tracker, tor_relays=relays
+        )
+        single_metric_tracker = TORMetricTracker()
+        single_outcomes = [
+            get_outcomes(Single, engine, single_metric_tracker, tor_relay=x)[0]
+            for x in relays
+        ]
+        assert batched_outcomes == single_outcomes
+        assert get_metric_rows(batched_metric_tracker) == get_metric_rows(
+            single_metric_tracker
+        )
+
+    def test_random_relays(self):
+        """Tests that a run's relays share an origin, and are picked like any relay"""
+
+        relays = tuple(
+            FakeRelay(
+                ipv4_origin=origin_asn,
+                ipv4_prefix=IPv4Network(f"1.2.{i}.0/24"),
+                ipv4_roa_validity=ROAValidity.VALID,
+            )
+            for i, origin_asn in enumerate([2, 2, 2, 3, 4, 4])
+        )
+
+        class Batched(BatchedClientsToGuardScenario):
+            tor_relay_groups_dict = frozendict({ROV: relays})  # type: ignore
+            relays_per_run = 5
+
+        random.seed(0)
+        # A relay of the origin of a random relay is as likely as a random relay
+        counts = Counter(
+            Batched.get_random_origin_tor_relay(
+                ROV, Batched.get_random_tor_relay(ROV).ipv4_origin
+            )
+            for _ in range(6000)
+        )
+        assert all(900 < counts[x] < 1100 for x in relays)  # type: ignore
+
+        engine = SimulationEngine(
+            ASGraph(get_random_as_graph_info(random.Random(0), 10))
+        )
+        scenario_config = ScenarioConfig(
+            ScenarioCls=Batched,
+            AdoptPolicyCls=ROV,
+            override_attacker_asns=frozenset([1]),
+        )
+        for _ in range(20):
+            scenario = Batched(scenario_config=scenario_config, engine=engine)
+            assert len(scenario.tor_relays) == 5
+            assert {x.ipv4_origin for x in scenario.tor_relays} == set(
+                scenario.victim_asns
+            )
+        with pytest.raises(AssertionError):
+            Batched(
+                scenario_config=scenario_config,
+                engine=engine,
+                tor_relays=relays,  # type: ignore
+            )
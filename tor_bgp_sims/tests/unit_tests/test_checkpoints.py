@@ -0,0 +1,106 @@
+import pickle
+import random
+
+import pytest
+
+from frozendict import frozendict
+
+from bgpy.simulation_framework import ScenarioConfig
+
+from tor_bgp_sims.policies import GuardValid24
+from tor_bgp_sims.scenarios.tor_scenario import RELAY_SNAPSHOT_ENV_VAR
+from tor_bgp_sims.simulation_framework import TORSimulation
+from tor_bgp_sims.simulation_framework.tor_simulation import _get_stable_repr
+
+from .utils import FakeGuardScenario, RandomASGraphConstructor
+
+
+class CountingSimulation(TORSimulation):
+    """TORSimulation that records which chunks it ran"""
+
+    chunks_run: list[int]
+
+    def _run_checkpointed_chunk(self, chunk_id, percent_adopt_trials):
+        self.chunks_run.append(chunk_id)
+        super()._run_checkpointed_chunk(chunk_id, percent_adopt_trials)
+
+
+@pytest.fixture
+def get_simulation(tmp_path, monkeypatch):
+    """Returns a function that returns a small checkpointed simulation"""
+
+    monkeypatch.setenv("PYTHONHASHSEED", "0")
+    # pin_relay_snapshot sets this, so it's restored after the test
+    monkeypatch.setenv(RELAY_SNAPSHOT_ENV_VAR, "")
+    relay_snapshot_path = tmp_path / "relays.snapshot"
+    relay_snapshot_path.write_bytes(b"relays")
+
+    def get_simulation(output_dir, num_trials=6):
+        simulation = CountingSimulation(
+            scenario_configs=(
+                ScenarioConfig(
+                    ScenarioCls=FakeGuardScenario, AdoptPolicyCls=GuardValid24
+                ),
+            ),
+            percent_adoptions=(0.1, 0.5),
+            num_trials=num_trials,
+            trials_per_checkpoint=2,
+            output_dir=output_dir,
+            parse_cpus=1,
+            python_hash_seed=0,
+            relay_snapshot=relay_snapshot_path,
+            ASGraphConstructorCls=RandomASGraphConstructor,
+            as_graph_constructor_kwargs=frozendict({"seed": 0}),
+        )
+        simulation.chunks_run = list()
+        return simulation
+
+    return get_simulation
+
+
+@pytest.mark.unit_tests
+class TestCheckpoints:
+    def test_resume(self, tmp_path, get_simulation):
+        """Tests that a run that was killed resumes with the same data"""
+
+        uninterrupted = get_simulation(tmp_path / "uninterrupted")
+        expected_rows = uninterrupted._get_data().get_csv_rows()
+        assert uninterrupted.chunks_run == list(range(6))
+
+        killed = get_simulation(tmp_path / "killed")
+        killed._get_data()
+        # As if it was killed while writing chunk 1
+        checkpoint_path = killed._get_checkpoint_path(1)
+        checkpoint_path.unlink()
+        checkpoint_path.with_name("chunk_1.host.123.tmp").write_bytes(b"cut sh")
+
+        resumed = get_simulation(tmp_path / "killed")
+        assert resumed.checkpoint_dir == killed.checkpoint_dir
+        assert resumed._get_data().get_csv_rows() == expected_rows
+        assert resumed.chunks_run == [1]
+
+    def test_checkpoint_dir(self, tmp_path, get_simulation):
+        """Tests that only runs with the same settings share checkpoints"""
+
+        simulation = get_simulation(tmp_path)
+        assert get_simulation(tmp_path).checkpoint_dir == simulation.checkpoint_dir
+        assert (
+            get_simulation(tmp_path, num_trials=8).checkpoint_dir
+            != simulation.checkpoint_dir
+        )
+
+    def test_stable_repr(self):
+        """Tests that sets are in the same order once they're pickled"""
+
+        scenario_config = ScenarioConfig(
+            ScenarioCls=FakeGuardScenario,
+            AdoptPolicyCls=GuardValid24,
+            override_attacker_asns=frozenset(
+                random.Random(0).sample(range(1, 400000), 3000)
+            ),
+        )
+        unpickled = pickle.loads(pickle.dumps(scenario_config))
+        # Pickling this set changes its order
+        assert repr(unpickled) != repr(scenario_config)
+        assert _get_stable_repr(unpickled) == _get_stable_repr(scenario_config)
+        assert _get_stable_repr(frozenset([3, 1, 2])) == "frozenset({1, 2, 3})"
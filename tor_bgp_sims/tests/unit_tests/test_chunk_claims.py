@@ -0,0 +1,120 @@
+from datetime import datetime
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from frozendict import frozendict
+
+from tor_bgp_sims.policies import GuardValid24
+from tor_bgp_sims.scenarios.tor_scenario import RELAY_SNAPSHOT_ENV_VAR
+from tor_bgp_sims.simulation_framework import (
+    Attackers,
+    Experiment,
+    ExperimentRunner,
+    TORSimulation,
+)
+
+from .utils import FakeGuardScenario, RandomASGraphConstructor
+
+
+class ClaimsSimulation(TORSimulation):
+    """TORSimulation with only what claiming chunks needs, without a graph"""
+
+    def __init__(self, checkpoint_dir):
+        self._checkpoint_dir = checkpoint_dir
+        self.chunks_run = list()
+
+    @property
+    def checkpoint_dir(self):
+        return self._checkpoint_dir
+
+    def _run_checkpointed_chunk(self, chunk_id, percent_adopt_trials):
+        self.chunks_run.append(chunk_id)
+        self._get_checkpoint_path(chunk_id).touch()
+
+
+@pytest.mark.unit_tests
+class TestChunkClaims:
+    def test_claim_chunk(self, tmp_path):
+        """Tests that a chunk can only be claimed once, until it's released"""
+
+        simulation = ClaimsSimulation(tmp_path)
+        assert simulation._claim_chunk(0, claim_timeout=60)
+        assert not simulation._claim_chunk(0, claim_timeout=60)
+        assert simulation._claim_chunk(1, claim_timeout=60)
+
+        assert simulation._run_claimed_chunk(2, [], claim_timeout=60)
+        # Already checkpointed
+        assert not simulation._run_claimed_chunk(2, [], claim_timeout=60)
+        # Claimed, but not checkpointed
+        assert not simulation._run_claimed_chunk(1, [], claim_timeout=60)
+        assert simulation.chunks_run == [2]
+        assert not simulation._get_claim_path(2).exists()
+
+    def test_stale_claims(self, tmp_path):
+        """Tests that claims of dead or timed out workers are taken over"""
+
+        simulation = ClaimsSimulation(tmp_path)
+        dead_process = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead_process.wait()
+        hostname = socket.gethostname()
+        simulation._get_claim_path(0).write_text(f"{hostname}.{dead_process.pid}")
+        assert simulation._claim_chunk(0, claim_timeout=60)
+
+        # Workers on other hosts can't be checked, so only time out
+        claim_path = simulation._get_claim_path(1)
+        claim_path.write_text(f"other.{hostname}.{os.getpid()}")
+        assert not simulation._claim_chunk(1, claim_timeout=60)
+        hour_ago = time.time() - 60 * 60
+        os.utime(claim_path, (hour_ago, hour_ago))
+        assert simulation._claim_chunk(1, claim_timeout=60)
+        assert claim_path.read_text() == f"{hostname}.{os.getpid()}"
+
+    def test_shard_plan(self, tmp_path, monkeypatch):
+        """Tests that workers get the same simulations as the shard plan
+
+        The US ASNs are a set whose order changes once it's pickled, which
+        must not change the checkpoint dirs
+        """
+
+        monkeypatch.setenv("PYTHONHASHSEED", "0")
+        # pin_relay_snapshot sets this, so it's restored after the test
+        monkeypatch.setenv(RELAY_SNAPSHOT_ENV_VAR, "")
+        relay_snapshot_path = tmp_path / "relays.snapshot"
+        relay_snapshot_path.write_bytes(b"relays")
+        us_asns = frozenset(random.Random(0).sample(range(1, 400000), 3000))
+        experiment = Experiment(
+            name="us",
+            ScenarioCls=FakeGuardScenario,
+            AdoptPolicyClasses=(GuardValid24,),
+            attackers=Attackers.US,
+            real_world_rov=False,
+        )
+        ExperimentRunner(
+            (experiment,),
+            tmp_path / "shared",
+            num_trials=4,
+            trials_per_checkpoint=2,
+            parse_cpus=1,
+            relay_snapshot=relay_snapshot_path,
+            us_asns=us_asns,
+            ASGraphConstructorCls=RandomASGraphConstructor,
+            as_graph_constructor_kwargs=frozendict(
+                {
+                    "as_graph_collector_kwargs": frozendict(
+                        {"dl_time": datetime(2024, 1, 1)}
+                    )
+                }
+            ),
+        ).write_shard_plan()
+
+        runner = ExperimentRunner.from_shard_plan(tmp_path / "shared")
+        [simulation] = runner._get_shard_simulations()
+        [scenario_config] = simulation.scenario_configs
+        assert scenario_config.override_attacker_asns == us_asns
+        assert simulation.checkpoint_dir.parent == tmp_path / "shared" / "us"
@@ -0,0 +1,104 @@
+from ipaddress import IPv4Network
+import random
+
+import pytest
+
+from frozendict import frozendict
+
+from bgpy.as_graphs import ASGraph
+from bgpy.enums import Outcomes, Plane
+from bgpy.simulation_engine import ROV
+from bgpy.simulation_framework import ASGraphAnalyzer, ScenarioConfig
+
+from roa_checker import ROAValidity
+
+from tor_bgp_sims.policies import GuardValidNot24, DestValidNot24
+from tor_bgp_sims.scenarios import (
+    ClientsToGuardExitToDestScenario,
+    ClientsToGuardScenario,
+    ExitToDestScenario,
+)
+from tor_bgp_sims.simulation_framework import TORASGraphAnalyzer, TORSimulationEngine
+
+from .utils import FakeRelay, get_random_as_graph_info
+
+
+@pytest.mark.unit_tests
+class TestClientsToGuardExitToDestScenario:
+    @pytest.mark.parametrize("seed", range(10))
+    def test_joint_outcomes(self, seed):
+        """Tests that the outcomes match the two legs simulated separately"""
+
+        rand = random.Random(seed)
+        as_graph_info = get_random_as_graph_info(rand, 150)
+        attacker_asn, guard_asn, exit_asn, dest_asn = rand.sample(range(2, 151), 4)
+        guard_relay = FakeRelay(
+            ipv4_origin=guard_asn,
+            ipv4_prefix=IPv4Network("1.2.0.0/16"),
+            ipv4_roa_validity=rand.choice(list(ROAValidity)),
+        )
+        exit_relay = FakeRelay(
+            ipv4_origin=exit_asn,
+            ipv4_prefix=IPv4Network("3.4.5.0/24"),
+            ipv4_roa_validity=ROAValidity.VALID,
+        )
+        relay_groups_dict = frozendict(
+            {GuardValidNot24: (guard_relay,), DestValidNot24: (exit_relay,)}
+        )
+        adopting_asns = set(rand.sample(range(1, 151), 50)) - {attacker_asn}
+        non_default_asn_cls_dict = frozendict({asn: ROV for asn in adopting_asns})
+
+        class Combined(ClientsToGuardExitToDestScenario):
+            tor_relay_groups_dict = relay_groups_dict  # type: ignore
+
+        class Guard(ClientsToGuardScenario):
+            tor_relay_groups_dict = relay_groups_dict  # type: ignore
+
+        class Exit(ExitToDestScenario):
+            tor_relay_groups_dict = relay_groups_dict  # type: ignore
+
+        def run(ScenarioCls, AdoptPolicyCls, victim_asns, AnalyzerCls):
+            engine = TORSimulationEngine(ASGraph(as_graph_info))
+            scenario_config = ScenarioConfig(
+                ScenarioCls=ScenarioCls,
+                AdoptPolicyCls=AdoptPolicyCls,
+                override_attacker_asns=frozenset([attacker_asn]),
+                override_victim_asns=frozenset(victim_asns),
+                override_non_default_asn_cls_dict=non_default_asn_cls_dict,
+            )
+            scenario = ScenarioCls(scenario_config=scenario_config, engine=engine)
+            scenario.setup_engine(engine)
+            for propagation_round in range(ScenarioCls.min_propagation_rounds):
+                engine.run(propagation_round=propagation_round, scenario=scenario)
+                # Analyzed after every round, the same as the simulation
+                outcomes = AnalyzerCls(engine=engine, scenario=scenario).analyze()
+                scenario.post_propagation_hook(
+                    engine=engine,
+                    percent_adopt=0,
+                    trial=0,
+                    propagation_round=propagation_round,
+                )
+            return outcomes[Plane.DATA.value]
+
+        joint_outcomes = run(
+            Combined, GuardValidNot24, [guard_asn, dest_asn], TORASGraphAnalyzer
+        )
+        guard_outcomes = run(Guard, GuardValidNot24, [guard_asn], ASGraphAnalyzer)
+        exit_outcome = run(Exit, DestValidNot24, [dest_asn], TORASGraphAnalyzer)[
+            exit_asn
+        ]
+
+        ATTACKER_SUCCESS = Outcomes.ATTACKER_SUCCESS.value
+        if exit_outcome == ATTACKER_SUCCESS:
+            assert joint_outcomes == guard_outcomes
+        else:
+            assert ATTACKER_SUCCESS not in joint_outcomes.values()
+            assert {
+                asn
+                for asn, outcome in joint_outcomes.items()
+                if outcome != guard_outcomes[asn]
+            } == {
+                asn
+                for asn, outcome in guard_outcomes.items()
+                if outcome == ATTACKER_SUCCESS
+            }
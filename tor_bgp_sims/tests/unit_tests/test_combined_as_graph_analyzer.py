@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+from bgpy.as_graphs import ASGraph
+from bgpy.enums import Plane
+from bgpy.simulation_engine import ROV, SimulationEngine
+from bgpy.simulation_framework import ASGraphAnalyzer, ScenarioConfig, SubprefixHijack
+
+from tor_bgp_sims.simulation_framework import CombinedASGraphAnalyzer
+
+from .utils import get_random_as_graph_info
+
+
+@pytest.mark.unit_tests
+class TestCombinedASGraphAnalyzer:
+    @pytest.mark.parametrize("seed", range(10))
+    def test_trace_back(self, seed):
+        """Tests that the traceback matches the base class's data plane"""
+
+        rand = random.Random(seed)
+        as_graph_info = get_random_as_graph_info(rand, 150)
+        victim_asn, attacker_asn = rand.sample(range(1, 151), 2)
+        engine = SimulationEngine(ASGraph(as_graph_info))
+        scenario_config = ScenarioConfig(
+            ScenarioCls=SubprefixHijack,
+            AdoptPolicyCls=ROV,
+            override_victim_asns=frozenset([victim_asn]),
+            override_attacker_asns=frozenset([attacker_asn]),
+        )
+        random.seed(seed)
+        scenario = SubprefixHijack(
+            scenario_config=scenario_config, engine=engine, percent_adoption=0.5
+        )
+        scenario.setup_engine(engine)
+        engine.run(propagation_round=0, scenario=scenario)
+
+        outcomes = ASGraphAnalyzer(engine=engine, scenario=scenario).analyze()
+        analyzer = CombinedASGraphAnalyzer(engine=engine, scenario=scenario)
+        assert analyzer._trace_back(scenario, engine.as_graph.as_dict) == (
+            outcomes[Plane.DATA.value]
+        )
@@ -0,0 +1,111 @@
+from datetime import date, datetime
+import io
+import lzma
+import tarfile
+
+import pytest
+
+from tor_bgp_sims.tor_relay_collector.consensus_parser import ConsensusParser
+from tor_bgp_sims.tor_relay_collector.tor_relay_collector import TORRelayCollector
+
+
+def get_consensus(valid_after: str = "2024-02-07 01:00:00") -> str:
+    """Returns a (trimmed down) consensus with two relays"""
+
+    return "\n".join(
+        [
+            "network-status-version 3",
+            "vote-status consensus",
+            f"valid-after {valid_after}",
+            "known-flags Authority BadExit Exit Fast Guard HSDir Running Valid",
+            "r seele AtNw etVuH1 2024-02-07 07:01:56 104.53.221.159 9001 0",
+            "s Fast Running Valid",
+            "v Tor 0.4.8.10",
+            "pr Conflux=1 Cons=1-2",
+            "w Bandwidth=630",
+            "p reject 1-65535",
+            "r other AtNx etVuH2 2024-02-07 07:01:56 1.2.3.4 443 0",
+            "a [2001:41d0:404:300::dd2]:9001",
+            "s Exit Fast Guard Running Valid",
+            "v Tor 0.4.8.10",
+            "pr Conflux=1 Cons=1-2",
+            "w Bandwidth=6000 Unmeasured=1",
+            "p accept 80,443",
+            "directory-footer",
+            "bandwidth-weights Wbd=0 Wbe=0 Wbg=4110 Wgg=5890 Wgd=0 Wee=10000",
+            "directory-signature sha256 0232AF901C31A04EE9848595AF9BB7620D4C5B2E",
+            "-----BEGIN SIGNATURE-----",
+            "",
+        ]
+    )
+
+
+@pytest.mark.unit_tests
+class TestConsensusParser:
+    def test_parse(self, tmp_path):
+        """Tests relays are streamed one at a time, and then the footer is set"""
+
+        path = tmp_path / "2024-02-07-01-00-00-consensus"
+        path.write_text(get_consensus())
+        consensus = ConsensusParser.from_path(path)
+        relays = iter(consensus)
+        first = next(relays)
+        footer = consensus.footer
+        assert footer is None
+        assert consensus.valid_after == datetime(2024, 2, 7, 1)
+        assert first["r"][5] == "104.53.221.159"
+        assert "a" not in first
+
+        second = next(relays)
+        assert second["a"] == ("[2001:41d0:404:300::dd2]:9001",)
+        assert second["w"] == ("Bandwidth=6000", "Unmeasured=1")
+        assert set(second) == {"r", "a", "s", "v", "pr", "w", "p"}
+        with pytest.raises(StopIteration):
+            next(relays)
+        assert consensus.footer
+        assert consensus.footer.bandwidth_weights["Wgg"] == 5890
+        assert consensus.footer.bandwidth_weights["Wee"] == 10000
+
+    def test_truncated(self):
+        """Tests that a consensus without a footer is an error"""
+
+        lines = get_consensus().split("directory-footer")[0].split("\n")
+        with pytest.raises(NotImplementedError):
+            list(ConsensusParser(lines))
+
+    def test_archive(self, tmp_path):
+        """Tests parsing consensuses out of a CollecTor .tar.xz archive"""
+
+        path = tmp_path / "consensuses-2024-02.tar.xz"
+        with tarfile.open(path, "w:xz") as tar:
+            for hour in range(3):
+                data = get_consensus(f"2024-02-07 0{hour}:00:00").encode()
+                info = tarfile.TarInfo(
+                    f"consensuses-2024-02/07/2024-02-07-0{hour}-00-00-consensus"
+                )
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+        valid_afters = list()
+        for consensus in ConsensusParser.iter_archive(path):
+            assert len(list(consensus)) == 2
+            valid_afters.append(consensus.valid_after)
+        assert valid_afters == [datetime(2024, 2, 7, hour) for hour in range(3)]
+
+        # The collector picks the 01:00 consensus for the date out of the archive
+        collector = TORRelayCollector(
+            requests_cache_db_path=tmp_path / "requests.db",
+            prefix_origin_cache_path=tmp_path / "prefix_origins.db",
+            dl_date=date(2024, 2, 7),
+            consensus_path=path,
+        )
+        assert len(list(collector._get_raw_tor_datas())) == 2
+        assert collector.footer
+
+    def test_xz(self, tmp_path):
+        """Tests parsing a single compressed consensus"""
+
+        path = tmp_path / "2024-02-07-01-00-00-consensus.xz"
+        with lzma.open(path, "wt") as f:
+            f.write(get_consensus())
+        assert len(list(ConsensusParser.from_path(path))) == 2
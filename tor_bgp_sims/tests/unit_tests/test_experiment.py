@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from frozendict import frozendict
+
+from bgpy.enums import ASGroups, SpecialPercentAdoptions
+from bgpy.simulation_engine import ROV
+
+from tor_bgp_sims.policies import Dest24, DestValidNot24
+from tor_bgp_sims.scenarios import ExitToDestScenario
+from tor_bgp_sims.simulation_framework import (
+    Attackers,
+    Experiment,
+    load_experiments,
+    RelaySampling,
+)
+
+SPEC = {
+    "defaults": {"propagation_rounds": 2, "real_world_rov": False},
+    "experiments": {
+        "exit_to_dest_mh": {
+            "scenario": "ExitToDestScenario",
+            "adopt_policies": ["Dest24", "DestValidNot24"],
+            "attackers": "multihomed",
+            "percent_adoptions": ["ONLY_ONE", 0.5],
+        },
+        "exit_to_dest_us": {
+            "scenario": "ExitToDestScenario",
+            "adopt_policies": ["Dest24"],
+            "attackers": "us",
+            "real_world_rov": True,
+            "relay_sampling": "equivalence_classes",
+            "enabled": False,
+        },
+    },
+}
+
+TOML_SPEC = """
+[defaults]
+propagation_rounds = 2
+real_world_rov = false
+
+[experiments.exit_to_dest_mh]
+scenario = "ExitToDestScenario"
+adopt_policies = ["Dest24", "DestValidNot24"]
+attackers = "multihomed"
+percent_adoptions = ["ONLY_ONE", 0.5]
+
+[experiments.exit_to_dest_us]
+scenario = "ExitToDestScenario"
+adopt_policies = ["Dest24"]
+attackers = "us"
+real_world_rov = true
+relay_sampling = "equivalence_classes"
+enabled = false
+"""
+
+
+@pytest.mark.unit_tests
+class TestExperiment:
+    @pytest.mark.parametrize("suffix", [".json", ".toml"])
+    def test_load_experiments(self, tmp_path, suffix):
+        """Tests that the spec's experiments and defaults are loaded"""
+
+        path = tmp_path / f"spec{suffix}"
+        path.write_text(json.dumps(SPEC) if suffix == ".json" else TOML_SPEC)
+        mh, us = load_experiments(path)
+
+        assert mh == Experiment(
+            name="exit_to_dest_mh",
+            ScenarioCls=ExitToDestScenario,
+            AdoptPolicyClasses=(Dest24, DestValidNot24),
+            attackers=Attackers.MULTIHOMED,
+            propagation_rounds=2,
+            real_world_rov=False,
+            percent_adoptions=(SpecialPercentAdoptions.ONLY_ONE, 0.5),
+        )
+        assert mh.enabled
+        assert us.attackers == Attackers.US
+        assert us.relay_sampling == RelaySampling.EQUIVALENCE_CLASSES
+        assert us.real_world_rov and not us.enabled
+
+        rov_asn_cls_dict = frozendict({1: ROV})
+        mh_configs = mh.get_scenario_configs(rov_asn_cls_dict, frozenset([2, 3]))
+        assert [x.AdoptPolicyCls for x in mh_configs] == [Dest24, DestValidNot24]
+        assert all(
+            x.attacker_subcategory_attr == ASGroups.MULTIHOMED.value
+            and x.propagation_rounds == 2
+            and not x.hardcoded_asn_cls_dict
+            for x in mh_configs
+        )
+        [us_config] = us.get_scenario_configs(rov_asn_cls_dict, frozenset([2, 3]))
+        assert us_config.override_attacker_asns == frozenset([2, 3])
+        assert us_config.num_attackers == 2
+        assert us_config.hardcoded_asn_cls_dict == rov_asn_cls_dict
+
+    def test_unknown_setting(self):
+        """Tests that typos in a spec aren't ignored"""
+
+        with pytest.raises(ValueError):
+            Experiment.from_dict(
+                "typo",
+                {
+                    "scenario": "ExitToDestScenario",
+                    "adopt_policies": ["Dest24"],
+                    "num_trails": 5,
+                },
+            )
+        with pytest.raises(ValueError):
+            Experiment.from_dict(
+                "typo", {"scenario": "ExitToDest", "adopt_policies": ["Dest24"]}
+            )
@@ -0,0 +1,248 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ipaddress import ip_network
+import json
+import lzma
+from threading import Lock, Thread
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from requests_cache import CachedSession
+
+from tor_bgp_sims.tor_relay_collector.prefix_origin_cache import PrefixOriginCache
+from tor_bgp_sims.tor_relay_collector.prefix_origin_resolvers import (
+    get_most_specific_pair,
+    Pfx2ASPrefixOriginResolver,
+    RIPEPrefixOriginResolver,
+)
+from tor_bgp_sims.tor_relay_collector.token_bucket import TokenBucket
+from tor_bgp_sims.tor_relay_collector.tor_relay import TORRelay
+
+
+class RIPEStandIn(BaseHTTPRequestHandler):
+    """Local stand in for the RIPE related-prefixes API
+
+    Every IP lives in its /24, originated by the third octet. The first
+    request for 1.2.3.4 is rate limited, to check that we back off and retry.
+    1.2.99.0/24 is also originated by AS 990, so its lookups tie
+    """
+
+    lock = Lock()
+    num_requests = 0
+    rate_limited = False
+
+    def do_GET(self):
+        resource = parse_qs(urlparse(self.path).query)["resource"][0]
+        with self.lock:
+            self.__class__.num_requests += 1
+            rate_limit = resource == "1.2.3.4/32" and not self.rate_limited
+            if rate_limit:
+                self.__class__.rate_limited = True
+        if rate_limit:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+
+        prefix = ip_network(resource).supernet(new_prefix=24)
+        origin = int(resource.split(".")[2])
+        prefixes = [{"prefix": str(prefix), "origin_asn": origin}]
+        if origin == 99:
+            prefixes.append({"prefix": str(prefix), "origin_asn": 990})
+        data = {"data": {"prefixes": prefixes}}
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture
+def ripe_url():
+    RIPEStandIn.num_requests = 0
+    RIPEStandIn.rate_limited = False
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RIPEStandIn)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/data/related-prefixes/data.json"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.unit_tests
+class TestPrefixOriginLookups:
+    def test_token_bucket_rate(self):
+        """Tests that the token bucket limits the request rate"""
+
+        bucket = TokenBucket(rate=50, capacity=1)
+        start = time.monotonic()
+        for _ in range(11):
+            bucket.acquire()
+        # First token is free, the next 10 take 1/50th of a second each
+        assert time.monotonic() - start >= 0.19
+
+    def test_concurrent_lookups(self, ripe_url, tmp_path):
+        """Tests concurrent, rate limited lookups are ordered, retried, and cached"""
+
+        session = CachedSession(str(tmp_path / "ripe.db"))
+        bucket = TokenBucket(rate=200)
+        ip_addrs = [ip_network(f"1.2.{i}.4") for i in range(1, 41)]
+
+        def lookup(ip_addr):
+            return TORRelay.get_prefix_origin_pair(
+                session, ip_addr, token_bucket=bucket, url=ripe_url, backoff_base=0
+            )
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lookup, ip_addrs))
+
+        assert results == [
+            (ip_network(f"1.2.{i}.0/24"), i) for i in range(1, len(ip_addrs) + 1)
+        ]
+        # One extra request for the rate limited retry
+        assert RIPEStandIn.num_requests == len(ip_addrs) + 1
+
+        # Everything is cached now, so no more requests go to RIPE
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert list(executor.map(lookup, ip_addrs)) == results
+        assert RIPEStandIn.num_requests == len(ip_addrs) + 1
+        session.close()
+
+    def test_prefix_origin_cache(self, ripe_url, tmp_path):
+        """Tests that resolved prefixes answer other IPs, across cache instances"""
+
+        db_path = tmp_path / "prefix_origins.db"
+        cache = PrefixOriginCache(db_path)
+        # Short prefixes are only authoritative for the /24 that was looked up
+        cache.add(ip_network("10.1.1.1"), ip_network("10.0.0.0/8"), 1)
+        cache.add(ip_network("10.2.2.2"), ip_network("10.2.2.0/24"), 2)
+        cache.add(ip_network("2001:db8::1"), ip_network("2001:db8::/32"), 3)
+        cache.close()
+
+        cache = PrefixOriginCache(db_path)
+        assert cache.get(ip_network("10.1.1.200")) == (ip_network("10.0.0.0/8"), 1)
+        assert cache.get(ip_network("10.2.2.200")) == (ip_network("10.2.2.0/24"), 2)
+        assert cache.get(ip_network("10.3.3.3")) is None
+        assert cache.get(ip_network("2001:db8::ff")) == (
+            ip_network("2001:db8::/32"),
+            3,
+        )
+        assert cache.get(ip_network("2001:db8:1::1")) is None
+        cache.close()
+
+        # Expired entries are ignored
+        cache = PrefixOriginCache(db_path, ttl=timedelta(seconds=0))
+        assert cache.get(ip_network("10.1.1.200")) is None
+        cache.close()
+
+        # Relays in a /24 we've already resolved don't hit RIPE
+        session = CachedSession(str(tmp_path / "ripe.db"))
+        cache = PrefixOriginCache(db_path)
+        for ip_addr in ("1.2.5.1", "1.2.5.2", "1.2.5.3"):
+            assert TORRelay.get_prefix_origin_pair(
+                session, ip_network(ip_addr), url=ripe_url, prefix_origin_cache=cache
+            ) == (ip_network("1.2.5.0/24"), 5)
+        assert RIPEStandIn.num_requests == 1
+        cache.close()
+        session.close()
+
+    def test_cached_ties(self, ripe_url, tmp_path, capsys):
+        """Tests that cached lookups warn about equal length prefixes too"""
+
+        db_path = tmp_path / "prefix_origins.db"
+        session = CachedSession(str(tmp_path / "ripe.db"))
+        pairs = list()
+        for ip_addr in ("1.2.99.1", "1.2.99.2", "1.2.99.3"):
+            cache = PrefixOriginCache(db_path)
+            resolver = RIPEPrefixOriginResolver(
+                session, url=ripe_url, prefix_origin_cache=cache
+            )
+            capsys.readouterr()
+            pairs.append(resolver.get_prefix_origin_pair(ip_network(ip_addr)))
+            assert "need both" in capsys.readouterr().out
+            cache.close()
+        # Only the first lookup went to RIPE
+        assert RIPEStandIn.num_requests == 1
+        assert pairs == [(ip_network("1.2.99.0/24"), 990)] * 3
+        session.close()
+
+    def test_pfx2as_resolver(self, tmp_path, capsys):
+        """Tests offline most specific lookups from a compressed pfx2as file"""
+
+        path = tmp_path / "routeviews-rv2-20240207-1200.pfx2as.gz"
+        with gzip.open(path, "wt") as f:
+            f.write("1.0.0.0\t8\t1\n")
+            f.write("1.2.0.0\t16\t2\n")
+            f.write("1.2.3.0\t24\t3_4\n")
+            f.write("2001:db8::\t32\t6\n")
+        resolver = Pfx2ASPrefixOriginResolver(path)
+
+        assert resolver.get_prefix_origin_pair(ip_network("1.2.4.1")) == (
+            ip_network("1.2.0.0/16"),
+            2,
+        )
+        assert resolver.get_prefix_origin_pair(ip_network("1.3.0.1")) == (
+            ip_network("1.0.0.0/8"),
+            1,
+        )
+        assert resolver.get_prefix_origin_pair(ip_network("2001:db8::1")) == (
+            ip_network("2001:db8::/32"),
+            6,
+        )
+        with pytest.raises(Exception):
+            resolver.get_prefix_origin_pair(ip_network("2.0.0.1"))
+
+        # MOAS ties break the same way as the RIPE backend, with the same warning
+        capsys.readouterr()
+        pair = resolver.get_prefix_origin_pair(ip_network("1.2.3.4"))
+        assert "need both" in capsys.readouterr().out
+        ripe_pairs = [(ip_network("1.2.3.0/24"), 3), (ip_network("1.2.3.0/24"), 4)]
+        assert pair == get_most_specific_pair(ip_network("1.2.3.4"), ripe_pairs)
+
+    def test_bgpdump_resolver(self, tmp_path):
+        """Tests offline lookups from a RIB dump converted with bgpdump -m"""
+
+        path = tmp_path / "rib.txt.xz"
+        with lzma.open(path, "wt") as f:
+            for peer, as_path in (("1", "1 2 5"), ("3", "3 5"), ("4", "4 {7,8}")):
+                f.write(f"TABLE_DUMP2|0|B|10.0.0.{peer}|{peer}|5.5.0.0/16|{as_path}|")
+                f.write("IGP|10.0.0.1|0|0||NAG||\n")
+        resolver = Pfx2ASPrefixOriginResolver(path)
+        assert resolver.get_prefix_origin_pair(ip_network("5.5.5.5")) == (
+            ip_network("5.5.0.0/16"),
+            5,
+        )
+
+    def test_as_sets(self, tmp_path):
+        """Tests that both offline formats skip AS set origins"""
+
+        pfx2as_path = tmp_path / "routeviews-rv2-20240207-1200.pfx2as"
+        pfx2as_path.write_text("5.5.0.0\t16\t5_7,8\n6.0.0.0\t8\t9\n6.6.0.0\t16\t7,8\n")
+        bgpdump_path = tmp_path / "rib.txt"
+        with bgpdump_path.open("w") as f:
+            for peer, prefix, as_path in (
+                ("1", "5.5.0.0/16", "1 5"),
+                ("4", "5.5.0.0/16", "4 {7,8}"),
+                ("1", "6.0.0.0/8", "1 9"),
+                ("4", "6.6.0.0/16", "4 {7,8}"),
+            ):
+                f.write(f"TABLE_DUMP2|0|B|10.0.0.{peer}|{peer}|{prefix}|{as_path}|")
+                f.write("IGP|10.0.0.1|0|0||NAG||\n")
+
+        for path in (pfx2as_path, bgpdump_path):
+            resolver = Pfx2ASPrefixOriginResolver(path)
+            assert resolver.get_prefix_origin_pair(ip_network("5.5.5.5")) == (
+                ip_network("5.5.0.0/16"),
+                5,
+            )
+            assert resolver.get_prefix_origin_pair(ip_network("6.6.6.6")) == (
+                ip_network("6.0.0.0/8"),
+                9,
+            )
@@ -0,0 +1,164 @@
+from array import array
+from collections import defaultdict
+import json
+import os
+import random
+
+import pytest
+
+from frozendict import frozendict
+
+from bgpy.simulation_framework import ScenarioConfig
+
+from tor_bgp_sims.policies import GuardValid24, GuardValidNot24
+from tor_bgp_sims.scenarios.tor_scenario import RELAY_SNAPSHOT_ENV_VAR
+from tor_bgp_sims.simulation_framework import TORSimulation
+from tor_bgp_sims.utils import RealROVSimplePolicy, RealWorldROV
+
+from .utils import FakeGuardScenario, GUARD_RELAYS, RandomASGraphConstructor
+
+
+ROV_INFO: dict[str, list[dict[str, float]]] = {
+    "1": [{"percent": 100}],
+    "2": [{"percent": 0}],
+    "3": [{"percent": 20}, {"percent": 60}],
+    "4": [{"percent": 50}],
+    "5": [{"percent": 0.5}],
+}
+
+
+class RecordingGuardScenario(FakeGuardScenario):
+    """FakeGuardScenario for two configs, that notes if it had a prev_scenario"""
+
+    tor_relay_groups_dict = frozendict(
+        {
+            GuardValid24: GUARD_RELAYS,  # type: ignore
+            GuardValidNot24: GUARD_RELAYS[::-1],  # type: ignore
+        }
+    )
+
+    def __init__(self, *args, prev_scenario=None, **kwargs):
+        self.had_prev_scenario: bool = prev_scenario is not None
+        super().__init__(*args, prev_scenario=prev_scenario, **kwargs)
+
+
+class RecordingSimulation(TORSimulation):
+    """TORSimulation that records the scenarios of each trial"""
+
+    trial_scenarios: defaultdict[int, list[RecordingGuardScenario]]
+
+    def _single_engine_run(self, *, trial, scenario, propagation_round, **kwargs):
+        if propagation_round == 0:
+            self.trial_scenarios[trial].append(scenario)
+        super()._single_engine_run(
+            trial=trial,
+            scenario=scenario,
+            propagation_round=propagation_round,
+            **kwargs,
+        )
+
+
+@pytest.mark.unit_tests
+class TestRealWorldROV:
+    def test_cache(self, tmp_path):
+        """Tests that the JSON is compiled once, and recompiled once it changes"""
+
+        json_path = tmp_path / "rov_info.json"
+        json_path.write_text(json.dumps(ROV_INFO))
+        real_world_rov = RealWorldROV.from_json(json_path)
+        assert list(real_world_rov.asns) == [1, 2, 3, 4, 5]
+        assert list(real_world_rov.percents) == [100, 0, 60, 50, 0.5]
+
+        cache_path = json_path.with_suffix(".rov")
+        cached = RealWorldROV.from_json(json_path)
+        assert repr(cached) == repr(real_world_rov)
+        assert list(cached.percents) == list(real_world_rov.percents)
+
+        json_path.write_text(json.dumps({"7": [{"percent": 10}]}))
+        stat = cache_path.stat()
+        os.utime(json_path, (stat.st_atime, stat.st_mtime + 1))
+        recompiled = RealWorldROV.from_json(json_path)
+        assert list(recompiled.asns) == [7]
+        assert repr(recompiled) != repr(real_world_rov)
+
+        cache_path.write_bytes(b"not a cache")
+        os.utime(json_path, (stat.st_atime, stat.st_mtime - 1))
+        assert list(RealWorldROV.from_json(json_path).asns) == [7]
+
+    def test_draw(self, tmp_path):
+        """Tests that draws are the same as checking each AS in turn"""
+
+        json_path = tmp_path / "rov_info.json"
+        json_path.write_text(json.dumps(ROV_INFO))
+        real_world_rov = RealWorldROV.from_json(json_path)
+        for seed in range(50):
+            rng = random.Random(seed)
+            expected = [
+                int(asn)
+                for asn, info_list in ROV_INFO.items()
+                if rng.random() * 100 < max(x["percent"] for x in info_list)
+            ]
+            deployment = real_world_rov.draw(random.Random(seed).random)
+            assert list(deployment) == expected
+            assert 1 in deployment and 2 not in deployment
+            assert set(deployment.values()) == {RealROVSimplePolicy}
+
+    def test_trials(self, tmp_path, monkeypatch):
+        """Tests that each trial's ROV ASes are shared by all of its scenarios
+
+        They should differ between trials, never be random adopters, and
+        still deploy ROV in scenarios that follow a prev_scenario
+        """
+
+        monkeypatch.setenv("PYTHONHASHSEED", "0")
+        # pin_relay_snapshot sets this, so it's restored after the test
+        monkeypatch.setenv(RELAY_SNAPSHOT_ENV_VAR, "")
+        relay_snapshot_path = tmp_path / "relays.snapshot"
+        relay_snapshot_path.write_bytes(b"relays")
+
+        # Half of the ASes deploy ROV half of the time
+        asns = array("q", range(1, 61))
+        real_world_rov = RealWorldROV(asns, array("d", [50] * len(asns)))
+        simulation = RecordingSimulation(
+            scenario_configs=tuple(
+                ScenarioConfig(
+                    ScenarioCls=RecordingGuardScenario, AdoptPolicyCls=AdoptPolicyCls
+                )
+                for AdoptPolicyCls in (GuardValid24, GuardValidNot24)
+            ),
+            percent_adoptions=(0.1, 0.5),
+            num_trials=2,
+            output_dir=tmp_path,
+            parse_cpus=1,
+            python_hash_seed=0,
+            relay_snapshot=relay_snapshot_path,
+            real_world_rov=real_world_rov,
+            ASGraphConstructorCls=RandomASGraphConstructor,
+            as_graph_constructor_kwargs=frozendict({"seed": 0}),
+        )
+        simulation.trial_scenarios = defaultdict(list)
+        simulation._get_data()
+
+        assert sorted(simulation.trial_scenarios) == [0, 1]
+        trial_rov_asn_cls_dicts = list()
+        for scenarios in simulation.trial_scenarios.values():
+            # Both scenario configs, for both percent adoptions
+            assert len(scenarios) == 4
+            assert any(x.had_prev_scenario for x in scenarios)
+            rov_asn_cls_dict = scenarios[0].rov_asn_cls_dict
+            assert rov_asn_cls_dict
+            trial_rov_asn_cls_dicts.append(rov_asn_cls_dict)
+            for scenario in scenarios:
+                assert scenario.rov_asn_cls_dict == rov_asn_cls_dict
+                # Like bgpy's hardcoded ASes, the victim adopts either way
+                preset_rov_asns = set(rov_asn_cls_dict) - scenario._default_adopters
+                random_adopters = {
+                    asn
+                    for asn, PolicyCls in scenario.non_default_asn_cls_dict.items()
+                    if PolicyCls == scenario.scenario_config.AdoptPolicyCls
+                } - scenario._default_adopters
+                assert random_adopters
+                assert not random_adopters & preset_rov_asns
+                for asn in preset_rov_asns:
+                    assert scenario.non_default_asn_cls_dict[asn] is RealROVSimplePolicy
+        assert trial_rov_asn_cls_dicts[0] != trial_rov_asn_cls_dicts[1]
@@ -0,0 +1,183 @@
+from datetime import date
+import io
+import tarfile
+
+import pytest
+import requests
+
+from roa_checker import ROAChecker
+
+from tor_bgp_sims.tor_relay_collector import RelayHistoryCollector, TORRelayCollector
+from tor_bgp_sims.tor_relay_collector.prefix_origin_resolvers import (
+    Pfx2ASPrefixOriginResolver,
+)
+
+
+class CountingResolver(Pfx2ASPrefixOriginResolver):
+    """Counts the IPs that get resolved"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ip_addrs = list()
+
+    def get_prefix_origin_pair(self, ip_addr):
+        self.ip_addrs.append(ip_addr)
+        return super().get_prefix_origin_pair(ip_addr)
+
+
+def get_consensus(relays: tuple[tuple[str, str, str], ...]) -> str:
+    """Returns a (trimmed down) consensus with (identity, IP, flags) relays"""
+
+    lines = ["network-status-version 3", "valid-after 2024-02-07 01:00:00"]
+    for identity, ip_addr, flags in relays:
+        lines.extend(
+            [
+                f"r nick {identity} x 2024-02-07 07:01:56 {ip_addr} 9001 0",
+                f"s {flags}",
+                "v Tor 0.4.8.10",
+                "pr Conflux=1",
+                "w Bandwidth=100",
+                "p reject 1-65535",
+            ]
+        )
+    lines.extend(["directory-footer", "bandwidth-weights Wgg=5890"])
+    return "\n".join(lines)
+
+
+class FakeResponse:
+    """Only what RelayHistoryCollector._download_archive looks at"""
+
+    def __init__(self, content: bytes | None) -> None:
+        self.content: bytes | None = content
+
+    def __enter__(self) -> "FakeResponse":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def raise_for_status(self) -> None:
+        if self.content is None:
+            raise requests.exceptions.HTTPError("404 Client Error: Not Found")
+
+    def iter_content(self, chunk_size: int):
+        assert self.content is not None
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
+
+def get_archive(consensuses: dict[str, str]) -> bytes:
+    """Returns a CollecTor monthly archive with the (name, consensus) items"""
+
+    f = io.BytesIO()
+    with tarfile.open(fileobj=f, mode="w:xz") as tar:
+        for name, consensus in consensuses.items():
+            data = consensus.encode()
+            info = tarfile.TarInfo(f"consensuses-2024-02/07/{name}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return f.getvalue()
+
+
+@pytest.mark.unit_tests
+class TestRelayHistory:
+    def test_incremental(self, tmp_path, monkeypatch):
+        """Tests that only new or changed relays are resolved"""
+
+        monkeypatch.setattr(
+            TORRelayCollector, "_init_roa_checker", lambda self: ROAChecker()
+        )
+        pfx2as_path = tmp_path / "pfx2as.txt"
+        pfx2as_path.write_text("1.0.0.0\t8\t1\n2.0.0.0\t8\t2\n")
+        consensus_dir = tmp_path / "consensuses"
+        consensus_dir.mkdir()
+        a = "AtNwqbOLWNZ5xBVKadIqV4vcNz4"
+        b = "BtNwqbOLWNZ5xBVKadIqV4vcNz4"
+        c = "CtNwqbOLWNZ5xBVKadIqV4vcNz4"
+        consensuses = {
+            6: ((a, "1.0.0.1", "Guard"), (b, "1.0.0.2", "Exit")),
+            # b moved to a new IP, c is new
+            7: ((a, "1.0.0.1", "Guard"), (b, "2.0.0.2", "Exit"), (c, "1.0.0.3", "")),
+            # b lost the exit flag
+            8: ((a, "1.0.0.1", "Guard"), (b, "2.0.0.2", ""), (c, "1.0.0.3", "")),
+        }
+        for day, relays in consensuses.items():
+            path = consensus_dir / f"2024-02-0{day}-01-00-00-consensus"
+            path.write_text(get_consensus(relays))
+
+        resolver = CountingResolver(pfx2as_path)
+        history = RelayHistoryCollector(
+            date(2024, 2, 6),
+            date(2024, 2, 8),
+            history_dir=tmp_path / "history",
+            consensus_dir=consensus_dir,
+            requests_cache_db_path=tmp_path / "requests.db",
+            resolver=resolver,
+        ).run()
+
+        assert [str(x) for x in resolver.ip_addrs] == [
+            "1.0.0.1/32",
+            "1.0.0.2/32",
+            "2.0.0.2/32",
+            "1.0.0.3/32",
+            "2.0.0.2/32",
+        ]
+        assert list(history) == [date(2024, 2, day) for day in consensuses]
+        assert [len(snapshot) for snapshot in history.values()] == [2, 3, 3]
+        b_history = history.get_relay_history(history[date(2024, 2, 6)][1].fingerprint)
+        assert [relay.ipv4_origin for _, relay in b_history] == [1, 2, 2]
+        assert [relay.exit for _, relay in b_history] == [True, True, False]
+
+    def test_archive_download(self, tmp_path, monkeypatch):
+        """Tests that missing consensuses come from the monthly archive
+
+        Dates that aren't in it fail, rather than using another day's
+        """
+
+        monkeypatch.setattr(
+            TORRelayCollector, "_init_roa_checker", lambda self: ROAChecker()
+        )
+        pfx2as_path = tmp_path / "pfx2as.txt"
+        pfx2as_path.write_text("1.0.0.0\t8\t1\n")
+        relays = (("AtNwqbOLWNZ5xBVKadIqV4vcNz4", "1.0.0.1", "Guard"),)
+        archives = {
+            "consensuses-2024-02.tar.xz": get_archive(
+                {
+                    f"2024-02-0{day}-01-00-00-consensus": get_consensus(relays)
+                    for day in (6, 7)
+                }
+            )
+        }
+        urls = list()
+
+        def get(url, **kwargs):
+            urls.append(url)
+            return FakeResponse(archives.get(url.split("/")[-1]))
+
+        monkeypatch.setattr(requests, "get", get)
+
+        def get_history(start_date, end_date):
+            return RelayHistoryCollector(
+                start_date,
+                end_date,
+                history_dir=tmp_path / "history",
+                requests_cache_db_path=tmp_path / "requests.db",
+                resolver=Pfx2ASPrefixOriginResolver(pfx2as_path),
+            ).run()
+
+        history = get_history(date(2024, 2, 6), date(2024, 2, 7))
+        assert list(history) == [date(2024, 2, 6), date(2024, 2, 7)]
+        assert urls == [
+            "https://collector.torproject.org/archive/relay-descriptors/"
+            "consensuses/consensuses-2024-02.tar.xz"
+        ]
+        consensus_dir = tmp_path / "history" / "consensuses"
+        assert (consensus_dir / "consensuses-2024-02.tar.xz").exists()
+
+        # Already downloaded, but it doesn't have the 8th
+        with pytest.raises(ValueError, match="2024-02-08-01-00-00-consensus"):
+            get_history(date(2024, 2, 6), date(2024, 2, 8))
+        assert len(urls) == 1
+        with pytest.raises(ValueError, match="Couldn't download"):
+            get_history(date(2024, 3, 1), date(2024, 3, 1))
+        assert not (tmp_path / "history" / "2024-03-01.snapshot").exists()
@@ -0,0 +1,205 @@
+from datetime import date
+from ipaddress import ip_network
+import os
+import pickle
+
+import pytest
+
+from frozendict import frozendict
+
+from roa_checker import ROAChecker
+
+from tor_bgp_sims.scenarios import pin_relay_snapshot, RelayWeighting, TORScenario
+from tor_bgp_sims.scenarios.tor_scenario import RELAY_SNAPSHOT_ENV_VAR
+from tor_bgp_sims.tor_relay_collector import (
+    get_tor_relay_groups,
+    RelayClass,
+    RelayIndex,
+    RelaySnapshot,
+    TORRelay,
+)
+from tor_bgp_sims.tor_relay_collector.prefix_origin_resolvers import (
+    Pfx2ASPrefixOriginResolver,
+)
+
+RELAY_ATTRS = (
+    "fingerprint",
+    "ipv4_addr",
+    "ipv4_prefix",
+    "ipv4_origin",
+    "ipv4_roa_validity",
+    "ipv4_roa_routed",
+    "ipv6_addr",
+    "ipv6_prefix",
+    "ipv6_origin",
+    "ipv6_roa_validity",
+    "ipv6_roa_routed",
+    "guard",
+    "exit",
+    "version",
+    "bandwidth_weight",
+)
+
+
+@pytest.fixture
+def tor_relays(tmp_path):
+    pfx2as_path = tmp_path / "pfx2as.txt"
+    pfx2as_path.write_text("1.2.0.0\t16\t2\n5.6.7.0\t24\t3\n2001:db8::\t32\t6\n")
+    roa_checker = ROAChecker()
+    roa_checker.insert(ip_network("1.2.0.0/16"), 2, 16)
+    roa_checker.insert(ip_network("5.6.0.0/16"), 4, 16)
+
+    raw_relays = (
+        {
+            "r": (
+                "a",
+                "AtNwqbOLWNZ5xBVKadIqV4vcNz4",
+                "x",
+                "",
+                "",
+                "1.2.3.4",
+                "443",
+                "0",
+            ),
+            "a": ("[2001:db8::dd2]:9001",),
+            "s": ("Exit", "Fast", "Guard", "Running", "Valid"),
+            "v": ("Tor", "0.4.8.10"),
+            "w": ("Bandwidth=6000",),
+        },
+        {
+            "r": (
+                "b",
+                "BtNwqbOLWNZ5xBVKadIqV4vcNz4",
+                "x",
+                "",
+                "",
+                "5.6.7.8",
+                "443",
+                "0",
+            ),
+            "s": ("Fast", "Guard", "Running", "Valid"),
+            "v": ("Tor", "0.4.7.16"),
+            "w": ("Bandwidth=630",),
+        },
+    )
+    return tuple(
+        TORRelay(
+            **raw,  # type: ignore
+            pr=(),
+            p=(),
+            session=None,  # type: ignore
+            roa_checker=roa_checker,
+            resolver=Pfx2ASPrefixOriginResolver(pfx2as_path),
+        )
+        for raw in raw_relays
+    )
+
+
+@pytest.mark.unit_tests
+class TestRelaySnapshot:
+    def test_round_trip(self, tor_relays, tmp_path):
+        """Tests that snapshot relays have the same data as the TORRelays"""
+
+        path = tmp_path / "relays.snapshot"
+        RelaySnapshot.write(
+            path, tor_relays, dl_date=date(2024, 2, 7), bandwidth_weights={"Wgg": 1}
+        )
+        snapshot = RelaySnapshot(path)
+        assert len(snapshot) == len(tor_relays)
+        assert snapshot.dl_date == date(2024, 2, 7)
+        assert snapshot.bandwidth_weights["Wgg"] == 1
+        for tor_relay, snapshot_relay in zip(tor_relays, snapshot):
+            for attr in RELAY_ATTRS:
+                assert getattr(tor_relay, attr) == getattr(snapshot_relay, attr), attr
+            assert set(tor_relay.s) == set(snapshot_relay.s)
+        assert snapshot[-1] == snapshot[1]
+        assert snapshot[:1] == (snapshot[0],)
+
+        # Relays pickle as references into the snapshot
+        unpickled = pickle.loads(pickle.dumps(snapshot[1]))
+        assert unpickled == snapshot[1]
+        assert unpickled.ipv4_prefix == tor_relays[1].ipv4_prefix
+        assert len(pickle.dumps(snapshot[1])) < len(pickle.dumps(tor_relays[1]))
+
+        # Groups are the same for snapshots as for TORRelays
+        snapshot_groups = get_tor_relay_groups(snapshot)
+        for policy, relays in get_tor_relay_groups(tor_relays).items():
+            assert [x.fingerprint for x in relays] == [
+                x.fingerprint for x in snapshot_groups[policy]
+            ]
+
+    def test_format_version(self, tor_relays, tmp_path):
+        """Tests that snapshots from other format versions are rejected"""
+
+        path = tmp_path / "relays.snapshot"
+        RelaySnapshot.write(path, tor_relays, dl_date=date(2024, 2, 7))
+        data = bytearray(path.read_bytes())
+        data[12] += 1
+        path.write_bytes(data)
+        with pytest.raises(ValueError):
+            RelaySnapshot(path)
+
+    def test_relay_index(self, tor_relays, tmp_path):
+        """Tests that relay index lookups are the same for snapshots"""
+
+        path = tmp_path / "relays.snapshot"
+        RelaySnapshot.write(path, tor_relays, dl_date=date(2024, 2, 7))
+        relay_index = RelayIndex(tor_relays)
+        snapshot_index = RelayIndex(RelaySnapshot(path))
+        lookups = (
+            (RelayClass.GUARD, RelayClass(0)),
+            (RelayClass.EXIT | RelayClass.IPV6, RelayClass(0)),
+            (RelayClass.GUARD | RelayClass.IPV4_LEN_24, RelayClass.IPV4_VALID),
+            (RelayClass.IPV6_INVALID | RelayClass.IPV6_LEN_LT_48, RelayClass(0)),
+        )
+        for required, excluded in lookups:
+            relays = relay_index.get_relays(required, excluded)
+            assert relays == tuple(
+                x
+                for x in tor_relays
+                if RelayIndex.get_relay_class(x) & required == required
+                and not RelayIndex.get_relay_class(x) & excluded
+            )
+            assert relay_index.count(required, excluded) == len(relays)
+            assert [x.fingerprint for x in relays] == [
+                x.fingerprint for x in snapshot_index.get_relays(required, excluded)
+            ]
+            # Lookups are cached
+            assert relays is relay_index.get_relays(required, excluded)
+        assert relay_index.get_relays(RelayClass.GUARD) == tor_relays
+        assert relay_index.get_relays(RelayClass.EXIT) == tor_relays[:1]
+
+    def test_pinned_relay_groups(self, tor_relays, tmp_path, monkeypatch):
+        """Tests that TORScenarios load relay groups from the pinned snapshot"""
+
+        monkeypatch.delenv(RELAY_SNAPSHOT_ENV_VAR, raising=False)
+        path = tmp_path / "relays.snapshot"
+        RelaySnapshot.write(path, tor_relays, dl_date=date(2024, 2, 7))
+        pin_relay_snapshot(RelaySnapshot(path))
+        # Workers inherit the pinned path from the environment
+        assert os.environ[RELAY_SNAPSHOT_ENV_VAR] == str(path.resolve())
+        tor_relay_groups_dict = TORScenario.get_tor_relay_groups_dict()
+        assert tor_relay_groups_dict is TORScenario.get_tor_relay_groups_dict()
+        for policy, relays in get_tor_relay_groups(tor_relays).items():
+            assert [x.fingerprint for x in relays] == [
+                x.fingerprint for x in tor_relay_groups_dict[policy]
+            ]
+
+    def test_relay_weights(self, tor_relays):
+        """Tests that relays are weighted by bandwidth for their position"""
+
+        class WeightedTORScenario(TORScenario):
+            tor_relay_groups_dict = get_tor_relay_groups(tor_relays)
+            bandwidth_weights = frozendict({"Wgg": 5000, "Wgd": 2000})
+            relay_weighting = RelayWeighting.CONSENSUS
+
+        # The first guard can also exit, so it's weighted by Wgd
+        assert [WeightedTORScenario.get_relay_weight(x) for x in tor_relays] == [
+            1200,
+            315,
+        ]
+        WeightedTORScenario.relay_weighting = RelayWeighting.BANDWIDTH
+        assert [WeightedTORScenario.get_relay_weight(x) for x in tor_relays] == [
+            6000,
+            630,
+        ]
@@ -0,0 +1,67 @@
+from datetime import date
+from ipaddress import ip_network
+import json
+import lzma
+
+import pytest
+
+from roa_checker import ROAValidity
+
+from tor_bgp_sims.tor_relay_collector import ROASnapshotStore
+
+
+@pytest.fixture
+def vrp_dir(tmp_path):
+    vrp_dir = tmp_path / "vrps"
+    (vrp_dir / "ripencc.tal" / "2024" / "02" / "01").mkdir(parents=True)
+    (vrp_dir / "arin.tal" / "2024" / "02" / "01").mkdir(parents=True)
+    # Both trust anchors are merged for 02-01
+    with lzma.open(vrp_dir / "ripencc.tal/2024/02/01/roas.csv.xz", "wt") as f:
+        f.write("URI,ASN,IP Prefix,Max Length,Not Before,Not After\n")
+        f.write("rsync://x,AS1,1.0.0.0/8,8,,\n")
+    with (vrp_dir / "arin.tal/2024/02/01/output.json").open("w") as f:
+        json.dump({"roas": [{"asn": 2, "prefix": "2.0.0.0/8", "maxLength": 16}]}, f)
+    # Later on, AS 1 gets a ROA for a longer max length
+    (vrp_dir / "2024-02-10.csv").write_text(
+        "ASN,IP Prefix,Max Length,Trust Anchor\nAS1,1.0.0.0/8,24,ripe\n"
+    )
+    return vrp_dir
+
+
+@pytest.mark.unit_tests
+class TestROASnapshotStore:
+    def test_dates(self, vrp_dir, tmp_path):
+        """Tests that ROAs match the latest export on or before the date"""
+
+        store = ROASnapshotStore(vrp_dir, cache_dir=tmp_path / "cache")
+        assert store.get_vrp_date(date(2024, 2, 5)) == date(2024, 2, 1)
+        assert store.get_vrp_date(date(2024, 2, 10)) == date(2024, 2, 10)
+        with pytest.raises(ValueError):
+            store.get_vrp_date(date(2024, 1, 31))
+
+        prefix = ip_network("1.2.3.0/24")
+        roa_checker = store.get_roa_checker(date(2024, 2, 5))
+        validity, _ = roa_checker.get_validity(prefix, 1)
+        assert validity == ROAValidity.INVALID_LENGTH
+        validity, _ = roa_checker.get_validity(ip_network("2.0.0.0/16"), 2)
+        assert validity == ROAValidity.VALID
+
+        validity, _ = store.get_roa_checker(date(2024, 3, 1)).get_validity(prefix, 1)
+        assert validity == ROAValidity.VALID
+
+    def test_cached(self, vrp_dir, tmp_path, monkeypatch):
+        """Tests that ROACheckers are only built once, and then reloaded"""
+
+        cache_dir = tmp_path / "cache"
+        ROASnapshotStore(vrp_dir, cache_dir=cache_dir).get_roa_checker(date(2024, 2, 5))
+        assert len(list(cache_dir.glob("2024-02-01_*.pickle"))) == 1
+
+        def build(*args, **kwargs):
+            raise AssertionError("Should have been loaded from the cache")
+
+        monkeypatch.setattr(ROASnapshotStore, "_build_roa_checker", build)
+        roa_checker = ROASnapshotStore(vrp_dir, cache_dir=cache_dir).get_roa_checker(
+            date(2024, 2, 5)
+        )
+        validity, _ = roa_checker.get_validity(ip_network("1.0.0.0/8"), 1)
+        assert validity == ROAValidity.VALID
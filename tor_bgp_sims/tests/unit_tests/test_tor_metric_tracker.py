@@ -0,0 +1,61 @@
+from collections import defaultdict
+from dataclasses import replace
+
+import pytest
+
+from bgpy.enums import ASGroups, Outcomes, Plane
+from bgpy.simulation_engine import BGP, ROV
+from bgpy.simulation_framework import ScenarioConfig
+from bgpy.simulation_framework.metric_tracker import DataKey, Metric
+from bgpy.simulation_framework.metric_tracker.metric_key import MetricKey
+
+from tor_bgp_sims.scenarios import ClientsToGuardScenario
+from tor_bgp_sims.simulation_framework import TORMetricTracker
+from tor_bgp_sims.tor_relay_collector import get_relay_equivalence_classes
+
+
+@pytest.mark.unit_tests
+class TestTORMetricTracker:
+    def test_merge_weighted_trial(self):
+        """Tests that weighted runs are merged into one weighted mean trial"""
+
+        metric_key = MetricKey(
+            Plane.DATA, ASGroups.ALL_WOUT_IXPS, Outcomes.VICTIM_SUCCESS
+        )
+        rov_key = replace(metric_key, PolicyCls=ROV)
+        data_key = DataKey(
+            propagation_round=0,
+            percent_adopt=0.5,
+            scenario_config=ScenarioConfig(
+                ScenarioCls=ClientsToGuardScenario, AdoptPolicyCls=ROV
+            ),
+            metric_key=metric_key,
+        )
+        metric_tracker = TORMetricTracker()
+        weighted_percents: tuple[tuple[float, dict[MetricKey, list[float]]], ...] = (
+            (0.75, {metric_key: [40.0], rov_key: []}),
+            (0.25, {metric_key: [80.0], rov_key: [10.0]}),
+        )
+        for weight, percents in weighted_percents:
+            metric = Metric(
+                metric_key, frozenset([BGP, ROV]), defaultdict(list, percents)
+            )
+            metric_tracker._weighted_metrics[data_key].append((weight, metric))
+        metric_tracker.merge_weighted_trial()
+
+        [merged] = metric_tracker.data[data_key]
+        assert merged.percents[metric_key] == [50.0]
+        # Runs without data for a key don't count towards its mean
+        assert merged.percents[rov_key] == [10.0]
+        assert not metric_tracker._weighted_metrics
+
+    def test_relay_equivalence_classes(self):
+        """Tests that relays are grouped by key in first seen order"""
+
+        classes = get_relay_equivalence_classes(
+            range(7), lambda x: x % 3  # type: ignore
+        )
+        assert [x.key for x in classes] == [0, 1, 2]
+        assert [x.relays for x in classes] == [(0, 3, 6), (1, 4), (2, 5)]
+        assert [x.relay for x in classes] == [0, 1, 2]
+        assert sum(x.count for x in classes) == 7
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from bgpy.as_graphs import ASGraph
+from bgpy.simulation_engine import BGP, ROV, SimulationEngine
+from bgpy.simulation_framework import PrefixHijack, ScenarioConfig, SubprefixHijack
+
+from tor_bgp_sims.policies import Dest24, DestNotValidNot24
+from tor_bgp_sims.scenarios.tor_scenario import get_propagation_policy_cls
+from tor_bgp_sims.simulation_framework import TORSimulationEngine
+from tor_bgp_sims.simulation_framework.tor_simulation_engine import (
+    get_valley_free_propagation_ranks,
+)
+
+from .utils import get_random_as_graph_info
+
+
+@pytest.mark.unit_tests
+class TestTORSimulationEngine:
+    @pytest.mark.parametrize("seed", range(20))
+    @pytest.mark.parametrize("BaseScenarioCls", (PrefixHijack, SubprefixHijack))
+    def test_pruned_ribs(self, seed, BaseScenarioCls):
+        """Tests that pruned propagation gives the targets the same RIBs
+
+        ROV adopters drop the invalid announcements, which pruning must not
+        change. Every AS that's pruned must not get any announcements
+        """
+
+        rand = random.Random(seed)
+        as_graph_info = get_random_as_graph_info(rand, 150)
+        victim_asn, attacker_asn, *target_asns = rand.sample(range(1, 151), 5)
+
+        class PrunedScenario(BaseScenarioCls):  # type: ignore
+            def _get_propagation_target_asns(self, propagation_round):
+                return frozenset(target_asns)
+
+        ribs = list()
+        for EngineCls in (SimulationEngine, TORSimulationEngine):
+            engine = EngineCls(ASGraph(as_graph_info))
+            scenario_config = ScenarioConfig(
+                ScenarioCls=PrunedScenario,
+                AdoptPolicyCls=ROV,
+                override_victim_asns=frozenset([victim_asn]),
+                override_attacker_asns=frozenset([attacker_asn]),
+            )
+            random.seed(seed)
+            scenario = PrunedScenario(
+                scenario_config=scenario_config, engine=engine, percent_adoption=0.5
+            )
+            assert any(
+                x == ROV for x in scenario.non_default_asn_cls_dict.values()
+            ), "ROV must adopt for the invalid announcements to be dropped"
+            scenario.setup_engine(engine)
+            engine.run(propagation_round=0, scenario=scenario)
+            ribs.append(
+                [
+                    {
+                        prefix: (ann.as_path, ann.recv_relationship)
+                        for prefix, ann in engine.as_graph.as_dict[
+                            asn
+                        ].policy._local_rib.items()
+                    }
+                    for asn in target_asns
+                ]
+            )
+
+        propagation_ranks = get_valley_free_propagation_ranks(
+            engine.as_graph, (victim_asn, attacker_asn), target_asns
+        )
+        pruned_asns = {x.asn for rank in propagation_ranks for x in rank}
+        assert len(pruned_asns) < len(engine.as_graph.as_dict)
+        for as_obj in engine.as_graph:
+            if as_obj.asn not in pruned_asns:
+                assert not as_obj.policy._local_rib, "Pruned ASes don't propagate"
+        assert ribs[0] == ribs[1]
+
+    def test_propagation_policy_cls(self):
+        """Tests that only renamed policies share cached rounds"""
+
+        class ROVWithAttr(ROV):
+            attr = 1
+
+        assert get_propagation_policy_cls(Dest24) is ROV
+        assert get_propagation_policy_cls(DestNotValidNot24) is ROV
+        assert get_propagation_policy_cls(ROV) is ROV
+        assert get_propagation_policy_cls(BGP) is BGP
+        assert get_propagation_policy_cls(ROVWithAttr) is ROVWithAttr
@@ -0,0 +1,74 @@
+"""Helpers that the unit tests share, rather than importing from each other"""
+
+from dataclasses import dataclass
+from ipaddress import IPv4Network
+import random
+
+from frozendict import frozendict
+
+from bgpy.as_graphs import ASGraph, ASGraphInfo
+from bgpy.as_graphs.base.links import CustomerProviderLink as CPLink, PeerLink
+
+from roa_checker import ROAValidity
+
+from tor_bgp_sims.policies import GuardValid24
+from tor_bgp_sims.scenarios import ClientsToGuardScenario
+
+
+@dataclass(frozen=True)
+class FakeRelay:
+    """Only what ClientsToGuardScenario looks at"""
+
+    ipv4_origin: int
+    ipv4_prefix: IPv4Network
+    ipv4_roa_validity: ROAValidity
+
+
+def get_random_as_graph_info(rand: random.Random, num_ases: int) -> ASGraphInfo:
+    """Returns a random graph, where providers always have lower ASNs"""
+
+    cp_links = set()
+    for customer_asn in range(2, num_ases + 1):
+        num_providers = min(customer_asn - 1, rand.choice((1, 1, 2, 3)))
+        for provider_asn in rand.sample(range(1, customer_asn), num_providers):
+            cp_links.add(CPLink(customer_asn=customer_asn, provider_asn=provider_asn))
+    linked = {frozenset(x.asns) for x in cp_links}
+    peer_links = set()
+    for _ in range(num_ases // 2):
+        asns = frozenset(rand.sample(range(1, num_ases + 1), 2))
+        if asns not in linked:
+            linked.add(asns)
+            peer_links.add(PeerLink(*asns))
+    return ASGraphInfo(
+        customer_provider_links=frozenset(cp_links), peer_links=frozenset(peer_links)
+    )
+
+
+class RandomASGraphConstructor:
+    """Builds a random graph for simulations, rather than downloading CAIDA's"""
+
+    def __init__(self, seed: int = 0, num_ases: int = 60, **kwargs) -> None:
+        self.seed: int = seed
+        self.num_ases: int = num_ases
+
+    def run(self) -> ASGraph:
+        return ASGraph(
+            get_random_as_graph_info(random.Random(self.seed), self.num_ases)
+        )
+
+
+# Relays for FakeGuardScenario, in a RandomASGraphConstructor graph
+GUARD_RELAYS: tuple[FakeRelay, ...] = tuple(
+    FakeRelay(
+        ipv4_origin=asn,
+        ipv4_prefix=IPv4Network("1.2.0.0/16"),
+        ipv4_roa_validity=ROAValidity.VALID,
+    )
+    for asn in (31, 45, 58)
+)
+
+
+class FakeGuardScenario(ClientsToGuardScenario):
+    """ClientsToGuardScenario for simulations, with the GUARD_RELAYS"""
+
+    tor_relay_groups_dict = frozendict({GuardValid24: GUARD_RELAYS})  # type: ignore
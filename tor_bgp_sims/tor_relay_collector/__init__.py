@@ -1,10 +1,37 @@
 from .tor_relay_collector import TORRelayCollector
 from .tor_relay import TORRelay
-from .utils import get_tor_relay_groups, print_relay_stats
+from .relay_snapshot import Relay, RelaySnapshot, SnapshotRelay
+from .relay_history import RelayHistory, RelayHistoryCollector
+from .roa_snapshot import ROASnapshotStore
+from .batch_roa_validator import BatchROAValidator
+from .relay_index import RelayClass, RelayIndex
+from .alias_table import AliasTable
+from .relay_equivalence_class import (
+    get_relay_equivalence_classes,
+    RelayEquivalenceClass,
+)
+from .utils import (
+    get_position_bandwidth_weight,
+    get_tor_relay_groups,
+    print_relay_stats,
+)
 
 __all__ = [
     "TORRelayCollector",
     "TORRelay",
+    "Relay",
+    "RelaySnapshot",
+    "SnapshotRelay",
+    "RelayHistory",
+    "RelayHistoryCollector",
+    "ROASnapshotStore",
+    "BatchROAValidator",
+    "RelayClass",
+    "RelayIndex",
+    "AliasTable",
+    "RelayEquivalenceClass",
+    "get_relay_equivalence_classes",
+    "get_position_bandwidth_weight",
     "get_tor_relay_groups",
     "print_relay_stats",
 ]
@@ -0,0 +1,43 @@
+import random
+from typing import Sequence
+
+
+class AliasTable:
+    """Samples indexes in proportion to their weights in O(1) (Vose's method)
+
+    Building the table is O(n), and then each sample is a single uniform
+    pick of a column, plus a biased coin flip between the column and its
+    alias. Samples use the random module, so seeding it seeds the samples
+    """
+
+    def __init__(self, weights: Sequence[float]) -> None:
+        total = sum(weights)
+        if not weights or total <= 0 or min(weights) < 0:
+            raise ValueError("Weights must be non negative with a positive sum")
+
+        num_weights = len(weights)
+        # Weights scaled so that the average is 1
+        scaled = [x * num_weights / total for x in weights]
+        self.probs: list[float] = [1.0] * num_weights
+        self.aliases: list[int] = list(range(num_weights))
+        small = [i for i, x in enumerate(scaled) if x < 1]
+        large = [i for i, x in enumerate(scaled) if x >= 1]
+        while small and large:
+            i = small.pop()
+            j = large[-1]
+            self.probs[i] = scaled[i]
+            self.aliases[i] = j
+            # j fills the rest of i's column
+            scaled[j] -= 1 - scaled[i]
+            if scaled[j] < 1:
+                small.append(large.pop())
+        # Whatever is left is 1 up to floating point error, and keeps prob 1
+
+    def __len__(self) -> int:
+        return len(self.probs)
+
+    def sample(self) -> int:
+        """Returns an index, with probability proportional to its weight"""
+
+        i = int(random.random() * len(self.probs))
+        return i if random.random() < self.probs[i] else self.aliases[i]
@@ -0,0 +1,216 @@
+from array import array
+from ipaddress import IPv4Network, IPv6Network
+from typing import Any, Iterable, Optional, Sequence
+
+from frozendict import frozendict
+
+from lib_cidr_trie import CIDRTrie
+
+from roa_checker import ROA, ROAChecker, ROARouted, ROAValidity
+
+from .relay_snapshot import RelaySnapshot
+
+
+class BatchROAValidator:
+    """Validates many prefix origin pairs against a ROA set at once
+
+    ROAChecker walks a trie bit by bit for every pair, which is slow when
+    all of the relays need to be rechecked against many alternative ROA
+    sets (ex: what if these ASes issued ROAs?). Instead, the ROA prefixes
+    are sorted once, and the pairs are sorted and merged against them in a
+    single sweep, keeping a stack of the ROA prefixes that cover the
+    current address.
+
+    The results are the same as ROAChecker.get_validity: only the most
+    specific ROA prefix covering a pair is used (ignoring /0 ROAs, which
+    the trie never returns), and the best outcome of its origin max length
+    pairs wins, with ties broken in the same (set) order as the ROA node
+    """
+
+    def __init__(
+        self,
+        roas: Iterable[tuple[IPv4Network | IPv6Network, int, Optional[int]]] = (),
+    ) -> None:
+        # Inserted the same way as ROA.add_data, so that set order matches
+        roa_pairs: dict[tuple[int, int, int], set[tuple[int, int]]] = dict()
+        for prefix, origin, max_length in roas:
+            if max_length is None:
+                max_length = prefix.prefixlen
+            key = (prefix.version, int(prefix.network_address), prefix.prefixlen)
+            roa_pairs.setdefault(key, set()).add((origin, max_length))
+        self._init_roas(
+            {key: tuple(pairs) for key, pairs in roa_pairs.items() if key[2] > 0}
+        )
+
+    @classmethod
+    def from_roa_checker(cls, roa_checker: ROAChecker) -> "BatchROAValidator":
+        """Returns a BatchROAValidator with the ROAs from a ROAChecker"""
+
+        validator = cls()
+        roas: dict[tuple[int, int, int], tuple[tuple[int, int], ...]] = dict()
+        tries: tuple[CIDRTrie[Any], ...] = (
+            roa_checker.ipv4_trie,
+            roa_checker.ipv6_trie,
+        )
+        for trie in tries:
+            # The root is never returned by the trie, so it's skipped
+            nodes = [x for x in (trie.root.left, trie.root.right) if x]
+            while nodes:
+                node = nodes.pop()
+                if node.prefix is not None:
+                    assert isinstance(node, ROA), "for mypy"
+                    key = (
+                        node.prefix.version,
+                        int(node.prefix.network_address),
+                        node.prefix.prefixlen,
+                    )
+                    roas[key] = tuple(node.origin_max_lengths)
+                nodes.extend(x for x in (node.left, node.right) if x)
+        validator._init_roas(roas)
+        return validator
+
+    def get_validities(
+        self,
+        version: int,
+        addrs: Sequence[int],
+        prefixlens: Sequence[int],
+        origins: Sequence[int],
+    ) -> tuple["array[int]", "array[int]"]:
+        """Returns the ROAValidity and ROARouted values for each pair
+
+        addrs can be any address within each prefix (ex: the relay's IP)
+        """
+
+        max_prefixlen = 32 if version == 4 else 128
+        starts, prefixlens_, ends, roa_pairs = self._roas[version]
+        validities = array("B", [ROAValidity.UNKNOWN.value]) * len(addrs)
+        routeds = array("B", [ROARouted.UNKNOWN.value]) * len(addrs)
+
+        queries = sorted(
+            (
+                (addr >> (max_prefixlen - prefixlen)) << (max_prefixlen - prefixlen),
+                prefixlen,
+                i,
+            )
+            for i, (addr, prefixlen) in enumerate(zip(addrs, prefixlens))
+        )
+        # Indexes of the ROA prefixes covering the current address, which
+        # are always nested, so the last one is the most specific
+        stack: list[int] = list()
+        j = 0
+        for start, prefixlen, i in queries:
+            # Every ROA prefix that sorts before the query is pushed. Ones
+            # that start at the same address but are more specific don't
+            # cover the query, and sort after it
+            while j < len(starts) and (starts[j], prefixlens_[j]) <= (
+                start,
+                prefixlen,
+            ):
+                while stack and ends[stack[-1]] < starts[j]:
+                    stack.pop()
+                stack.append(j)
+                j += 1
+            while stack and ends[stack[-1]] < start:
+                stack.pop()
+            if stack:
+                validity, routed = self._get_validity(
+                    roa_pairs[stack[-1]], prefixlen, origins[i]
+                )
+                validities[i] = validity.value
+                routeds[i] = routed.value
+        return validities, routeds
+
+    def validate_snapshot(
+        self, snapshot: RelaySnapshot
+    ) -> frozendict[str, "array[int]"]:
+        """Returns the ROA validity columns for a snapshot under these ROAs
+
+        Keys are the same as the snapshot's columns (ex: ipv4_roa_validity),
+        with one value per relay
+        """
+
+        ipv4_validities, ipv4_routeds = self.get_validities(
+            4,
+            snapshot.get_column("ipv4_addr"),
+            snapshot.get_column("ipv4_prefixlen"),
+            snapshot.get_column("ipv4_origin"),
+        )
+        # Relays without IPv6 stay unknown, the same as TORRelay
+        ipv6_indexes = [
+            i
+            for i, prefixlen in enumerate(snapshot.get_column("ipv6_prefixlen"))
+            if prefixlen != RelaySnapshot.NO_IPV6
+        ]
+        ipv6_validities = array("B", [ROAValidity.UNKNOWN.value]) * len(snapshot)
+        ipv6_routeds = array("B", [ROARouted.UNKNOWN.value]) * len(snapshot)
+        validities, routeds = self.get_validities(
+            6,
+            [int.from_bytes(snapshot.get("ipv6_addr", i), "big") for i in ipv6_indexes],
+            [snapshot.get_column("ipv6_prefixlen")[i] for i in ipv6_indexes],
+            [snapshot.get_column("ipv6_origin")[i] for i in ipv6_indexes],
+        )
+        for i, validity, routed in zip(ipv6_indexes, validities, routeds):
+            ipv6_validities[i] = validity
+            ipv6_routeds[i] = routed
+        return frozendict(
+            {
+                "ipv4_roa_validity": ipv4_validities,
+                "ipv4_roa_routed": ipv4_routeds,
+                "ipv6_roa_validity": ipv6_validities,
+                "ipv6_roa_routed": ipv6_routeds,
+            }
+        )
+
+    def _init_roas(
+        self, roas: dict[tuple[int, int, int], tuple[tuple[int, int], ...]]
+    ) -> None:
+        """Sorts the ROA prefixes into (start, prefixlen, end, pairs) columns
+
+        roas maps (version, start, prefixlen) to the origin max length pairs
+        """
+
+        self._roas: dict[
+            int,
+            tuple[
+                tuple[int, ...],
+                tuple[int, ...],
+                tuple[int, ...],
+                tuple[tuple[tuple[int, int], ...], ...],
+            ],
+        ] = dict()
+        sorted_keys = sorted(roas)
+        for version, max_prefixlen in ((4, 32), (6, 128)):
+            keys = [x for x in sorted_keys if x[0] == version]
+            self._roas[version] = (
+                tuple(start for _, start, _ in keys),
+                tuple(prefixlen for _, _, prefixlen in keys),
+                tuple(
+                    start + (1 << (max_prefixlen - prefixlen)) - 1
+                    for _, start, prefixlen in keys
+                ),
+                tuple(roas[key] for key in keys),
+            )
+
+    @staticmethod
+    def _get_validity(
+        roa_pairs: tuple[tuple[int, int], ...], prefixlen: int, origin: int
+    ) -> tuple[ROAValidity, ROARouted]:
+        """Returns the best outcome of the ROA's pairs, same as ROA.get_validity"""
+
+        best: Optional[tuple[ROAValidity, ROARouted]] = None
+        for roa_origin, max_length in roa_pairs:
+            if prefixlen > max_length:
+                if origin != roa_origin:
+                    validity = ROAValidity.INVALID_LENGTH_AND_ORIGIN
+                else:
+                    validity = ROAValidity.INVALID_LENGTH
+            elif origin != roa_origin:
+                validity = ROAValidity.INVALID_ORIGIN
+            else:
+                validity = ROAValidity.VALID
+            # The first of the best outcomes wins ties, same as a stable sort
+            if best is None or validity.value < best[0].value:
+                routed = ROARouted.NON_ROUTED if roa_origin == 0 else ROARouted.ROUTED
+                best = (validity, routed)
+        assert best, "ROA prefixes always have pairs"
+        return best
@@ -0,0 +1,136 @@
+from dataclasses import dataclass
+from datetime import datetime
+import lzma
+from pathlib import Path
+import tarfile
+from typing import IO, Iterable, Iterator, Optional
+
+from frozendict import frozendict
+from requests_cache import CachedSession
+
+
+@dataclass(frozen=True, slots=True)
+class ConsensusFooter:
+    """Structured data from the consensus directory-footer
+
+    bandwidth-weights are the Wxx position weights (scaled by 10000), ex:
+        bandwidth-weights Wbd=0 Wbe=0 Wbg=4110 Wbm=10000 Wdb=10000 ...
+    """
+
+    bandwidth_weights: frozendict[str, int]
+
+
+class ConsensusParser:
+    """Streams relay records out of a TOR consensus, one relay at a time
+
+    Iterating yields a dict per relay, keyed by the line keyword
+    (r/a/s/v/pr/w/p, see the TORRelay dataclass) with the remaining words of
+    the line as a tuple. Once iteration is done, the footer is populated.
+
+    The lines can come from anywhere, see from_url, from_path, and
+    iter_archive for the usual sources
+    """
+
+    relay_keys: frozenset[str] = frozenset(["r", "a", "s", "v", "pr", "w", "p"])
+
+    def __init__(self, lines: Iterable[str], name: str = "") -> None:
+        self.lines: Iterable[str] = lines
+        self.name: str = name
+        # Set from the header, before the first relay is yielded
+        self.valid_after: Optional[datetime] = None
+        # Set once all relays have been yielded
+        self.footer: Optional[ConsensusFooter] = None
+
+    @classmethod
+    def from_url(cls, session: CachedSession, url: str) -> "ConsensusParser":
+        """Streams the consensus from a URL
+
+        Raises an HTTPError if the consensus isn't posted
+        """
+
+        resp = session.get(url, stream=True)
+        resp.raise_for_status()
+        return cls(resp.iter_lines(decode_unicode=True), name=url)
+
+    @classmethod
+    def from_path(cls, path: Path) -> "ConsensusParser":
+        """Streams the consensus from a local (optionally .xz) file"""
+
+        if path.suffix == ".xz":
+            f = lzma.open(path, "rt")
+        else:
+            f = path.open()
+        return cls(cls._iter_and_close(f), name=path.name)
+
+    @classmethod
+    def iter_archive(cls, path: Path) -> Iterator["ConsensusParser"]:
+        """Yields a parser per consensus in a CollecTor .tar.xz archive
+
+        ex: consensuses-2024-02.tar.xz, which has every hourly consensus of
+        the month. The archive is read as a stream, so each parser must be
+        consumed before moving on to the next
+        """
+
+        with tarfile.open(path, "r|xz") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                f = tar.extractfile(member)
+                assert f, "for mypy"
+                # NOTE: can't use a TextIOWrapper, since the stream isn't seekable
+                lines = (line.decode() for line in f)
+                yield cls(lines, name=Path(member.name).name)
+
+    def __iter__(self) -> Iterator[dict[str, tuple[str, ...]]]:
+        """Yields the raw data for each relay"""
+
+        relay: Optional[dict[str, tuple[str, ...]]] = None
+        lines = iter(self.lines)
+        for line in lines:
+            sections = line.split()
+            if not sections:
+                continue
+            keyword = sections[0]
+            if keyword == "r":
+                if relay:
+                    yield relay
+                relay = dict()
+            elif keyword == "directory-footer":
+                break
+            elif relay is None:
+                if keyword == "valid-after":
+                    self.valid_after = datetime.strptime(
+                        " ".join(sections[1:3]), "%Y-%m-%d %H:%M:%S"
+                    )
+                continue
+
+            if keyword in self.relay_keys:
+                assert relay is not None, "for mypy"
+                relay[keyword] = tuple(sections[1:])
+        else:
+            raise NotImplementedError(f"Never reached directory footer {self.name}")
+
+        assert relay, f"Didn't parse any TOR relays {self.name}"
+        yield relay
+        self.footer = self._parse_footer(lines)
+
+    @staticmethod
+    def _parse_footer(lines: Iterator[str]) -> ConsensusFooter:
+        """Parses the footer lines, up until the signatures"""
+
+        bandwidth_weights: dict[str, int] = dict()
+        for line in lines:
+            if line.startswith("bandwidth-weights"):
+                for weight in line.split()[1:]:
+                    k, v = weight.split("=")
+                    bandwidth_weights[k] = int(v)
+            elif line.startswith("directory-signature"):
+                break
+        return ConsensusFooter(bandwidth_weights=frozendict(bandwidth_weights))
+
+    @staticmethod
+    def _iter_and_close(f: IO[str]) -> Iterator[str]:
+        """Yields lines from a file, closing it when done"""
+
+        with f:
+            yield from f
@@ -0,0 +1,165 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from ipaddress import ip_network, IPv4Network, IPv6Network
+import json
+from pathlib import Path
+import sqlite3
+from threading import Lock
+import time
+from typing import Optional
+
+
+@dataclass(frozen=True, slots=True)
+class PrefixOriginEntry:
+    """A resolved prefix origin pair, and the related prefixes RIPE returned"""
+
+    prefix: IPv4Network | IPv6Network
+    origin: int
+    related: tuple[tuple[str, int], ...]
+    fetched_at: float
+
+
+class PrefixOriginCache:
+    """Durable prefix -> (origin, related prefixes) store with longest prefix match
+
+    Unlike the requests_cache DB (which is keyed by day and by exact IP),
+    this persists across consensus dates, and answers for any IP that falls
+    within a prefix we've already resolved.
+
+    Entries are keyed by the prefix they are authoritative for. Prefixes
+    of length /24 (/48 for IPv6) or longer are keyed by themselves. Shorter
+    prefixes are keyed by the /24 (or /48) block of the IP that was looked up,
+    since a more specific prefix (that RIPE never told us about) could exist
+    elsewhere within the shorter prefix. Any prefix of /24 or shorter that
+    covers one IP in a /24 covers every IP in that /24, so relays that share a
+    /24 share an entry.
+    """
+
+    # More specific than this isn't globally routable
+    routable_prefixlens: dict[int, int] = {4: 24, 6: 48}
+
+    def __init__(self, db_path: Path, ttl: timedelta = timedelta(days=30)) -> None:
+        self.db_path: Path = db_path
+        self.ttl: timedelta = ttl
+        self._lock: Lock = Lock()
+        # Autocommit, and shared between the collector's threads (under the lock)
+        self._conn: sqlite3.Connection = sqlite3.connect(
+            str(db_path), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS prefix_origins ("
+            "version INTEGER, network TEXT, prefixlen INTEGER, "
+            "prefix TEXT, origin INTEGER, related TEXT, fetched_at REAL, "
+            "PRIMARY KEY (version, network, prefixlen))"
+        )
+        # {version: {prefixlen: {network int: entry}}}
+        self._entries: dict[int, dict[int, dict[int, PrefixOriginEntry]]] = {
+            4: dict(),
+            6: dict(),
+        }
+        # Most specific first, for the longest prefix match
+        self._prefixlens: dict[int, list[int]] = {4: [], 6: []}
+        self._load()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def get(
+        self, ip_addr: IPv4Network | IPv6Network
+    ) -> Optional[tuple[IPv4Network | IPv6Network, int]]:
+        """Returns the most specific unexpired prefix origin pair covering ip_addr"""
+
+        entry = self.get_entry(ip_addr)
+        return None if entry is None else (entry.prefix, entry.origin)
+
+    def get_entry(
+        self, ip_addr: IPv4Network | IPv6Network
+    ) -> Optional[PrefixOriginEntry]:
+        """Returns the most specific unexpired entry covering ip_addr"""
+
+        ip_int = int(ip_addr.network_address)
+        max_len = ip_addr.max_prefixlen
+        min_fetched_at = time.time() - self.ttl.total_seconds()
+        with self._lock:
+            entries = self._entries[ip_addr.version]
+            for prefixlen in self._prefixlens[ip_addr.version]:
+                if prefixlen > ip_addr.prefixlen:
+                    continue
+                network = ip_int >> (max_len - prefixlen) << (max_len - prefixlen)
+                entry = entries[prefixlen].get(network)
+                if entry and entry.fetched_at >= min_fetched_at:
+                    return entry
+        return None
+
+    def add(
+        self,
+        ip_addr: IPv4Network | IPv6Network,
+        prefix: IPv4Network | IPv6Network,
+        origin: int,
+        related: tuple[tuple[IPv4Network | IPv6Network, int], ...] = (),
+    ) -> None:
+        """Stores the prefix origin pair that was resolved for ip_addr"""
+
+        routable_prefixlen = self.routable_prefixlens[ip_addr.version]
+        if prefix.prefixlen >= routable_prefixlen:
+            key = prefix
+        else:
+            key = ip_addr.supernet(new_prefix=routable_prefixlen)
+        entry = PrefixOriginEntry(
+            prefix=prefix,
+            origin=origin,
+            related=tuple((str(p), o) for p, o in related),
+            fetched_at=time.time(),
+        )
+        with self._lock:
+            self._insert(key, entry)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prefix_origins VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key.version,
+                    self._network_str(key),
+                    key.prefixlen,
+                    str(prefix),
+                    origin,
+                    json.dumps(entry.related),
+                    entry.fetched_at,
+                ),
+            )
+
+    def _load(self) -> None:
+        """Loads all entries from the DB into memory"""
+
+        rows = self._conn.execute(
+            "SELECT version, network, prefixlen, prefix, origin, related, fetched_at "
+            "FROM prefix_origins"
+        )
+        for version, network, prefixlen, prefix, origin, related, fetched_at in rows:
+            key: IPv4Network | IPv6Network
+            if version == 4:
+                key = IPv4Network((int(network, 16), prefixlen))
+            else:
+                key = IPv6Network((int(network, 16), prefixlen))
+            self._insert(
+                key,
+                PrefixOriginEntry(
+                    prefix=ip_network(prefix),
+                    origin=origin,
+                    related=tuple((p, o) for p, o in json.loads(related)),
+                    fetched_at=fetched_at,
+                ),
+            )
+
+    def _insert(self, key: IPv4Network | IPv6Network, entry: PrefixOriginEntry) -> None:
+        """Inserts an entry in memory (caller must hold the lock)"""
+
+        entries = self._entries[key.version]
+        if key.prefixlen not in entries:
+            entries[key.prefixlen] = dict()
+            self._prefixlens[key.version] = sorted(entries, reverse=True)
+        entries[key.prefixlen][int(key.network_address)] = entry
+
+    @staticmethod
+    def _network_str(prefix: IPv4Network | IPv6Network) -> str:
+        """Fixed width hex, since IPv6 ints don't fit in an SQLite INTEGER"""
+
+        return format(int(prefix.network_address), "032x")
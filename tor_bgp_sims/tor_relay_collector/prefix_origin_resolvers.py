@@ -0,0 +1,298 @@
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+import bz2
+import gzip
+from ipaddress import ip_network, IPv4Network, IPv6Network
+import lzma
+from pathlib import Path
+from pprint import pprint, pformat
+import random
+import time
+from typing import Any, IO, Iterator, Optional
+
+import requests
+from requests_cache import CachedSession
+
+from .prefix_origin_cache import PrefixOriginCache
+from .token_bucket import TokenBucket
+
+
+RIPE_RELATED_PREFIXES_URL = "https://stat.ripe.net/data/related-prefixes/data.json"
+
+
+def get_most_specific_pair(
+    ip_addr: IPv4Network | IPv6Network,
+    prefix_origin_pairs: list[tuple[IPv4Network | IPv6Network, int]],
+    details: str = "",
+) -> tuple[IPv4Network | IPv6Network, int]:
+    """Returns the most specific prefix origin pair
+
+    Ties between equal length prefixes go to the last pair (the sort is
+    stable), and print a warning, since really we'd need both
+    """
+
+    if not prefix_origin_pairs:
+        raise Exception(f"No prefixes found for {ip_addr} {details}")
+
+    # Ensure that the second most isn't the same length...
+    pairs = sorted(prefix_origin_pairs, key=lambda x: x[0].prefixlen)
+
+    if len(pairs) > 1 and pairs[-1][0].prefixlen == pairs[-2][0].prefixlen:
+        msg = f"for {ip_addr}, need both: {details}"
+        print(msg)
+
+    # Get most specific prefix origin paid
+    return pairs[-1]
+
+
+class PrefixOriginResolver(ABC):
+    """Resolves the most specific prefix and origin for a TOR relay's IP"""
+
+    @abstractmethod
+    def get_prefix_origin_pair(
+        self, ip_addr: IPv4Network | IPv6Network
+    ) -> tuple[IPv4Network | IPv6Network, int]:
+        raise NotImplementedError
+
+
+class RIPEPrefixOriginResolver(PrefixOriginResolver):
+    """Resolves prefix origin pairs with RIPE's related-prefixes API
+
+    Requests that go over the network take a token from the token bucket
+    (if there is one), so that many threads can share the RIPE rate limit.
+    Cached responses skip the bucket entirely.
+
+    Failed requests back off exponentially (with jitter) per request,
+    rather than stalling every other lookup
+
+    If there is a prefix origin cache, any IP within an already resolved
+    prefix is answered from it, without a request at all
+    """
+
+    def __init__(
+        self,
+        session: CachedSession,
+        token_bucket: Optional[TokenBucket] = None,
+        prefix_origin_cache: Optional[PrefixOriginCache] = None,
+        url: str = RIPE_RELATED_PREFIXES_URL,
+        max_retries: int = 6,
+        backoff_base: float = 2,
+        debug: bool = False,
+    ) -> None:
+        self.session: CachedSession = session
+        self.token_bucket: Optional[TokenBucket] = token_bucket
+        self.prefix_origin_cache: Optional[PrefixOriginCache] = prefix_origin_cache
+        self.url: str = url
+        self.max_retries: int = max_retries
+        self.backoff_base: float = backoff_base
+        self.debug: bool = debug
+
+    def get_prefix_origin_pair(
+        self, ip_addr: IPv4Network | IPv6Network
+    ) -> tuple[IPv4Network | IPv6Network, int]:
+        """Returns ASNs and prefixesusing RIPE from a given IP addr"""
+
+        if self.prefix_origin_cache:
+            entry = self.prefix_origin_cache.get_entry(ip_addr)
+            if entry:
+                # So that ties between equal length prefixes still print a warning
+                cached_pairs: list[tuple[IPv4Network | IPv6Network, int]] = [
+                    (ip_network(prefix), origin) for prefix, origin in entry.related
+                ] or [(entry.prefix, entry.origin)]
+                return get_most_specific_pair(
+                    ip_addr, cached_pairs, pformat(cached_pairs, indent=4)
+                )
+
+        resp = self._get(ip_addr)
+        data = resp.json()
+        if self.debug:
+            pprint(data)
+            input()
+
+        prefix_origin_pairs = list()
+        for inner in data["data"]["prefixes"]:
+            # Sometimes API returns prefixes that don't overlap...
+            if ip_network(inner["prefix"]).overlaps(ip_addr):
+                prefix_origin_pairs.append(
+                    (ip_network(inner["prefix"]), int(inner["origin_asn"]))
+                )
+        resp.close()
+
+        if prefix_origin_pairs:
+            details = pformat(data, indent=4)
+        else:
+            details = str(resp.url)
+        prefix, origin = get_most_specific_pair(ip_addr, prefix_origin_pairs, details)
+        if self.prefix_origin_cache:
+            self.prefix_origin_cache.add(
+                ip_addr,
+                prefix,
+                origin,
+                related=tuple(
+                    sorted(prefix_origin_pairs, key=lambda x: x[0].prefixlen)
+                ),
+            )
+        return prefix, origin
+
+    def _get(self, ip_addr: IPv4Network | IPv6Network) -> requests.Response:
+        """Gets the RIPE response, rate limited and with retries"""
+
+        params = {"data_overload_limit": "ignore", "resource": str(ip_addr)}
+        for i in range(1, self.max_retries + 1):
+            try:
+                # Only wait on the rate limit if we actually need the network
+                resp = self.session.get(self.url, params=params, only_if_cached=True)
+                # requests_cache returns a 504 when the response isn't cached
+                if resp.status_code == 504:
+                    if self.token_bucket:
+                        self.token_bucket.acquire()
+                    resp = self.session.get(self.url, params=params)
+                resp.raise_for_status()
+                return resp
+            except (
+                requests.exceptions.HTTPError,
+                requests.exceptions.ConnectionError,
+            ) as e:
+                if i == self.max_retries:
+                    raise
+                else:
+                    time.sleep(self._get_backoff(e, i, self.backoff_base))
+        raise NotImplementedError("Should never reach here")
+
+    @staticmethod
+    def _get_backoff(
+        e: requests.exceptions.RequestException, attempt: int, backoff_base: float
+    ) -> float:
+        """Returns seconds to wait before retrying a RIPE request
+
+        Honors the Retry-After header when RIPE sends one, otherwise
+        exponential backoff with jitter so that threads don't retry in lockstep
+        """
+
+        # NOTE: must check against None, since error responses are falsey
+        if e.response is not None:
+            retry_after = e.response.headers.get("Retry-After", "")
+        else:
+            retry_after = ""
+        if retry_after.isdigit():
+            return float(retry_after)
+        else:
+            return backoff_base ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+
+class Pfx2ASPrefixOriginResolver(PrefixOriginResolver):
+    """Resolves prefix origin pairs offline, from a local prefix origin table
+
+    Accepts either a CAIDA pfx2as file (tab separated):
+        1.0.0.0    24    13335
+    or a RIB dump converted with bgpdump -m:
+        TABLE_DUMP2|1707264000|B|1.2.3.4|3333|1.0.0.0/24|3333 13335|IGP|...
+    optionally compressed with gzip, bz2, or xz.
+
+    MOAS entries (1_2 in pfx2as, or different origins across RIB peers) are
+    kept in file order. Since these are equal length prefixes, the tie breaking
+    is the same as for RIPE: the last one wins, with a warning.
+
+    Prefixes are stored per prefix length, as sorted arrays of network
+    addresses, with a parallel array indexing into the unique origin tuples.
+    That keeps a full table in tens of MB, and a lookup is a binary search
+    per prefix length, most specific first.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path: Path = path
+        # {version: [(prefixlen, networks, origin indexes)]}, most specific first
+        self._tables: dict[int, list[tuple[int, Any, "array[int]"]]] = {4: [], 6: []}
+        self._origins: list[tuple[int, ...]] = list()
+        self._load()
+
+    def get_prefix_origin_pair(
+        self, ip_addr: IPv4Network | IPv6Network
+    ) -> tuple[IPv4Network | IPv6Network, int]:
+        """Returns the most specific prefix origin pair from the table"""
+
+        ip_int = int(ip_addr.network_address)
+        max_len = ip_addr.max_prefixlen
+        prefix_origin_pairs: list[tuple[IPv4Network | IPv6Network, int]] = list()
+        for prefixlen, networks, origin_indexes in self._tables[ip_addr.version]:
+            if prefixlen > ip_addr.prefixlen:
+                continue
+            network = ip_int >> (max_len - prefixlen) << (max_len - prefixlen)
+            i = bisect_left(networks, network)
+            if i < len(networks) and networks[i] == network:
+                prefix = type(ip_addr)((network, prefixlen))
+                for origin in self._origins[origin_indexes[i]]:
+                    prefix_origin_pairs.append((prefix, origin))
+                break
+
+        return get_most_specific_pair(
+            ip_addr, prefix_origin_pairs, pformat(prefix_origin_pairs, indent=4)
+        )
+
+    def _load(self) -> None:
+        """Loads the prefix origin table into sorted arrays"""
+
+        print(f"Loading prefix origin table from {self.path}")
+        # {(version, prefixlen): {network: {origin: None}}}, dicts keep file order
+        raw: dict[tuple[int, int], dict[int, dict[int, None]]] = dict()
+        with self._open() as f:
+            for prefix, origins in self._parse_lines(f):
+                networks = raw.setdefault((prefix.version, prefix.prefixlen), dict())
+                prefix_origins = networks.setdefault(int(prefix.network_address), {})
+                for origin in origins:
+                    prefix_origins[origin] = None
+
+        origin_indexes: dict[tuple[int, ...], int] = dict()
+        for (version, prefixlen), networks in sorted(raw.items(), reverse=True):
+            sorted_networks = sorted(networks)
+            indexes: "array[int]" = array("I")
+            for network in sorted_networks:
+                origins = tuple(networks[network])
+                if origins not in origin_indexes:
+                    origin_indexes[origins] = len(self._origins)
+                    self._origins.append(origins)
+                indexes.append(origin_indexes[origins])
+            # IPv6 networks don't fit in a machine int
+            table = array("I", sorted_networks) if version == 4 else sorted_networks
+            self._tables[version].append((prefixlen, table, indexes))
+
+    def _open(self) -> IO[str]:
+        """Opens the (possibly compressed) table as text"""
+
+        if self.path.suffix == ".gz":
+            return gzip.open(self.path, "rt")
+        elif self.path.suffix == ".bz2":
+            return bz2.open(self.path, "rt")
+        elif self.path.suffix == ".xz":
+            return lzma.open(self.path, "rt")
+        else:
+            return self.path.open()
+
+    @staticmethod
+    def _parse_lines(
+        lines: IO[str],
+    ) -> Iterator[tuple[IPv4Network | IPv6Network, tuple[int, ...]]]:
+        """Yields prefixes and their origins from pfx2as or bgpdump -m lines"""
+
+        for line in lines:
+            if not line.strip() or line.startswith("#"):
+                continue
+            if "|" in line:
+                # bgpdump -m: the prefix is the 6th field, the AS path the 7th
+                fields = line.split("|")
+                prefix = ip_network(fields[5])
+                path = fields[6].split()
+                # Skip AS sets, since there's no single origin
+                if not path or "{" in path[-1]:
+                    continue
+                origins: tuple[int, ...] = (int(path[-1]),)
+            else:
+                network, prefixlen, asns = line.split()
+                prefix = ip_network(f"{network}/{prefixlen}")
+                # _ separates MOAS origins, and , separates AS set members.
+                # Skip AS sets, the same as above
+                origins = tuple(int(x) for x in asns.split("_") if "," not in x)
+                if not origins:
+                    continue
+            yield prefix, origins
@@ -0,0 +1,44 @@
+from dataclasses import dataclass
+from typing import Callable, Hashable, Iterable
+
+from .relay_snapshot import Relay
+
+
+@dataclass(frozen=True, slots=True)
+class RelayEquivalenceClass:
+    """Relays that a scenario can't tell apart (ex: same origin and validity)
+
+    Simulating any one of these relays gives the same result as the others,
+    so each class only needs to be simulated once, and then weighted by how
+    many relays (or how much bandwidth) it stands for
+    """
+
+    key: Hashable
+    relays: tuple[Relay, ...]
+
+    @property
+    def relay(self) -> Relay:
+        """Returns the relay to simulate for the class"""
+
+        return self.relays[0]
+
+    @property
+    def count(self) -> int:
+        return len(self.relays)
+
+    @property
+    def bandwidth_weight(self) -> int:
+        """Returns the total bandwidth weight of the relays in the class"""
+
+        return sum(x.bandwidth_weight for x in self.relays)
+
+
+def get_relay_equivalence_classes(
+    relays: Iterable[Relay], key: Callable[[Relay], Hashable]
+) -> tuple[RelayEquivalenceClass, ...]:
+    """Groups relays by key, in the order that each key first appears"""
+
+    relays_dict: dict[Hashable, list[Relay]] = dict()
+    for relay in relays:
+        relays_dict.setdefault(key(relay), list()).append(relay)
+    return tuple(RelayEquivalenceClass(k, tuple(v)) for k, v in relays_dict.items())
@@ -0,0 +1,262 @@
+from collections.abc import Mapping
+from datetime import date, timedelta
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
+import requests
+import requests_cache
+
+from .consensus_parser import ConsensusParser
+from .prefix_origin_cache import PrefixOriginCache
+from .prefix_origin_resolvers import PrefixOriginResolver, RIPEPrefixOriginResolver
+from .relay_snapshot import RelaySnapshot, SnapshotRelay
+from .roa_snapshot import ROASnapshotStore
+from .token_bucket import TokenBucket
+from .tor_relay_collector import TORRelayCollector
+
+
+class RelayHistory(Mapping[date, RelaySnapshot]):
+    """Relay snapshots indexed by date, from a RelayHistoryCollector
+
+    Snapshots are opened lazily, as they're accessed
+    """
+
+    def __init__(self, history_dir: Path) -> None:
+        self.history_dir: Path = history_dir
+        self.dates: tuple[date, ...] = tuple(
+            sorted(
+                date.fromisoformat(path.stem) for path in history_dir.glob("*.snapshot")
+            )
+        )
+        self._snapshots: dict[date, RelaySnapshot] = dict()
+
+    def __getitem__(self, dl_date: date) -> RelaySnapshot:
+        if dl_date not in self.dates:
+            raise KeyError(dl_date)
+        if dl_date not in self._snapshots:
+            self._snapshots[dl_date] = RelaySnapshot(
+                self.history_dir / f"{dl_date}.snapshot"
+            )
+        return self._snapshots[dl_date]
+
+    def __iter__(self) -> Iterator[date]:
+        return iter(self.dates)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def get_relay_history(
+        self, fingerprint: str
+    ) -> tuple[tuple[date, SnapshotRelay], ...]:
+        """Returns the relay with the fingerprint for every date it was in"""
+
+        rv = list()
+        for dl_date, snapshot in self.items():
+            for relay in snapshot:
+                if relay.fingerprint == fingerprint:
+                    rv.append((dl_date, relay))
+                    break
+        return tuple(rv)
+
+
+class RelayHistoryCollector:
+    """Collects a relay snapshot for every date in a date range
+
+    Consensuses are walked in order, and relays with the same fingerprint,
+    IPs, and flags as the previous consensus reuse its resolved prefixes and
+    origins (and ROA validity, unless the ROAs changed). Only new or changed
+    relays are resolved, which is a small fraction of the relays from one
+    consensus to the next.
+
+    Snapshots that already exist in the history dir are reused, so an
+    interrupted collection picks up where it left off. Consensuses that
+    aren't in the consensus_dir are read from CollecTor's monthly archives,
+    which are downloaded into it
+    """
+
+    ARCHIVE_URL: str = (
+        "https://collector.torproject.org/archive/relay-descriptors/consensuses/"
+    )
+
+    def __init__(
+        self,
+        start_date: date,
+        end_date: date,
+        history_dir: Optional[Path] = None,
+        consensus_dir: Optional[Path] = None,
+        requests_cache_db_path: Optional[Path] = None,
+        max_workers: int = 8,
+        requests_per_second: float = 8,
+        prefix_origin_cache_path: Optional[Path] = None,
+        resolver: Optional[PrefixOriginResolver] = None,
+        roa_snapshot_store: Optional[ROASnapshotStore] = None,
+    ) -> None:
+        assert start_date <= end_date, "Start date must not be after end date"
+        self.start_date: date = start_date
+        self.end_date: date = end_date
+        if history_dir is None:
+            history_dir = Path.home() / "tor_bgp_sims_relay_history"
+        self.history_dir: Path = history_dir
+        self.history_dir.mkdir(parents=True, exist_ok=True)
+        # Consensus files (optionally .xz), or CollecTor monthly .tar.xz
+        # archives. Archives for dates with neither are downloaded here
+        if consensus_dir is None:
+            consensus_dir = self.history_dir / "consensuses"
+        self.consensus_dir: Path = consensus_dir
+        # Past consensuses don't change, so these can be cached indefinitely
+        if requests_cache_db_path is None:
+            requests_cache_db_path = (
+                Path.home() / f"tor_bgp_sims_{start_date}_{end_date}.db"
+            )
+        self.requests_cache_db_path: Path = requests_cache_db_path
+        self.max_workers: int = max_workers
+        self.session = requests_cache.CachedSession(str(self.requests_cache_db_path))
+        self.prefix_origin_cache: Optional[PrefixOriginCache] = None
+        # Shared across all dates, rather than one per TORRelayCollector
+        if resolver is None:
+            if prefix_origin_cache_path is None:
+                prefix_origin_cache_path = (
+                    Path.home() / "tor_bgp_sims_prefix_origins.db"
+                )
+            self.prefix_origin_cache = PrefixOriginCache(prefix_origin_cache_path)
+            resolver = RIPEPrefixOriginResolver(
+                self.session,
+                token_bucket=TokenBucket(requests_per_second),
+                prefix_origin_cache=self.prefix_origin_cache,
+            )
+        self.resolver: PrefixOriginResolver = resolver
+        # So that the ROAs match each consensus date
+        self.roa_snapshot_store: Optional[ROASnapshotStore] = roa_snapshot_store
+
+    def __del__(self):
+        self.session.close()
+        if self.prefix_origin_cache:
+            self.prefix_origin_cache.close()
+
+    def run(self) -> RelayHistory:
+        """Collects a snapshot per date, resolving only new or changed relays"""
+
+        prev_snapshot: Optional[RelaySnapshot] = None
+        for dl_date, consensus in self._get_consensuses():
+            print(f"Collecting relays for {dl_date}")
+            prev_snapshot = TORRelayCollector(
+                requests_cache_db_path=self.requests_cache_db_path,
+                dl_date=dl_date,
+                max_workers=self.max_workers,
+                resolver=self.resolver,
+                consensus=consensus,
+                prev_snapshot=prev_snapshot,
+                snapshot_path=self._get_snapshot_path(dl_date),
+                roa_snapshot_store=self.roa_snapshot_store,
+            ).run()
+        return RelayHistory(self.history_dir)
+
+    def _get_consensuses(
+        self,
+    ) -> Iterator[tuple[date, Optional[ConsensusParser]]]:
+        """Yields the consensus for each date (None if its snapshot exists)
+
+        Monthly archives are only read through once, for all of their dates,
+        and only downloaded if a date without a local consensus needs them.
+        Each consensus must be consumed before moving on to the next
+        """
+
+        dl_date = self.start_date
+        while dl_date <= self.end_date:
+            archive_path = self._get_archive_path(dl_date)
+            if not archive_path:
+                consensus = self._get_consensus(dl_date)
+                if consensus or self._has_snapshot(dl_date):
+                    yield dl_date, consensus
+                    dl_date += timedelta(days=1)
+                    continue
+                archive_path = self._download_archive(dl_date)
+            # All the dates in this archive
+            archive_dates: dict[str, date] = dict()
+            while (
+                dl_date <= self.end_date
+                and self._get_archive_path(dl_date) == archive_path
+            ):
+                archive_dates[self._get_consensus_name(dl_date)] = dl_date
+                dl_date += timedelta(days=1)
+            for consensus in ConsensusParser.iter_archive(archive_path):
+                if consensus.name in archive_dates:
+                    yield archive_dates.pop(consensus.name), consensus
+            # Rather than downloading another day's consensus in their place
+            missing_names = [
+                name
+                for name, missing_date in archive_dates.items()
+                if not self._has_snapshot(missing_date)
+            ]
+            if missing_names:
+                raise ValueError(f"{archive_path} doesn't have {missing_names}")
+            for missing_date in archive_dates.values():
+                yield missing_date, None
+
+    def _get_consensus(self, dl_date: date) -> Optional[ConsensusParser]:
+        """Returns the local consensus for the date, if there is one"""
+
+        for suffix in ("", ".xz"):
+            path = self.consensus_dir / (self._get_consensus_name(dl_date) + suffix)
+            if path.exists():
+                return ConsensusParser.from_path(path)
+        return None
+
+    def _get_archive_path(self, dl_date: date) -> Optional[Path]:
+        """Returns the CollecTor monthly archive with the date, if there is one"""
+
+        path = self.consensus_dir / self._get_archive_name(dl_date)
+        return path if path.exists() else None
+
+    def _download_archive(self, dl_date: date) -> Path:
+        """Downloads the CollecTor monthly archive with the date
+
+        The current month's isn't archived yet, so its consensuses must be
+        put in the consensus_dir instead
+        """
+
+        url = self.ARCHIVE_URL + self._get_archive_name(dl_date)
+        print(f"Downloading {url}")
+        # Not through the requests cache, since these are hundreds of MB
+        with requests.get(url, stream=True, timeout=60) as resp:
+            try:
+                resp.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                raise ValueError(
+                    f"Couldn't download the consensuses for {dl_date} ({e}). "
+                    f"Put them in {self.consensus_dir} instead"
+                ) from e
+            self.consensus_dir.mkdir(parents=True, exist_ok=True)
+            path = self.consensus_dir / self._get_archive_name(dl_date)
+            # Written in full before it's moved, so a crash never leaves half of one
+            tmp_path = path.with_name(path.name + ".tmp")
+            with tmp_path.open("wb") as f:
+                for chunk in resp.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+        return path
+
+    def _get_snapshot_path(self, dl_date: date) -> Path:
+        return self.history_dir / f"{dl_date}.snapshot"
+
+    def _has_snapshot(self, dl_date: date) -> bool:
+        """Returns whether the date's snapshot exists, so it needs no consensus"""
+
+        try:
+            RelaySnapshot(self._get_snapshot_path(dl_date))
+        except (OSError, ValueError):
+            return False
+        return True
+
+    @staticmethod
+    def _get_archive_name(dl_date: date) -> str:
+        """Returns the file name of CollecTor's monthly archive with the date"""
+
+        return f"consensuses-{dl_date:%Y-%m}.tar.xz"
+
+    @staticmethod
+    def _get_consensus_name(dl_date: date) -> str:
+        """Returns the file name of the consensus for the date"""
+
+        return f"{dl_date.strftime('%Y-%m-%d-01-00-00')}-consensus"
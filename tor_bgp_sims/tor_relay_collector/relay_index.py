@@ -0,0 +1,183 @@
+from enum import IntFlag
+from typing import Optional, Sequence
+
+from roa_checker import ROAValidity
+
+from .relay_snapshot import Relay, RelaySnapshot
+
+
+class RelayClass(IntFlag):
+    """Bits that a relay is classified into (role, ROA validity, prefix length)
+
+    Prefix lengths are relative to the shortest prefix that's still
+    propagated (/24 for IPv4 and /48 for IPv6)
+    """
+
+    GUARD = 1 << 0
+    EXIT = 1 << 1
+
+    IPV4_VALID = 1 << 2
+    IPV4_UNKNOWN = 1 << 3
+    IPV4_INVALID = 1 << 4
+    IPV4_LEN_24 = 1 << 5
+    IPV4_LEN_LT_24 = 1 << 6
+    IPV4_LEN_GT_24 = 1 << 7
+
+    IPV6 = 1 << 8
+    IPV6_VALID = 1 << 9
+    IPV6_UNKNOWN = 1 << 10
+    IPV6_INVALID = 1 << 11
+    IPV6_LEN_48 = 1 << 12
+    IPV6_LEN_LT_48 = 1 << 13
+    IPV6_LEN_GT_48 = 1 << 14
+
+
+class RelayIndex:
+    """Classifies every relay once, for fast lookups of relay groups
+
+    Each relay gets a RelayClass bitmask, and relays with the same bitmask
+    are grouped together. A lookup (ex: guards with IPv6 and a /48 with no
+    ROA) only checks the handful of distinct bitmasks rather than every
+    relay, and is cached, so the same lookup always returns the same tuple
+    """
+
+    def __init__(self, relays: Sequence[Relay]) -> None:
+        self.relays: Sequence[Relay] = relays
+        if isinstance(relays, RelaySnapshot):
+            relay_classes = self._get_snapshot_relay_classes(relays)
+        else:
+            relay_classes = [self.get_relay_class(x) for x in relays]
+        # Indexes of the relays for each distinct bitmask, in order
+        indexes: dict[RelayClass, list[int]] = dict()
+        for i, relay_class in enumerate(relay_classes):
+            indexes.setdefault(relay_class, list()).append(i)
+        self._indexes: dict[RelayClass, tuple[int, ...]] = {
+            k: tuple(v) for k, v in indexes.items()
+        }
+        self._lookups: dict[tuple[RelayClass, RelayClass], tuple[Relay, ...]] = dict()
+
+    def __len__(self) -> int:
+        return len(self.relays)
+
+    def get_relays(
+        self,
+        required: RelayClass,
+        excluded: RelayClass = RelayClass(0),
+    ) -> tuple[Relay, ...]:
+        """Returns relays with all of the required bits and none excluded
+
+        ex: get_relays(RelayClass.GUARD | RelayClass.IPV4_LEN_24,
+                       excluded=RelayClass.IPV4_VALID)
+        returns the guards with a /24 that aren't valid by ROA
+
+        Relays are in the same order as they were passed in
+        """
+
+        key = (required, excluded)
+        if key not in self._lookups:
+            indexes = sorted(
+                i
+                for relay_class, class_indexes in self._indexes.items()
+                if relay_class & required == required and not relay_class & excluded
+                for i in class_indexes
+            )
+            self._lookups[key] = tuple(self.relays[i] for i in indexes)
+        return self._lookups[key]
+
+    def count(self, required: RelayClass, excluded: RelayClass = RelayClass(0)) -> int:
+        """Returns the number of relays that get_relays would return"""
+
+        return sum(
+            len(class_indexes)
+            for relay_class, class_indexes in self._indexes.items()
+            if relay_class & required == required and not relay_class & excluded
+        )
+
+    @classmethod
+    def get_relay_class(cls, relay: Relay) -> RelayClass:
+        """Returns the bitmask for a relay"""
+
+        flags = set(relay.s)
+        ipv6_prefixlen = relay.ipv6_prefix.prefixlen if relay.ipv6_prefix else None
+        return cls._get_relay_class(
+            "Guard" in flags,
+            "Exit" in flags and "BadExit" not in flags,
+            relay.ipv4_roa_validity,
+            relay.ipv4_prefix.prefixlen,
+            relay.ipv6_roa_validity,
+            ipv6_prefixlen,
+        )
+
+    @classmethod
+    def _get_snapshot_relay_classes(cls, snapshot: RelaySnapshot) -> list[RelayClass]:
+        """Returns the bitmask for each relay, straight from the columns"""
+
+        def get_flag_bit(flag: str) -> int:
+            return 1 << snapshot.flags.index(flag) if flag in snapshot.flags else 0
+
+        guard_bit = get_flag_bit("Guard")
+        exit_bit = get_flag_bit("Exit")
+        bad_exit_bit = get_flag_bit("BadExit")
+        relay_classes: list[RelayClass] = list()
+        for flags, ipv4_validity, ipv4_prefixlen, ipv6_validity, ipv6_prefixlen in zip(
+            snapshot.get_column("flags"),
+            snapshot.get_column("ipv4_roa_validity"),
+            snapshot.get_column("ipv4_prefixlen"),
+            snapshot.get_column("ipv6_roa_validity"),
+            snapshot.get_column("ipv6_prefixlen"),
+        ):
+            relay_classes.append(
+                cls._get_relay_class(
+                    bool(flags & guard_bit),
+                    bool(flags & exit_bit) and not flags & bad_exit_bit,
+                    ROAValidity(ipv4_validity),
+                    ipv4_prefixlen,
+                    ROAValidity(ipv6_validity),
+                    None if ipv6_prefixlen == RelaySnapshot.NO_IPV6 else ipv6_prefixlen,
+                )
+            )
+        return relay_classes
+
+    @staticmethod
+    def _get_relay_class(
+        guard: bool,
+        exit: bool,
+        ipv4_validity: ROAValidity,
+        ipv4_prefixlen: int,
+        ipv6_validity: ROAValidity,
+        ipv6_prefixlen: Optional[int],
+    ) -> RelayClass:
+        relay_class = RelayClass(0)
+        if guard:
+            relay_class |= RelayClass.GUARD
+        if exit:
+            relay_class |= RelayClass.EXIT
+
+        if ROAValidity.is_valid(ipv4_validity):
+            relay_class |= RelayClass.IPV4_VALID
+        elif ROAValidity.is_unknown(ipv4_validity):
+            relay_class |= RelayClass.IPV4_UNKNOWN
+        else:
+            relay_class |= RelayClass.IPV4_INVALID
+        if ipv4_prefixlen == 24:
+            relay_class |= RelayClass.IPV4_LEN_24
+        elif ipv4_prefixlen < 24:
+            relay_class |= RelayClass.IPV4_LEN_LT_24
+        else:
+            relay_class |= RelayClass.IPV4_LEN_GT_24
+
+        if ipv6_prefixlen is not None:
+            relay_class |= RelayClass.IPV6
+            if ROAValidity.is_valid(ipv6_validity):
+                relay_class |= RelayClass.IPV6_VALID
+            elif ROAValidity.is_unknown(ipv6_validity):
+                relay_class |= RelayClass.IPV6_UNKNOWN
+            else:
+                relay_class |= RelayClass.IPV6_INVALID
+            if ipv6_prefixlen == 48:
+                relay_class |= RelayClass.IPV6_LEN_48
+            elif ipv6_prefixlen < 48:
+                relay_class |= RelayClass.IPV6_LEN_LT_48
+            else:
+                relay_class |= RelayClass.IPV6_LEN_GT_48
+        return relay_class
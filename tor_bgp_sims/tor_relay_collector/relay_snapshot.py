@@ -0,0 +1,390 @@
+from array import array
+from collections.abc import Sequence
+from datetime import date
+from ipaddress import IPv4Network, IPv6Network
+import json
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+from typing import Any, Iterable, Mapping, Optional, overload, Union
+
+from frozendict import frozendict
+
+from roa_checker import ROAValidity, ROARouted
+
+from .tor_relay import TORRelay
+
+
+class RelaySnapshot(Sequence["SnapshotRelay"]):
+    """Memory mapped, columnar snapshot of the relays in a consensus
+
+    Unlike a pickle of TORRelays, this doesn't depend on the TORRelay class,
+    only on FORMAT_VERSION, and since the file is memory mapped, forked
+    simulation workers share the same pages rather than each unpickling a copy.
+
+    Layout:
+        header: magic, format version, metadata length
+        metadata: JSON with the number of relays, column offsets, date,
+                  bandwidth weights, and the flag/version string tables
+        columns: fixed width arrays, one value per relay, 8 byte aligned
+
+    Indexing returns SnapshotRelay views, which have the same API as TORRelay
+    """
+
+    MAGIC: bytes = b"TORRELAYSNAP"
+    # Bump this whenever the columns change
+    FORMAT_VERSION: int = 1
+    HEADER: struct.Struct = struct.Struct("<12sII")
+    # (name, array typecode or width in bytes)
+    COLUMNS: tuple[tuple[str, Union[str, int]], ...] = (
+        ("identity", 20),
+        ("ipv4_addr", "I"),
+        ("ipv4_prefixlen", "B"),
+        ("ipv4_origin", "I"),
+        ("ipv4_roa_validity", "B"),
+        ("ipv4_roa_routed", "B"),
+        ("ipv6_addr", 16),
+        ("ipv6_prefixlen", "B"),
+        ("ipv6_origin", "I"),
+        ("ipv6_roa_validity", "B"),
+        ("ipv6_roa_routed", "B"),
+        ("flags", "I"),
+        ("bandwidth", "I"),
+        ("version", "H"),
+    )
+    # ipv6_prefixlen for relays without an IPv6 address
+    NO_IPV6: int = 0xFF
+
+    def __init__(self, path: Path) -> None:
+        self.path: Path = path
+        with path.open("rb") as f:
+            self._mmap: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, metadata_len = self.HEADER.unpack_from(self._mmap)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a relay snapshot")
+        if format_version != self.FORMAT_VERSION:
+            raise ValueError(
+                f"{path} is relay snapshot format {format_version}, "
+                f"but {self.FORMAT_VERSION} is required"
+            )
+        start = self.HEADER.size
+        metadata = json.loads(self._mmap[start : start + metadata_len])
+        if metadata["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was written with a different byte order")
+
+        self.num_relays: int = metadata["num_relays"]
+        self.dl_date: date = date.fromisoformat(metadata["dl_date"])
+        # Date of the ROAs the relays were validated against (None for current)
+        self.roa_date: Optional[date] = (
+            date.fromisoformat(metadata["roa_date"])
+            if metadata.get("roa_date")
+            else None
+        )
+        self.bandwidth_weights: frozendict[str, int] = frozendict(
+            metadata["bandwidth_weights"]
+        )
+        self.flags: tuple[str, ...] = tuple(metadata["flags"])
+        self.versions: tuple[str, ...] = tuple(metadata["versions"])
+        self.metadata: dict[str, Any] = metadata
+
+        view = memoryview(self._mmap)
+        self._byte_widths: dict[str, int] = dict()
+        self._columns: dict[str, memoryview] = dict()
+        for name, fmt in self.COLUMNS:
+            offset = metadata["columns"][name]
+            size = self._get_size(fmt) * self.num_relays
+            column = view[offset : offset + size]
+            if isinstance(fmt, str):
+                self._columns[name] = column.cast(fmt)
+            else:
+                self._columns[name] = column
+                self._byte_widths[name] = fmt
+
+    def __len__(self) -> int:
+        return self.num_relays
+
+    @overload
+    def __getitem__(self, index: int) -> "SnapshotRelay": ...
+
+    @overload
+    def __getitem__(self, index: slice) -> tuple["SnapshotRelay", ...]: ...
+
+    def __getitem__(
+        self, index: int | slice
+    ) -> Union["SnapshotRelay", tuple["SnapshotRelay", ...]]:
+        if isinstance(index, slice):
+            return tuple(
+                SnapshotRelay(self, i) for i in range(*index.indices(len(self)))
+            )
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return SnapshotRelay(self, index)
+
+    def get(self, column: str, index: int) -> Any:
+        """Returns the value of a column for the relay at index"""
+
+        values = self._columns[column]
+        width = self._byte_widths.get(column)
+        if width:
+            return bytes(values[index * width : (index + 1) * width])
+        return values[index]
+
+    def get_column(self, column: str) -> memoryview:
+        """Returns every value of a column (raw bytes for fixed width columns)"""
+
+        return self._columns[column]
+
+    @classmethod
+    def write(
+        cls,
+        path: Path,
+        relays: Iterable[Union[TORRelay, "SnapshotRelay"]],
+        dl_date: date,
+        bandwidth_weights: Optional[Mapping[str, int]] = None,
+        roa_date: Optional[date] = None,
+    ) -> None:
+        """Writes the relays to a snapshot (atomically)"""
+
+        relays = tuple(relays)
+        flags = sorted(set(flag for relay in relays for flag in relay.s))
+        assert len(flags) <= 32, "Flags no longer fit in the bitmask"
+        flag_bits = {flag: 1 << i for i, flag in enumerate(flags)}
+        versions = sorted(set(relay.version for relay in relays))
+        version_indexes = {version: i for i, version in enumerate(versions)}
+
+        columns: dict[str, Any] = {
+            name: bytearray() if isinstance(fmt, int) else array(fmt)
+            for name, fmt in cls.COLUMNS
+        }
+        for relay in relays:
+            columns["identity"] += relay.identity
+            columns["ipv4_addr"].append(int(relay.ipv4_addr.network_address))
+            columns["ipv4_prefixlen"].append(relay.ipv4_prefix.prefixlen)
+            columns["ipv4_origin"].append(relay.ipv4_origin)
+            columns["ipv4_roa_validity"].append(relay.ipv4_roa_validity.value)
+            columns["ipv4_roa_routed"].append(relay.ipv4_roa_routed.value)
+            if relay.ipv6_addr and relay.ipv6_prefix:
+                ipv6_addr = int(relay.ipv6_addr.network_address)
+                columns["ipv6_addr"] += ipv6_addr.to_bytes(16, "big")
+                columns["ipv6_prefixlen"].append(relay.ipv6_prefix.prefixlen)
+                columns["ipv6_origin"].append(relay.ipv6_origin)
+            else:
+                columns["ipv6_addr"] += bytes(16)
+                columns["ipv6_prefixlen"].append(cls.NO_IPV6)
+                columns["ipv6_origin"].append(0)
+            columns["ipv6_roa_validity"].append(relay.ipv6_roa_validity.value)
+            columns["ipv6_roa_routed"].append(relay.ipv6_roa_routed.value)
+            columns["flags"].append(sum(flag_bits[flag] for flag in set(relay.s)))
+            columns["bandwidth"].append(relay.bandwidth_weight)
+            columns["version"].append(version_indexes[relay.version])
+
+        metadata: dict[str, Any] = {
+            "num_relays": len(relays),
+            "byteorder": sys.byteorder,
+            "dl_date": str(dl_date),
+            "roa_date": str(roa_date) if roa_date else None,
+            "bandwidth_weights": dict(bandwidth_weights or {}),
+            "flags": flags,
+            "versions": versions,
+            "columns": {},
+        }
+        # The offsets change the metadata length, so give them room to grow
+        metadata_len = len(json.dumps(metadata)) + 64 * len(cls.COLUMNS)
+        offset = cls._align(cls.HEADER.size + metadata_len)
+        for name, fmt in cls.COLUMNS:
+            metadata["columns"][name] = offset
+            offset = cls._align(offset + cls._get_size(fmt) * len(relays))
+        metadata_bytes = json.dumps(metadata).encode().ljust(metadata_len)
+        assert len(metadata_bytes) == metadata_len, "Metadata overflowed"
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.FORMAT_VERSION, metadata_len))
+            f.write(metadata_bytes)
+            for name, _ in cls.COLUMNS:
+                f.write(bytes(metadata["columns"][name] - f.tell()))
+                f.write(bytes(columns[name]))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _get_size(fmt: Union[str, int]) -> int:
+        """Returns the number of bytes per value in a column"""
+
+        return fmt if isinstance(fmt, int) else array(fmt).itemsize
+
+    @staticmethod
+    def _align(offset: int) -> int:
+        return (offset + 7) // 8 * 8
+
+
+# Snapshots opened by unpickled relays, so that they share the same mmap
+_loaded_snapshots: dict[str, RelaySnapshot] = dict()
+
+
+def _load_snapshot_relay(path: str, index: int) -> "SnapshotRelay":
+    if path not in _loaded_snapshots:
+        _loaded_snapshots[path] = RelaySnapshot(Path(path))
+    return _loaded_snapshots[path][index]
+
+
+class SnapshotRelay:
+    """View of a single relay in a RelaySnapshot, with the TORRelay API
+
+    Pickles as a reference into the snapshot, rather than a copy of the data
+    """
+
+    __slots__ = ("_snapshot", "_index")
+
+    def __init__(self, snapshot: RelaySnapshot, index: int) -> None:
+        self._snapshot: RelaySnapshot = snapshot
+        self._index: int = index
+
+    def __reduce__(self) -> tuple[Any, tuple[str, int]]:
+        return _load_snapshot_relay, (str(self._snapshot.path), self._index)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, SnapshotRelay):
+            return (self._snapshot.path, self._index) == (
+                other._snapshot.path,
+                other._index,
+            )
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((self._snapshot.path, self._index))
+
+    def __repr__(self) -> str:
+        return f"SnapshotRelay({self.fingerprint}, {self.ipv4_addr})"
+
+    @property
+    def identity(self) -> bytes:
+        """Returns the relay's identity digest"""
+
+        rv = self._snapshot.get("identity", self._index)
+        assert isinstance(rv, bytes), "for mypy"
+        return rv
+
+    @property
+    def fingerprint(self) -> str:
+        """Returns the relay's fingerprint (hex of the identity digest)"""
+
+        return self.identity.hex().upper()
+
+    @property
+    def ipv4_addr(self) -> IPv4Network:
+        return IPv4Network(self._snapshot.get("ipv4_addr", self._index))
+
+    @property
+    def ipv4_prefix(self) -> IPv4Network:
+        return IPv4Network(
+            (
+                self._snapshot.get("ipv4_addr", self._index),
+                self._snapshot.get("ipv4_prefixlen", self._index),
+            ),
+            strict=False,
+        )
+
+    @property
+    def ipv4_origin(self) -> int:
+        rv = self._snapshot.get("ipv4_origin", self._index)
+        assert isinstance(rv, int), "for mypy"
+        return rv
+
+    @property
+    def ipv4_roa_validity(self) -> ROAValidity:
+        return ROAValidity(self._snapshot.get("ipv4_roa_validity", self._index))
+
+    @property
+    def ipv4_roa_routed(self) -> ROARouted:
+        return ROARouted(self._snapshot.get("ipv4_roa_routed", self._index))
+
+    @property
+    def ipv6_addr(self) -> Optional[IPv6Network]:
+        if self._ipv6_prefixlen == RelaySnapshot.NO_IPV6:
+            return None
+        return IPv6Network(self._ipv6_int)
+
+    @property
+    def ipv6_prefix(self) -> Optional[IPv6Network]:
+        if self._ipv6_prefixlen == RelaySnapshot.NO_IPV6:
+            return None
+        return IPv6Network((self._ipv6_int, self._ipv6_prefixlen), strict=False)
+
+    @property
+    def ipv6_origin(self) -> Optional[int]:
+        if self._ipv6_prefixlen == RelaySnapshot.NO_IPV6:
+            return None
+        rv = self._snapshot.get("ipv6_origin", self._index)
+        assert isinstance(rv, int), "for mypy"
+        return rv
+
+    @property
+    def ipv6_roa_validity(self) -> ROAValidity:
+        return ROAValidity(self._snapshot.get("ipv6_roa_validity", self._index))
+
+    @property
+    def ipv6_roa_routed(self) -> ROARouted:
+        return ROARouted(self._snapshot.get("ipv6_roa_routed", self._index))
+
+    @property
+    def s(self) -> tuple[str, ...]:
+        """Returns the relay's flags"""
+
+        flags = self._snapshot.get("flags", self._index)
+        return tuple(
+            flag for i, flag in enumerate(self._snapshot.flags) if flags & (1 << i)
+        )
+
+    @property
+    def guard(self) -> bool:
+        return self.guard_relay
+
+    @property
+    def guard_relay(self) -> bool:
+        """Returns True if eligible to be a guard node"""
+
+        return "Guard" in self.s
+
+    @property
+    def exit(self) -> bool:
+        return self.exit_relay
+
+    @property
+    def exit_relay(self) -> bool:
+        """Returns True if eligible to be an exit node"""
+
+        return "Exit" in self.s and "BadExit" not in self.s
+
+    @property
+    def version(self) -> str:
+        """Returns the Relay version"""
+
+        version_index: int = self._snapshot.get("version", self._index)
+        return self._snapshot.versions[version_index]
+
+    @property
+    def bandwidth_weight(self) -> int:
+        """Returns the weight for the bandwidth used"""
+
+        rv = self._snapshot.get("bandwidth", self._index)
+        assert isinstance(rv, int), "for mypy"
+        return rv
+
+    @property
+    def _ipv6_int(self) -> int:
+        return int.from_bytes(self._snapshot.get("ipv6_addr", self._index), "big")
+
+    @property
+    def _ipv6_prefixlen(self) -> int:
+        rv = self._snapshot.get("ipv6_prefixlen", self._index)
+        assert isinstance(rv, int), "for mypy"
+        return rv
+
+
+# Anything with the TORRelay API
+Relay = Union[TORRelay, SnapshotRelay]
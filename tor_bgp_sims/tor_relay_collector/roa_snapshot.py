@@ -0,0 +1,155 @@
+import bz2
+import csv
+from datetime import date
+import gzip
+import hashlib
+from ipaddress import ip_network
+import json
+import lzma
+import os
+from pathlib import Path
+import pickle
+import re
+from typing import Any, IO, Iterator, Optional
+
+from roa_checker import ROAChecker
+
+
+class ROASnapshotStore:
+    """Date versioned ROAChecker snapshots, from historical VRP exports
+
+    VRP exports live in vrp_dir (searched recursively) as CSV or JSON,
+    optionally compressed with gzip, bz2, or xz. The date is taken from the
+    path, so both of these work:
+        vrp_dir/2024-02-07.csv
+        vrp_dir/ripencc.tal/2024/02/07/output.json.xz
+    Every file for the same date is merged into the same snapshot (ex: one
+    per trust anchor).
+
+    The snapshot for a date is the latest export on or before that date, so
+    that the ROAs match the consensus date. Each ROAChecker is built once and
+    pickled, so later runs just load it, rather than rebuilding the tries.
+    """
+
+    vrp_suffixes: frozenset[str] = frozenset([".csv", ".json"])
+    date_re: re.Pattern[str] = re.compile(r"(\d{4})[-/_]?(\d{2})[-/_]?(\d{2})")
+
+    def __init__(self, vrp_dir: Path, cache_dir: Optional[Path] = None) -> None:
+        self.vrp_dir: Path = vrp_dir
+        if cache_dir is None:
+            cache_dir = Path.home() / "tor_bgp_sims_roa_snapshots"
+        self.cache_dir: Path = cache_dir
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.vrp_paths: dict[date, tuple[Path, ...]] = self._get_vrp_paths()
+        self._roa_checkers: dict[date, ROAChecker] = dict()
+
+    def get_vrp_date(self, dl_date: date) -> date:
+        """Returns the date of the latest VRP export on or before dl_date"""
+
+        vrp_dates = [x for x in self.vrp_paths if x <= dl_date]
+        if not vrp_dates:
+            raise ValueError(f"No VRP exports on or before {dl_date} in {self.vrp_dir}")
+        return max(vrp_dates)
+
+    def get_roa_checker(self, dl_date: date) -> ROAChecker:
+        """Returns the ROAChecker for the ROAs as of dl_date"""
+
+        vrp_date = self.get_vrp_date(dl_date)
+        if vrp_date not in self._roa_checkers:
+            pickle_path = self._get_pickle_path(vrp_date)
+            if pickle_path.exists():
+                with pickle_path.open("rb") as f:
+                    roa_checker = pickle.load(f)
+            else:
+                roa_checker = self._build_roa_checker(vrp_date)
+                tmp_path = pickle_path.with_name(pickle_path.name + ".tmp")
+                with tmp_path.open("wb") as f:
+                    pickle.dump(roa_checker, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, pickle_path)
+            self._roa_checkers[vrp_date] = roa_checker
+        return self._roa_checkers[vrp_date]
+
+    def _build_roa_checker(self, vrp_date: date) -> ROAChecker:
+        """Inserts every ROA from the exports for the date into a ROAChecker"""
+
+        print(f"Building ROAChecker for {vrp_date}")
+        roa_checker = ROAChecker()
+        for path in self.vrp_paths[vrp_date]:
+            for prefix, origin, max_length in self._parse_vrps(path):
+                roa_checker.insert(ip_network(prefix), origin, max_length)
+        return roa_checker
+
+    def _get_pickle_path(self, vrp_date: date) -> Path:
+        """Returns the pickle path, which changes if any of the exports change"""
+
+        fingerprint = hashlib.sha256()
+        for path in self.vrp_paths[vrp_date]:
+            stat = path.stat()
+            fingerprint.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return self.cache_dir / f"{vrp_date}_{fingerprint.hexdigest()[:16]}.pickle"
+
+    def _get_vrp_paths(self) -> dict[date, tuple[Path, ...]]:
+        """Returns the VRP exports for each date"""
+
+        vrp_paths: dict[date, list[Path]] = dict()
+        for path in sorted(self.vrp_dir.rglob("*")):
+            if not path.is_file() or not self._get_vrp_suffix(path):
+                continue
+            match = self.date_re.search(str(path.relative_to(self.vrp_dir)))
+            if match:
+                vrp_date = date(*(int(x) for x in match.groups()))
+                vrp_paths.setdefault(vrp_date, list()).append(path)
+        return {k: tuple(v) for k, v in vrp_paths.items()}
+
+    @classmethod
+    def _get_vrp_suffix(cls, path: Path) -> Optional[str]:
+        """Returns .csv or .json, ignoring any compression suffix"""
+
+        suffixes = [x for x in path.suffixes if x not in (".gz", ".bz2", ".xz")]
+        if suffixes and suffixes[-1] in cls.vrp_suffixes:
+            return suffixes[-1]
+        return None
+
+    @classmethod
+    def _parse_vrps(cls, path: Path) -> Iterator[tuple[str, int, int]]:
+        """Yields prefix, origin, max length from a VRP export
+
+        CSV headers vary by validator (ex: ASN,IP Prefix,Max Length,...) and
+        JSON ASNs are either ints or strings like AS13335
+        """
+
+        with cls._open(path) as f:
+            if cls._get_vrp_suffix(path) == ".json":
+                for roa in json.load(f)["roas"]:
+                    yield (
+                        roa["prefix"],
+                        cls._parse_asn(roa["asn"]),
+                        int(roa["maxLength"]),
+                    )
+            else:
+                reader = csv.DictReader(f)
+                assert reader.fieldnames, f"{path} has no header"
+                keys = {re.sub(r"[^a-z]", "", x.lower()): x for x in reader.fieldnames}
+                for row in reader:
+                    yield (
+                        row[keys["ipprefix"]],
+                        cls._parse_asn(row[keys["asn"]]),
+                        int(row[keys["maxlength"]]),
+                    )
+
+    @staticmethod
+    def _parse_asn(asn: Any) -> int:
+        return int(re.findall(r"\d+", str(asn))[0])
+
+    @staticmethod
+    def _open(path: Path) -> IO[str]:
+        """Opens the (possibly compressed) export as text"""
+
+        if path.suffix == ".gz":
+            return gzip.open(path, "rt")
+        elif path.suffix == ".bz2":
+            return bz2.open(path, "rt")
+        elif path.suffix == ".xz":
+            return lzma.open(path, "rt")
+        else:
+            return path.open()
@@ -0,0 +1,44 @@
+from threading import Lock
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Thread safe token bucket used to rate limit requests to RIPE
+
+    Tokens refill continuously at rate tokens per second, up to capacity.
+    Every request takes a token, and blocks until one is available. This
+    lets many worker threads share a single request budget
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        assert rate > 0, "Rate must be positive"
+        self.rate: float = rate
+        # By default allow a burst of up to one second worth of requests
+        self.capacity: float = capacity if capacity is not None else max(1.0, rate)
+        self._tokens: float = self.capacity
+        self._last_refill: float = time.monotonic()
+        self._lock: Lock = Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Blocks until tokens are available, then takes them"""
+
+        assert tokens <= self.capacity, "Can never acquire more than capacity"
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            # Sleep outside of the lock so other threads can refill/check
+            time.sleep(wait)
+
+    def _refill(self) -> None:
+        """Adds tokens based on the time elapsed since the last refill"""
+
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
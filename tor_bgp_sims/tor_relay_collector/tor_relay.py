@@ -1,15 +1,21 @@
-from dataclasses import dataclass, InitVar
+import base64
+from dataclasses import dataclass, field, InitVar
 from ipaddress import ip_network, IPv4Network, IPv6Network
-from pprint import pprint, pformat
 import re
-import time
-from typing import Optional
+from typing import ClassVar, Optional
 
-import requests
 from requests_cache import CachedSession
 
 from roa_checker import ROAChecker, ROAValidity, ROARouted
 
+from .prefix_origin_cache import PrefixOriginCache
+from .prefix_origin_resolvers import (
+    PrefixOriginResolver,
+    RIPE_RELATED_PREFIXES_URL,
+    RIPEPrefixOriginResolver,
+)
+from .token_bucket import TokenBucket
+
 
 @dataclass(frozen=True, slots=True)
 class TORRelay:
@@ -80,6 +86,8 @@ class TORRelay:
     session: InitVar[CachedSession]
     roa_checker: InitVar[ROAChecker]
     a: tuple[str, ...] = ()
+    # Defaults to RIPE (using the session). Shared between threads
+    resolver: InitVar[Optional[PrefixOriginResolver]] = None
     # type ignoring since we set them in the post init always
     ipv4_prefix: IPv4Network = None  # type: ignore
     ipv4_origin: int = None  # type: ignore
@@ -90,44 +98,86 @@ class TORRelay:
     # type ignoring since we set them in post init always
     ipv6_roa_validity: ROAValidity = None  # type: ignore
     ipv6_roa_routed: ROARouted = None  # type: ignore
+    # Parsed from w once in the post init, since relays are weighted by it
+    _bandwidth_weight: int = field(init=False, repr=False, compare=False)
+
+    # Fields set in the post init, which can be reused from an unchanged relay
+    resolved_attrs: ClassVar[tuple[str, ...]] = (
+        "ipv4_prefix",
+        "ipv4_origin",
+        "ipv6_prefix",
+        "ipv6_origin",
+    )
+    # Can only be reused if the ROAs didn't change either
+    roa_attrs: ClassVar[tuple[str, ...]] = (
+        "ipv4_roa_validity",
+        "ipv4_roa_routed",
+        "ipv6_roa_validity",
+        "ipv6_roa_routed",
+    )
 
     def __post_init__(
         self,
         session: CachedSession,
         roa_checker: ROAChecker,
+        resolver: Optional[PrefixOriginResolver],
     ) -> None:
-        """Gets ASNs and ROAs for TOR relay"""
-
-        # Get ipv4 prefix origin pair
-        ipv4_prefix, ipv4_origin = self.get_prefix_origin_pair(session, self.ipv4_addr)
-        object.__setattr__(self, "ipv4_prefix", ipv4_prefix)
-        object.__setattr__(self, "ipv4_origin", ipv4_origin)
-
-        # get ipv4 roa validity and routed
-        ipv4_validity, ipv4_routed = roa_checker.get_validity(ipv4_prefix, ipv4_origin)
-        object.__setattr__(self, "ipv4_roa_validity", ipv4_validity)
-        object.__setattr__(self, "ipv4_roa_routed", ipv4_routed)
-
-        # Get ipv6 prefix origin pair
-        if self.ipv6_addr:
-            ipv6_prefix, ipv6_origin = self.get_prefix_origin_pair(
-                session, self.ipv6_addr
+        """Gets ASNs and ROAs for TOR relay
+
+        If the resolved fields are passed in (ex: the relay is unchanged since
+        the previous consensus), they're kept as is. If only the prefixes and
+        origins are passed in (ex: the ROAs changed), only the ROAs are checked
+        """
+
+        # NOTE: mypy thinks these are always set, but they're None by default
+        resolved_prefix: Optional[IPv4Network] = self.ipv4_prefix
+        resolved_validity: Optional[ROAValidity] = self.ipv4_roa_validity
+
+        if resolved_prefix is None:
+            if resolver is None:
+                resolver = RIPEPrefixOriginResolver(session)
+
+            # Get ipv4 prefix origin pair
+            ipv4_prefix, ipv4_origin = resolver.get_prefix_origin_pair(self.ipv4_addr)
+            object.__setattr__(self, "ipv4_prefix", ipv4_prefix)
+            object.__setattr__(self, "ipv4_origin", ipv4_origin)
+
+            # Get ipv6 prefix origin pair
+            if self.ipv6_addr:
+                ipv6_prefix, ipv6_origin = resolver.get_prefix_origin_pair(
+                    self.ipv6_addr
+                )
+                object.__setattr__(self, "ipv6_prefix", ipv6_prefix)
+                object.__setattr__(self, "ipv6_origin", ipv6_origin)
+            resolved_validity = None
+
+        if resolved_validity is None:
+            # get ipv4 roa validity and routed
+            ipv4_validity, ipv4_routed = roa_checker.get_validity(
+                self.ipv4_prefix, self.ipv4_origin
             )
-            object.__setattr__(self, "ipv6_prefix", ipv6_prefix)
-            object.__setattr__(self, "ipv6_origin", ipv6_origin)
+            object.__setattr__(self, "ipv4_roa_validity", ipv4_validity)
+            object.__setattr__(self, "ipv4_roa_routed", ipv4_routed)
 
             # get ipv6 roa validity and routed
-            ipv6_validity, ipv6_routed = roa_checker.get_validity(
-                ipv6_prefix, ipv6_origin
-            )
-            object.__setattr__(self, "ipv6_roa_validity", ipv6_validity)
-            object.__setattr__(self, "ipv6_roa_routed", ipv6_routed)
-        else:
-            object.__setattr__(self, "ipv6_roa_validity", ROAValidity.UNKNOWN)
-            object.__setattr__(self, "ipv6_roa_routed", ROARouted.UNKNOWN)
+            if self.ipv6_prefix and self.ipv6_origin is not None:
+                ipv6_validity, ipv6_routed = roa_checker.get_validity(
+                    self.ipv6_prefix, self.ipv6_origin
+                )
+                object.__setattr__(self, "ipv6_roa_validity", ipv6_validity)
+                object.__setattr__(self, "ipv6_roa_routed", ipv6_routed)
+            else:
+                object.__setattr__(self, "ipv6_roa_validity", ROAValidity.UNKNOWN)
+                object.__setattr__(self, "ipv6_roa_routed", ROARouted.UNKNOWN)
 
         # assert not self.ipv6_addr or ipv4_origin == ipv6_origin
 
+        assert self.w
+        assert isinstance(self.w, tuple)
+        result = re.search(r"Bandwidth=(\d+)", self.w[0])
+        assert result, str(self.w)
+        object.__setattr__(self, "_bandwidth_weight", int(result.group(1)))
+
     @property
     def ipv4_addr(self) -> IPv4Network:
         """Returns IPv4 prefix
@@ -148,6 +198,21 @@ class TORRelay:
             assert isinstance(rv, IPv6Network), "for mypy"
             return rv
 
+    @property
+    def identity(self) -> bytes:
+        """Returns the identity digest
+
+        ex: r seele AtNw etVuH1 ... where AtNw is base64 without the padding
+        """
+
+        return base64.b64decode(self.r[1] + "=")
+
+    @property
+    def fingerprint(self) -> str:
+        """Returns the relay's fingerprint (hex of the identity digest)"""
+
+        return self.identity.hex().upper()
+
     @property
     def guard(self) -> bool:
         return self.guard_relay
@@ -181,54 +246,30 @@ class TORRelay:
         Original expression is like ('Bandwidth=6000',)
         """
 
-        assert self.w
-        assert isinstance(self.w, tuple)
-        result = re.search(r"Bandwidth=(\d+)", self.w[0])
-        assert result, str(self.w)
-        return int(result.group(1))
+        return self._bandwidth_weight
 
     @staticmethod
     def get_prefix_origin_pair(
-        session: CachedSession, ip_addr: IPv4Network | IPv6Network, debug: bool = False
+        session: CachedSession,
+        ip_addr: IPv4Network | IPv6Network,
+        debug: bool = False,
+        token_bucket: Optional[TokenBucket] = None,
+        url: str = RIPE_RELATED_PREFIXES_URL,
+        max_retries: int = 6,
+        backoff_base: float = 2,
+        prefix_origin_cache: Optional[PrefixOriginCache] = None,
     ) -> tuple[IPv4Network | IPv6Network, int]:
-        """Returns ASNs and prefixesusing RIPE from a given IP addr"""
-
-        max_retries = 3
-        for i in range(1, max_retries + 1):
-            try:
-                URL = "https://stat.ripe.net/data/related-prefixes/data.json"
-                params = {"data_overload_limit": "ignore", "resource": str(ip_addr)}
-                resp = session.get(URL, params=params)
-                resp.raise_for_status()
-                break
-            except requests.exceptions.HTTPError:
-                if i == max_retries:
-                    raise
-                else:
-                    time.sleep(i * 30)
-
-        data = resp.json()
-        if debug:
-            pprint(data)
-            input()
-
-        prefix_origin_pairs = list()
-        for inner in data["data"]["prefixes"]:
-            # Sometimes API returns prefixes that don't overlap...
-            if ip_network(inner["prefix"]).overlaps(ip_addr):
-                prefix_origin_pairs.append(
-                    (ip_network(inner["prefix"]), int(inner["origin_asn"]))
-                )
-        if not prefix_origin_pairs:
-            raise Exception(f"No prefixes found for {ip_addr} {resp.url}")
-
-        # Ensure that the second most isn't the same length...
-        pairs = sorted(prefix_origin_pairs, key=lambda x: x[0].prefixlen)
+        """Returns ASNs and prefixesusing RIPE from a given IP addr
 
-        if len(pairs) > 1 and pairs[-1][0].prefixlen == pairs[-2][0].prefixlen:
-            msg = f"for {ip_addr}, need both: {pformat(resp.json(), indent=4)}"
-            print(msg)
+        See RIPEPrefixOriginResolver
+        """
 
-        resp.close()
-        # Get most specific prefix origin paid
-        return pairs[-1]
+        return RIPEPrefixOriginResolver(
+            session,
+            token_bucket=token_bucket,
+            prefix_origin_cache=prefix_origin_cache,
+            url=url,
+            max_retries=max_retries,
+            backoff_base=backoff_base,
+            debug=debug,
+        ).get_prefix_origin_pair(ip_addr)
@@ -1,8 +1,10 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
-from ipaddress import ip_network
+from ipaddress import ip_network, IPv4Network, IPv6Network
+from itertools import repeat
 from pathlib import Path
-import pickle
-from typing import Optional
+from typing import Any, Iterator, Optional
 
 import requests_cache
 from tqdm import tqdm
@@ -10,14 +12,34 @@ from tqdm import tqdm
 from roa_collector import ROACollector
 from roa_checker import ROAChecker
 
+from .consensus_parser import ConsensusFooter, ConsensusParser
+from .prefix_origin_cache import PrefixOriginCache
+from .prefix_origin_resolvers import PrefixOriginResolver, RIPEPrefixOriginResolver
+from .relay_snapshot import Relay, RelaySnapshot, SnapshotRelay
+from .roa_snapshot import ROASnapshotStore
+from .token_bucket import TokenBucket
 from .tor_relay import TORRelay
 
 
+# Relays with the same key can reuse the previously resolved prefixes/ROAs
+RelayKey = tuple[bytes, IPv4Network, Optional[IPv6Network], frozenset[str]]
+
+
 class TORRelayCollector:
     def __init__(
         self,
         requests_cache_db_path: Optional[Path] = None,
         dl_date: date | None = None,
+        max_workers: int = 8,
+        requests_per_second: float = 8,
+        prefix_origin_cache_path: Optional[Path] = None,
+        prefix_origin_cache_ttl: timedelta = timedelta(days=30),
+        resolver: Optional[PrefixOriginResolver] = None,
+        consensus_path: Optional[Path] = None,
+        consensus: Optional[ConsensusParser] = None,
+        prev_snapshot: Optional[RelaySnapshot] = None,
+        snapshot_path: Optional[Path] = None,
+        roa_snapshot_store: Optional[ROASnapshotStore] = None,
     ) -> None:
         print(dl_date)
         self.dl_date: date = dl_date if dl_date else date.today()
@@ -27,21 +49,76 @@ class TORRelayCollector:
             requests_cache_db_path = Path.home() / f"tor_bgp_sims_{self.dl_date}.db"
         self.requests_cache_db_path: Path = requests_cache_db_path
         self.session = requests_cache.CachedSession(str(self.requests_cache_db_path))
+        # RIPE lookups are IO bound, so we resolve relays with a pool of threads
+        # that all share a single rate limit
+        self.max_workers: int = max_workers
+        self.token_bucket: TokenBucket = TokenBucket(requests_per_second)
+        self.prefix_origin_cache: Optional[PrefixOriginCache] = None
+        # Defaults to RIPE. Pass in a Pfx2ASPrefixOriginResolver to run offline
+        if resolver is None:
+            # Unlike the requests cache, this isn't keyed by date, so that
+            # prefixes resolved for one consensus are reused for the next
+            if prefix_origin_cache_path is None:
+                prefix_origin_cache_path = (
+                    Path.home() / "tor_bgp_sims_prefix_origins.db"
+                )
+            self.prefix_origin_cache = PrefixOriginCache(
+                prefix_origin_cache_path, ttl=prefix_origin_cache_ttl
+            )
+            resolver = RIPEPrefixOriginResolver(
+                self.session,
+                token_bucket=self.token_bucket,
+                prefix_origin_cache=self.prefix_origin_cache,
+            )
+        self.resolver: PrefixOriginResolver = resolver
+        # Local consensus (optionally .xz), or CollecTor .tar.xz monthly archive
+        # to read instead of downloading
+        self.consensus_path: Optional[Path] = consensus_path
+        # Already opened consensus to use instead (ex: from a monthly archive)
+        self.consensus: Optional[ConsensusParser] = consensus
+        # Unchanged relays from this snapshot aren't resolved again
+        self.prev_snapshot: Optional[RelaySnapshot] = prev_snapshot
+        if snapshot_path is None:
+            snapshot_path = Path(
+                str(self.requests_cache_db_path).replace(".db", ".snapshot")
+            )
+        self.snapshot_path: Path = snapshot_path
+        # Historical ROAs for dl_date. Without this, the current ROAs are used
+        self.roa_snapshot_store: Optional[ROASnapshotStore] = roa_snapshot_store
+        # Set once the ROAs are loaded (None for the current ROAs)
+        self.roa_date: Optional[date] = None
+        # Set once the consensus has been parsed
+        self.footer: Optional[ConsensusFooter] = None
 
     def __del__(self):
         self.session.close()
+        if self.prefix_origin_cache:
+            self.prefix_origin_cache.close()
 
-    def run(self) -> tuple[TORRelay, ...]:
-        """Download TOR Relay data w/cached requests"""
+    def run(self) -> RelaySnapshot:
+        """Download TOR Relay data w/cached requests
 
-        pickle_path = Path(str(self.requests_cache_db_path).replace(".db", ".pickle"))
-        if not pickle_path.exists():
-            data = self._parse_tor_relays()
-            with pickle_path.open("wb") as f:
-                pickle.dump(data, f)
+        Returns a memory mapped snapshot, which is only rebuilt when it
+        doesn't exist yet or its format version is out of date
+        """
 
-        with pickle_path.open("rb") as f:
-            return pickle.load(f)  # type: ignore
+        snapshot_path = self.snapshot_path
+        if snapshot_path.exists():
+            try:
+                return RelaySnapshot(snapshot_path)
+            except ValueError as e:
+                print(e)
+                print("Rebuilding relay snapshot")
+
+        tor_relays = self._parse_tor_relays()
+        RelaySnapshot.write(
+            snapshot_path,
+            tor_relays,
+            dl_date=self.dl_date,
+            bandwidth_weights=self.footer.bandwidth_weights if self.footer else None,
+            roa_date=self.roa_date,
+        )
+        return RelaySnapshot(snapshot_path)
 
     def _parse_tor_relays(self) -> tuple[TORRelay, ...]:
         """Parses TOR relays from the consensus URL
@@ -49,77 +126,138 @@ class TORRelayCollector:
         See TORRelay dataclass for docs on format
         """
 
-        relevant_tor_lines: tuple[str, ...] = self._get_relevant_tor_lines()
-        raw_tor_datas = self._get_raw_tor_data(relevant_tor_lines)
-        init_vars = {"session": self.session, "roa_checker": self._init_roa_checker()}
-        tor_relays = list()
-        # NOTE: This takes about a half hour
-        # but not going to bother multiprocessing this
-        # due to rate limits and also caching - it only needs to run once
-        for x in tqdm(raw_tor_datas, total=len(raw_tor_datas), desc="Parsing TOR"):
-            try:
-                tor_relays.append(TORRelay(**(x | init_vars)))
-            except Exception as e:
-                print(e)
-                print("Failed to parse relay, continuing")
+        init_vars = {
+            "session": self.session,
+            "roa_checker": self._init_roa_checker(),
+            "resolver": self.resolver,
+        }
+        prev_relays: dict[RelayKey, SnapshotRelay] = dict()
+        reused_attrs: tuple[str, ...] = TORRelay.resolved_attrs
+        if self.prev_snapshot is not None:
+            prev_relays = {self._get_relay_key(x): x for x in self.prev_snapshot}
+            # ROA validity is only reused if the ROAs are the same
+            if self.prev_snapshot.roa_date == self.roa_date:
+                reused_attrs += TORRelay.roa_attrs
+        # NOTE: This used to take about a half hour serially. Now the RIPE lookups
+        # run concurrently, bounded by max_workers and the shared token bucket.
+        # executor.map returns results in the same order as the consensus
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(
+                self._get_tor_relay,
+                self._get_raw_tor_datas(),
+                repeat(init_vars),
+                repeat(prev_relays),
+                repeat(reused_attrs),
+            )
+            tor_relays = [x for x in tqdm(results, desc="Parsing TOR") if x]
         return tuple(tor_relays)
 
-    def _get_relevant_tor_lines(self) -> tuple[str, ...]:
-        """Returns the relevant lines from TOR consensus"""
+    def _get_tor_relay(
+        self,
+        raw_tor_data: dict[str, tuple[str, ...]],
+        init_vars: dict[str, Any],
+        prev_relays: dict[RelayKey, SnapshotRelay],
+        reused_attrs: tuple[str, ...],
+    ) -> Optional[TORRelay]:
+        """Returns a TORRelay, or None if it failed to parse
+
+        Relays with the same fingerprint, IPs, and flags as in the previous
+        snapshot reuse the resolved prefixes and origins (and ROA validity,
+        if the ROAs are the same)
+        """
 
         try:
-            resp = self.session.get(self._get_tor_relay_url())
-            resp.raise_for_status()
+            prev_relay = prev_relays.get(self._get_raw_relay_key(raw_tor_data))
+            if prev_relay:
+                init_vars = init_vars | {
+                    attr: getattr(prev_relay, attr) for attr in reused_attrs
+                }
+            return TORRelay(**(raw_tor_data | init_vars))
         except Exception as e:
             print(e)
-            print("Consensus not posted for current day, using previous")
-            self.dl_date = self.dl_date - timedelta(days=1)
-            resp = self.session.get(self._get_tor_relay_url())
-            resp.raise_for_status()
-
-        relevant_lines: list[str] = list()
-
-        relevant_line = False
-        for line in resp.text.split("\n"):
-            if line.startswith("r "):
-                relevant_line = True
-            elif line.startswith("directory-footer"):
-                assert relevant_lines, "Didn't parse any TOR lines"
-                return tuple(relevant_lines)
-            if relevant_line:
-                relevant_lines.append(line)
-        raise NotImplementedError("Never reached directory footer")
+            print("Failed to parse relay, continuing")
+            return None
+
+    @staticmethod
+    def _get_relay_key(relay: Relay) -> RelayKey:
+        """Returns the fields that, if unchanged, mean the relay can be reused"""
+
+        return (relay.identity, relay.ipv4_addr, relay.ipv6_addr, frozenset(relay.s))
+
+    @staticmethod
+    def _get_raw_relay_key(raw_tor_data: dict[str, tuple[str, ...]]) -> RelayKey:
+        """Same as _get_relay_key, but from the raw data, before resolving"""
+
+        r = raw_tor_data["r"]
+        ipv4_addr = ip_network(r[5])
+        assert isinstance(ipv4_addr, IPv4Network), "for mypy"
+        ipv6_addr: Optional[IPv6Network] = None
+        if raw_tor_data.get("a"):
+            ipv6_network = ip_network(raw_tor_data["a"][0].split("]")[0][1:])
+            assert isinstance(ipv6_network, IPv6Network), "for mypy"
+            ipv6_addr = ipv6_network
+        identity = base64.b64decode(r[1] + "=")
+        return (identity, ipv4_addr, ipv6_addr, frozenset(raw_tor_data.get("s", ())))
+
+    def _get_raw_tor_datas(self) -> Iterator[dict[str, tuple[str, ...]]]:
+        """Streams raw TOR data for each relay, then sets the footer
+
+        See ConsensusParser for the format
+        """
+
+        if self.consensus:
+            consensus = self.consensus
+        elif self.consensus_path and self.consensus_path.name.endswith(".tar.xz"):
+            consensus_name = self._get_consensus_name()
+            # NOTE: keep a reference, since the archive closes once this is freed
+            archive = ConsensusParser.iter_archive(self.consensus_path)
+            for consensus in archive:
+                if consensus.name == consensus_name:
+                    break
+            else:
+                raise ValueError(f"{consensus_name} not in {self.consensus_path}")
+        elif self.consensus_path:
+            consensus = ConsensusParser.from_path(self.consensus_path)
+        else:
+            try:
+                consensus = ConsensusParser.from_url(
+                    self.session, self._get_tor_relay_url()
+                )
+            except Exception as e:
+                print(e)
+                print("Consensus not posted for current day, using previous")
+                self.dl_date = self.dl_date - timedelta(days=1)
+                consensus = ConsensusParser.from_url(
+                    self.session, self._get_tor_relay_url()
+                )
+        yield from consensus
+        self.footer = consensus.footer
 
     def _get_tor_relay_url(self) -> str:
         """Returns TOR relay URL with todays date. Old dates aren't saved here"""
 
         return (
             "https://collector.torproject.org/recent/relay-descriptors/consensuses/"
-            f"{self.dl_date.strftime('%Y-%m-%d-01-00-00')}-consensus"
+            f"{self._get_consensus_name()}"
         )
 
-    def _get_raw_tor_data(
-        self, relevant_lines: tuple[str, ...]
-    ) -> tuple[dict[str, tuple[str, ...]], ...]:
-        """Gets raw TOR data from relevant parsed lines"""
+    def _get_consensus_name(self) -> str:
+        """Returns the file name of the consensus for dl_date"""
 
-        raw_tor_data: list[dict[str, list[str]]] = list()
-        for line in relevant_lines:
-            sections = line.split()
-            if sections[0] == "r":
-                raw_tor_data.append(dict())
-            try:
-                raw_tor_data[-1][sections[0]] = sections[1:]
-            except IndexError:
-                print(sections)
-                raise
-        return tuple([{k: tuple(v) for k, v in x.items()} for x in raw_tor_data])
+        return f"{self.dl_date.strftime('%Y-%m-%d-01-00-00')}-consensus"
 
     def _init_roa_checker(self) -> ROAChecker:
-        """Downloads ROAs and returns ROAChecker"""
+        """Downloads ROAs and returns ROAChecker
+
+        If there's a ROA snapshot store, uses the historical ROAs for dl_date
+        """
+
+        if self.roa_snapshot_store:
+            self.roa_date = self.roa_snapshot_store.get_vrp_date(self.dl_date)
+            return self.roa_snapshot_store.get_roa_checker(self.dl_date)
 
         roa_checker = ROAChecker()
-        # TODO: Change this to historical roas
+        # NOTE: Pass in a ROASnapshotStore for historical roas
         for roa in ROACollector(
             csv_path=None, requests_cache_db_path=self.requests_cache_db_path
         ).run():
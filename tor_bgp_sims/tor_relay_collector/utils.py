@@ -1,12 +1,14 @@
 from collections import Counter
 from pprint import pprint
+from typing import Literal, Mapping, Sequence, Union
 
 from frozendict import frozendict
 
 from bgpy.simulation_engine import Policy
 from roa_checker import ROAValidity
 
-from .tor_relay import TORRelay
+from .relay_index import RelayClass, RelayIndex
+from .relay_snapshot import Relay
 from .tor_relay_collector import TORRelayCollector
 from ..policies import (
     GuardValid24,
@@ -20,28 +22,30 @@ from ..policies import (
 
 
 def get_tor_relay_groups(
-    relays: tuple[TORRelay, ...] = ()
-) -> frozendict[type[Policy], tuple[TORRelay, ...]]:
+    relays: Sequence[Relay] = (),
+) -> frozendict[type[Policy], tuple[Relay, ...]]:
     """Returns TOR relay groups"""
 
     if not relays:
         relays = TORRelayCollector().run()
+    relay_index = RelayIndex(relays)
 
+    # NOTE: These are for the destinations, they don't affect the exit!
+    exits = relay_index.get_relays(RelayClass.EXIT)
     return frozendict(
         {
-            GuardValid24: get_guard_valid_ipv4_len_24(relays),
-            GuardValidNot24: get_guard_valid_ipv4_len_lt_24(relays),
-            GuardNotValid24: get_guard_not_valid_ipv4_len_24(relays),
-            GuardNotValidNot24: get_guard_not_valid_ipv4_len_lt_24(relays),
-            # NOTE: These are for the destinations, they don't affect the exit!
-            Dest24: tuple([x for x in relays if x.exit]),
-            DestValidNot24: tuple([x for x in relays if x.exit]),
-            DestNotValidNot24: tuple([x for x in relays if x.exit]),
+            GuardValid24: get_guard_valid_ipv4_len_24(relay_index),
+            GuardValidNot24: get_guard_valid_ipv4_len_lt_24(relay_index),
+            GuardNotValid24: get_guard_not_valid_ipv4_len_24(relay_index),
+            GuardNotValidNot24: get_guard_not_valid_ipv4_len_lt_24(relay_index),
+            Dest24: exits,
+            DestValidNot24: exits,
+            DestNotValidNot24: exits,
         }
     )
 
 
-def print_relay_stats(relays: tuple[TORRelay, ...]):
+def print_relay_stats(relays: Sequence[Relay]):
     versions = [x.version for x in relays]
     version_freq_dict = dict(Counter(versions))
 
@@ -266,63 +270,65 @@ def print_relay_stats(relays: tuple[TORRelay, ...]):
     )
 
 
-def get_guard_valid_ipv4_len_24(relays: tuple[TORRelay, ...]) -> tuple[TORRelay, ...]:
+def get_guard_valid_ipv4_len_24(
+    relays: Union[Sequence[Relay], RelayIndex],
+) -> tuple[Relay, ...]:
     """Returns guard relays valid by ROA with a /24 IPV4 prefix"""
 
-    rv = list()
-    for x in relays:
-        if (
-            x.guard
-            and ROAValidity.is_valid(x.ipv4_roa_validity)
-            and x.ipv4_prefix.prefixlen == 24
-        ):
-            rv.append(x)
-    return tuple(rv)
+    return _get_relay_index(relays).get_relays(
+        RelayClass.GUARD | RelayClass.IPV4_VALID | RelayClass.IPV4_LEN_24
+    )
 
 
 def get_guard_valid_ipv4_len_lt_24(
-    relays: tuple[TORRelay, ...]
-) -> tuple[TORRelay, ...]:
+    relays: Union[Sequence[Relay], RelayIndex],
+) -> tuple[Relay, ...]:
     """Returns guard relays valid by ROA with a < /24 IPV4 prefix"""
 
-    rv = list()
-    for x in relays:
-        if (
-            x.guard
-            and ROAValidity.is_valid(x.ipv4_roa_validity)
-            and x.ipv4_prefix.prefixlen < 24
-        ):
-            rv.append(x)
-    return tuple(rv)
+    return _get_relay_index(relays).get_relays(
+        RelayClass.GUARD | RelayClass.IPV4_VALID | RelayClass.IPV4_LEN_LT_24
+    )
 
 
 def get_guard_not_valid_ipv4_len_24(
-    relays: tuple[TORRelay, ...]
-) -> tuple[TORRelay, ...]:
+    relays: Union[Sequence[Relay], RelayIndex],
+) -> tuple[Relay, ...]:
     """Returns guard relays not valid by ROA with a /24 IPV4 prefix"""
 
-    rv = list()
-    for x in relays:
-        if (
-            x.guard
-            and (not ROAValidity.is_valid(x.ipv4_roa_validity))
-            and x.ipv4_prefix.prefixlen == 24
-        ):
-            rv.append(x)
-    return tuple(rv)
+    return _get_relay_index(relays).get_relays(
+        RelayClass.GUARD | RelayClass.IPV4_LEN_24, excluded=RelayClass.IPV4_VALID
+    )
 
 
 def get_guard_not_valid_ipv4_len_lt_24(
-    relays: tuple[TORRelay, ...]
-) -> tuple[TORRelay, ...]:
+    relays: Union[Sequence[Relay], RelayIndex],
+) -> tuple[Relay, ...]:
     """Returns guard relays not valid by ROA with a < /24 IPV4 prefix"""
 
-    rv = list()
-    for x in relays:
-        if (
-            x.guard
-            and (not ROAValidity.is_valid(x.ipv4_roa_validity))
-            and x.ipv4_prefix.prefixlen < 24
-        ):
-            rv.append(x)
-    return tuple(rv)
+    return _get_relay_index(relays).get_relays(
+        RelayClass.GUARD | RelayClass.IPV4_LEN_LT_24, excluded=RelayClass.IPV4_VALID
+    )
+
+
+def get_position_bandwidth_weight(
+    relay: Relay,
+    position: Literal["guard", "exit"],
+    bandwidth_weights: Mapping[str, int],
+) -> float:
+    """Returns how likely clients are to pick the relay for a position
+
+    This is the relay's bandwidth scaled by the consensus bandwidth-weights
+    for the position (Wgg/Wgd for guards, Wee/Wed for exits, out of 10000),
+    which is how clients weigh relays in path selection. Missing weights
+    default to 10000 (ex: older snapshots without the footer)
+    """
+
+    if position == "guard":
+        key = "Wgd" if relay.exit else "Wgg"
+    else:
+        key = "Wed" if relay.guard else "Wee"
+    return relay.bandwidth_weight * bandwidth_weights.get(key, 10000) / 10000
+
+
+def _get_relay_index(relays: Union[Sequence[Relay], RelayIndex]) -> RelayIndex:
+    return relays if isinstance(relays, RelayIndex) else RelayIndex(relays)
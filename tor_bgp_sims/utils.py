@@ -1,8 +1,14 @@
+from array import array
+import hashlib
+from itertools import compress, repeat
 import json
+from operator import lt, mul
 from pathlib import Path
 import random
 import os
-from typing import Optional
+import struct
+import sys
+from typing import Callable, Optional
 
 from frozendict import frozendict
 
@@ -17,34 +23,136 @@ class RealROVSimplePolicy(ROVSimplePolicy):
     name = "RealROV"
 
 
+class RealWorldROV:
+    """The ASes that deploy ROV in the real world, and how likely each one is
+
+    rov_info.json is compiled once into an array of ASNs and an array of the
+    max percent of each one, which are cached next to it (and recompiled
+    when it changes), so drawing a deployment doesn't parse the JSON again.
+
+    Each draw of the ASes that deploy ROV (see draw) is a chain of C
+    iterators, rather than a Python loop over the ASes, so it's cheap enough
+    to draw a new deployment for every trial
+    """
+
+    MAGIC: bytes = b"TORROV"
+    # Bump this whenever the layout changes
+    FORMAT_VERSION: int = 1
+    # magic, format version, number of ASes, then the ASNs and percents
+    HEADER: struct.Struct = struct.Struct("<6sHQ")
+
+    def __init__(self, asns: "array[int]", percents: "array[float]") -> None:
+        assert len(asns) == len(percents), "Each ASN needs a percent"
+        self.asns: "array[int]" = asns
+        # Max percent (0-100) of each ASN, in the same order as the JSON
+        self.percents: "array[float]" = percents
+        self.digest: str = hashlib.sha256(
+            asns.tobytes() + percents.tobytes()
+        ).hexdigest()
+
+    def __repr__(self) -> str:
+        # So that the checkpoints depend on the deployment probabilities
+        return f"{self.__class__.__name__}(sha256={self.digest})"
+
+    @classmethod
+    def from_json(
+        cls,
+        json_path: Path = Path.home() / "Desktop" / "rov_info.json",
+        requests_cache_db_path: Optional[Path] = None,
+    ) -> "RealWorldROV":
+        """Returns the compiled rov_info.json, collecting it if needed"""
+
+        if not json_path.exists():
+            for CollectorCls in rov_collector_classes:
+                CollectorCls(
+                    json_path=json_path,
+                    requests_cache_db_path=requests_cache_db_path,
+                ).run()  # type: ignore
+
+        cache_path = json_path.with_suffix(".rov")
+        if (
+            cache_path.exists()
+            and cache_path.stat().st_mtime >= json_path.stat().st_mtime
+        ):
+            try:
+                return cls.read(cache_path)
+            # ex: from an older version, or cut short
+            except (EOFError, ValueError, struct.error) as e:
+                print(f"{e}, so recompiling {json_path}")
+
+        with json_path.open() as f:
+            data = json.load(f)
+        asns = array("q")
+        percents = array("d")
+        for asn, info_list in data.items():
+            asns.append(int(asn))
+            percents.append(max((float(x["percent"]) for x in info_list), default=0))
+        real_world_rov = cls(asns, percents)
+        real_world_rov.write(cache_path)
+        return real_world_rov
+
+    @classmethod
+    def read(cls, path: Path) -> "RealWorldROV":
+        with path.open("rb") as f:
+            magic, format_version, num_asns = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC or format_version != cls.FORMAT_VERSION:
+                raise ValueError(f"{path} isn't ROV format {cls.FORMAT_VERSION}")
+            asns = array("q")
+            asns.fromfile(f, num_asns)
+            percents = array("d")
+            percents.fromfile(f, num_asns)
+        if sys.byteorder != "little":
+            asns.byteswap()
+            percents.byteswap()
+        return cls(asns, percents)
+
+    def write(self, path: Path) -> None:
+        asns, percents = array("q", self.asns), array("d", self.percents)
+        if sys.byteorder != "little":
+            asns.byteswap()
+            percents.byteswap()
+        # Written in full before it's moved, so a crash never leaves half of one
+        tmp_path = path.with_suffix(".tmp")
+        with tmp_path.open("wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.FORMAT_VERSION, len(asns)))
+            asns.tofile(f)
+            percents.tofile(f)
+        os.replace(tmp_path, path)
+
+    def draw(
+        self, random_func: Callable[[], float] = random.random
+    ) -> frozendict[int, type[RealROVSimplePolicy]]:
+        """Returns a random deployment, with each AS deploying at its percent
+
+        This uses one random number for each AS, in the order of the JSON,
+        so for the same random state, it's the same as it's always been
+        """
+
+        # Each AS deploys if random_func() * 100 < its percent
+        deploys = map(
+            lt, map(mul, iter(random_func, -1.0), repeat(100.0)), self.percents
+        )
+        return frozendict(
+            dict.fromkeys(compress(self.asns, deploys), RealROVSimplePolicy)
+        )
+
+
 def get_real_world_rov_asn_cls_dict(
     json_path: Path = Path.home() / "Desktop" / "rov_info.json",
     requests_cache_db_path: Optional[Path] = None,
 ) -> frozendict[int, type[RealROVSimplePolicy]]:
-    if not json_path.exists():
-        for CollectorCls in rov_collector_classes:
-            CollectorCls(
-                json_path=json_path,
-                requests_cache_db_path=requests_cache_db_path,
-            ).run()  # type: ignore
+    """Returns one random deployment of real world ROV (see RealWorldROV)
+
+    This is seeded by the PYTHONHASHSEED, so it's the same for every run
+    """
+
+    real_world_rov = RealWorldROV.from_json(json_path, requests_cache_db_path)
 
     python_hash_seed = os.environ.get("PYTHONHASHSEED")
     if python_hash_seed:
         random.seed(int(python_hash_seed))
 
-    with json_path.open() as f:
-        data = json.load(f)
-        hardcoded_dict = dict()
-        for asn, info_list in data.items():
-            max_percent: float = 0
-            # Calculate max_percent for each ASN
-            for info in info_list:
-                max_percent = max(max_percent, float(info["percent"]))
-
-            # Use max_percent as the probability for inclusion
-            if random.random() * 100 < max_percent:
-                hardcoded_dict[int(asn)] = RealROVSimplePolicy
-    return frozendict(hardcoded_dict)
+    return real_world_rov.draw()
 
 
 def get_us_country_asns() -> frozenset[int]: